@@ -0,0 +1,50 @@
+"""
+Action item endpoints (batch create / batch completion)
+"""
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from app.db.database import get_db
+from app.schemas.schemas import (
+    ActionItemBatchCreate, ActionItemResponse, ActionItemBatchUpdate, ActionItemBatchUpdateResponse
+)
+from app.models.models import DiagnosisRecord
+from app.crud import crud
+
+router = APIRouter()
+
+
+@router.post("/diagnoses/{diagnosis_id}/action-items", response_model=List[ActionItemResponse], status_code=201)
+async def create_action_items(
+    diagnosis_id: int,
+    payload: ActionItemBatchCreate,
+    db: Session = Depends(get_db)
+):
+    """
+    Create all recommended actions of a diagnosis in one transaction
+    """
+    exists = db.query(DiagnosisRecord.id).filter(DiagnosisRecord.id == diagnosis_id).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Diagnosis not found")
+    
+    return crud.create_action_items(db, diagnosis_id, [item.model_dump() for item in payload.items])
+
+
+@router.patch("/action-items", response_model=ActionItemBatchUpdateResponse)
+async def update_action_items(payload: ActionItemBatchUpdate, db: Session = Depends(get_db)):
+    """
+    Mark many action items as completed / pending in one transaction
+    
+    Si un id aparece varias veces gana la última actualización. NAS se
+    actualiza en la misma transacción.
+    """
+    updates = {update.id: update.is_completed for update in payload.updates}
+    updated, not_found = crud.update_action_items_status(db, updates)
+    
+    skipped = set(updated) | set(not_found)
+    return ActionItemBatchUpdateResponse(
+        updated=updated,
+        unchanged=sorted(action_id for action_id in updates if action_id not in skipped),
+        not_found=not_found
+    )
@@ -6,30 +6,179 @@ Proporciona estadísticas avanzadas:
 - Diagnósticos más comunes
 - Mapa de calor por ubicación
 - Tendencias temporales
+- Dispositivos únicos y percentiles de confianza (sketches aproximados)
+- Calibración del modelo a partir del feedback
+
+Todos los endpoints aceptan los mismos filtros (since, until, category,
+issue, location_prefix, min_confidence, max_confidence); ver
+app/services/analytics_filters.py.
+
+frequent-issues y trends suman los meses archivados en Parquet; unique-devices
+y confidence-percentiles leen los sketches, que los conservan; el resto
+cubre solo la tabla caliente.
+
+Con shards regionales las agregaciones sobre diagnosis_records se calculan
+como conteos y sumas parciales en cada base y se combinan aquí; usuarios,
+sketches y archivo viven solo en la principal.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, case
 from typing import List, Dict, Optional
-from datetime import datetime, timedelta
-from app.db.database import get_db
+from datetime import datetime, timedelta, timezone
+from app.db.deadlines import read_db_with_deadline, compute_or_stale
 from app.models.models import DiagnosisRecord, User
 from app.core.security import get_current_technician
 from app.schemas.schemas import UserRead
+from app.crud import crud
+from app.core.config import settings
+from app.core.cache import WatermarkCache
+from app.core.responses import CachedJSONResponse, dumps
+from app.services import archive
+from app.services.analytics_filters import AnalyticsFilters
+from app.db.shards import shard_router, merge_sums
+
+# Resultados reutilizados mientras no se ingieran diagnósticos nuevos
+calibration_cache = WatermarkCache("calibration")
+# Cuerpos JSON ya serializados de las respuestas grandes (heatmap, trends)
+response_cache = WatermarkCache("analytics_responses")
 
 router = APIRouter()
 
 
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Los timestamps se guardan en UTC sin zona horaria
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def get_analytics_filters(
+    since: Optional[datetime] = Query(None, description="Desde (ISO 8601, incluido)"),
+    until: Optional[datetime] = Query(None, description="Hasta (ISO 8601, excluido)"),
+    category: Optional[str] = Query(None, description="Categoría del dashboard"),
+    issue: Optional[List[str]] = Query(None, description="Problema detectado (se puede repetir)"),
+    location_prefix: Optional[str] = Query(None, min_length=1, description="Prefijo de ubicación"),
+    min_confidence: Optional[float] = Query(None, ge=0, le=1, description="Confianza mínima"),
+    max_confidence: Optional[float] = Query(None, ge=0, le=1, description="Confianza máxima"),
+) -> AnalyticsFilters:
+    """
+    Filters shared by every analytics endpoint
+    """
+    since, until = _naive_utc(since), _naive_utc(until)
+    if category is not None and category not in crud.CATEGORIES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Categoría inválida; opciones: {', '.join(crud.CATEGORIES)}"
+        )
+    if since is not None and until is not None and since >= until:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="since debe ser anterior a until")
+    if min_confidence is not None and max_confidence is not None and min_confidence > max_confidence:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="min_confidence no puede ser mayor que max_confidence"
+        )
+    return AnalyticsFilters(since, until, category, issue, location_prefix, min_confidence, max_confidence)
+
+
+def _hot_snapshot(db: Session):
+    """
+    Columnar view of the hot table, unless an archive delete is half done
+    """
+    if not settings.COLUMNAR_STORE_ENABLED or archive.deleting_in_progress():
+        return None
+    from app.services import columnar_store  # NumPy, solo con el almacén activo
+    
+    return columnar_store.get_snapshot(db)
+
+
+def _gather_sums(db: Session, primary_fn, shard_fn) -> dict:
+    """
+    Partial {key: [numbers...]} from the primary plus every regional shard, added up
+    """
+    if not shard_router.enabled:
+        return primary_fn(db)
+    return merge_sums(shard_router.scatter(db, lambda session, _: shard_fn(session), primary_fn).values())
+
+
+def _hot_issue_totals(db: Session, filters: AnalyticsFilters, where: list) -> Dict[str, list]:
+    """
+    {issue: [count, confidence_sum]} of the hot diagnoses that pass the filters
+    """
+    snapshot = _hot_snapshot(db)
+    if snapshot is not None:
+        return snapshot.issue_totals(filters)
+    return _sql_issue_totals(db, where + archive.hot_exclusions())
+
+
+def _sql_issue_totals(db: Session, where=()) -> Dict[str, list]:
+    query = db.query(
+        DiagnosisRecord.detected_issue,
+        func.count(DiagnosisRecord.id),
+        func.sum(DiagnosisRecord.confidence)
+    ).filter(*where)
+    
+    return {
+        issue: [count, conf_sum or 0.0]
+        for issue, count, conf_sum in query.group_by(DiagnosisRecord.detected_issue).all()
+    }
+
+
+def _hot_trend_counts(db: Session, filters: AnalyticsFilters, where: list, interval: str) -> Dict[str, List[int]]:
+    """
+    {date_key: per-category counts} of the hot diagnoses that pass the filters
+    """
+    snapshot = _hot_snapshot(db)
+    if snapshot is not None:
+        return snapshot.trend_counts(filters, interval)
+    return _sql_trend_counts(db, interval, where + archive.hot_exclusions())
+
+
+def _sql_trend_counts(db: Session, interval: str, where=()) -> Dict[str, List[int]]:
+    rows = db.query(DiagnosisRecord.timestamp, DiagnosisRecord.detected_issue)\
+        .filter(*where)\
+        .all()
+    
+    counts = {}
+    for timestamp, detected_issue in rows:
+        # Determinar la clave de fecha según el intervalo
+        if interval == "day":
+            date_key = timestamp.strftime("%Y-%m-%d")
+        elif interval == "week":
+            # Primer día de la semana
+            date_key = (timestamp - timedelta(days=timestamp.weekday())).strftime("%Y-%m-%d")
+        else:  # month
+            date_key = timestamp.strftime("%Y-%m")
+        
+        row = counts.setdefault(date_key, [0] * len(crud.CATEGORIES))
+        row[crud.CATEGORIES.index(crud.categorize_issue(detected_issue))] += 1
+    
+    return counts
+
+
+def _cached_json(db: Session, key, compute) -> CachedJSONResponse:
+    """
+    Serve ``compute()`` serialized once per ingest watermark
+    
+    La respuesta sale como bytes: sin jsonable_encoder ni json.dumps por request.
+    Si la consulta se pasa del presupuesto de la ruta se responde el último
+    resultado calculado, marcado con ``X-Degraded: stale``.
+    """
+    body, stale = compute_or_stale(response_cache, db, key, lambda: dumps(compute()))
+    return CachedJSONResponse(body, headers={"X-Degraded": "stale"} if stale else None)
+
+
 # ============================================================================
 # ENDPOINT 1: Diagnósticos Más Frecuentes
 # ============================================================================
 
 @router.get("/frequent-issues")
-async def get_frequent_issues(
+def get_frequent_issues(
     limit: int = Query(10, ge=1, le=50, description="Número de resultados"),
     days: Optional[int] = Query(None, ge=1, le=365, description="Últimos N días"),
-    db: Session = Depends(get_db),
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("frequent-issues")),
     current_user: UserRead = Depends(get_current_technician)
 ):
     """
@@ -52,33 +201,32 @@ async def get_frequent_issues(
     }
     ```
     """
-    # Construir query base
-    query = db.query(
-        DiagnosisRecord.detected_issue,
-        func.count(DiagnosisRecord.id).label('count'),
-        func.avg(DiagnosisRecord.confidence).label('avg_confidence')
-    )
-    
-    # Filtrar por fecha si se especificó
-    if days:
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        query = query.filter(DiagnosisRecord.timestamp >= cutoff_date)
-    
-    # Agrupar y ordenar
-    results = query.group_by(DiagnosisRecord.detected_issue)\
-                   .order_by(desc('count'))\
-                   .limit(limit)\
-                   .all()
+    cutoff_date = datetime.utcnow() - timedelta(days=days) if days else None
+    filters = filters.narrowed(cutoff_date)
+    where = filters.predicates(db)
     
-    # Calcular total
-    total_query = db.query(func.count(DiagnosisRecord.id))
-    if days:
-        total_query = total_query.filter(DiagnosisRecord.timestamp >= cutoff_date)
-    total_diagnoses = total_query.scalar()
+    # Tabla caliente + meses archivados en Parquet
+    totals = _gather_sums(
+        db,
+        lambda session: _hot_issue_totals(session, filters, where),
+        lambda session: _sql_issue_totals(session, where)
+    )
+    totals = archive.add_issue_totals(totals, filters)
+    if crud.ISSUE_REPLACEMENTS:
+        # Filas aún no reescritas por una re-categorización en curso
+        merged: Dict[str, list] = {}
+        for issue, (count, conf_sum) in totals.items():
+            entry = merged.setdefault(crud.canonical_issue(issue), [0, 0.0])
+            entry[0] += count
+            entry[1] += conf_sum
+        totals = merged
+    total_diagnoses = sum(count for count, _ in totals.values())
     
-    # Formatear respuesta
+    # Ordenar y formatear respuesta
+    ranked = sorted(totals.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
     issues = []
-    for issue, count, avg_conf in results:
+    for issue, (count, conf_sum) in ranked:
+        avg_conf = conf_sum / count if count else 0
         issues.append({
             "issue": issue,
             "count": count,
@@ -98,8 +246,9 @@ async def get_frequent_issues(
 # ============================================================================
 
 @router.get("/heatmap")
-async def get_location_heatmap(
-    db: Session = Depends(get_db),
+def get_location_heatmap(
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("heatmap")),
     current_user: UserRead = Depends(get_current_technician)
 ):
     """
@@ -120,7 +269,65 @@ async def get_location_heatmap(
         ]
     }
     ```
+    
+    Solo cubre la tabla caliente: los meses archivados en Parquet no entran.
     """
+    return _cached_json(db, ("heatmap", filters.key()), lambda: _compute_heatmap(db, filters))
+
+
+def _location_issue_totals(db: Session, where=()) -> Dict[tuple, list]:
+    """
+    {(location, issue): [count, confidence_sum]}, the combinable part of the heatmap
+    """
+    rows = db.query(
+        DiagnosisRecord.location,
+        DiagnosisRecord.detected_issue,
+        func.count(DiagnosisRecord.id),
+        func.sum(DiagnosisRecord.confidence)
+    ).filter(
+        DiagnosisRecord.location.isnot(None),
+        DiagnosisRecord.location != '',
+        *where
+    ).group_by(DiagnosisRecord.location, DiagnosisRecord.detected_issue).all()
+    return {(location, issue): [count, conf_sum or 0.0] for location, issue, count, conf_sum in rows}
+
+
+def _sharded_heatmap(db: Session, where: list) -> dict:
+    by_location: Dict[str, list] = {}
+    for (location, issue), (count, conf_sum) in merge_sums(
+        shard_router.scatter(db, lambda session, _: _location_issue_totals(session, where)).values()
+    ).items():
+        entry = by_location.setdefault(location, [0, 0.0, {}])
+        entry[0] += count
+        entry[1] += conf_sum
+        entry[2][issue] = count
+    
+    locations = [
+        {
+            "location": location,
+            "diagnoses_count": count,
+            "most_common_issue": min(issues, key=lambda issue: (-issues[issue], issue)),
+            "avg_confidence": round(conf_sum / count, 3) if conf_sum else 0
+        }
+        for location, (count, conf_sum, issues) in by_location.items()
+    ]
+    locations.sort(key=lambda x: (-x["diagnoses_count"], x["location"]))
+    
+    return {
+        "total_locations": len(locations),
+        "locations": locations
+    }
+
+
+def _compute_heatmap(db: Session, filters: AnalyticsFilters) -> dict:
+    where = filters.predicates(db)
+    if shard_router.enabled:
+        return _sharded_heatmap(db, where)
+    
+    snapshot = _hot_snapshot(db)
+    if snapshot is not None:
+        return snapshot.heatmap(filters)
+    
     # Query por ubicación
     results = db.query(
         DiagnosisRecord.location,
@@ -128,20 +335,21 @@ async def get_location_heatmap(
         func.avg(DiagnosisRecord.confidence).label('avg_confidence')
     ).filter(
         DiagnosisRecord.location.isnot(None),
-        DiagnosisRecord.location != ''
+        DiagnosisRecord.location != '',
+        *where
     ).group_by(
         DiagnosisRecord.location
     ).order_by(
-        desc('count')
+        desc('count'), DiagnosisRecord.location
     ).all()
     
     locations = []
     for location, count, avg_conf in results:
         # Obtener el problema más común en esta ubicación
         most_common = db.query(DiagnosisRecord.detected_issue)\
-            .filter(DiagnosisRecord.location == location)\
+            .filter(DiagnosisRecord.location == location, *where)\
             .group_by(DiagnosisRecord.detected_issue)\
-            .order_by(desc(func.count()))\
+            .order_by(desc(func.count()), DiagnosisRecord.detected_issue)\
             .first()
         
         locations.append({
@@ -162,10 +370,11 @@ async def get_location_heatmap(
 # ============================================================================
 
 @router.get("/trends")
-async def get_temporal_trends(
+def get_temporal_trends(
     days: int = Query(30, ge=7, le=365, description="Período de análisis"),
     interval: str = Query("day", regex="^(day|week|month)$"),
-    db: Session = Depends(get_db),
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("trends")),
     current_user: UserRead = Depends(get_current_technician)
 ):
     """
@@ -192,48 +401,31 @@ async def get_temporal_trends(
     }
     ```
     """
-    from app.crud.crud import categorize_issue
-    
+    return _cached_json(
+        db, ("trends", days, interval, filters.key()), lambda: compute_trends(db, days, interval, filters)
+    )
+
+
+def compute_trends(db: Session, days: int, interval: str, filters: Optional[AnalyticsFilters] = None) -> dict:
     cutoff_date = datetime.utcnow() - timedelta(days=days)
+    filters = (filters or AnalyticsFilters()).narrowed(cutoff_date)
+    where = filters.predicates(db)
     
-    # Obtener todos los diagnósticos en el período
-    diagnoses = db.query(DiagnosisRecord)\
-        .filter(DiagnosisRecord.timestamp >= cutoff_date)\
-        .order_by(DiagnosisRecord.timestamp)\
-        .all()
-    
-    # Agrupar por intervalo
-    data_points = {}
-    
-    for diagnosis in diagnoses:
-        # Determinar la clave de fecha según el intervalo
-        if interval == "day":
-            date_key = diagnosis.timestamp.strftime("%Y-%m-%d")
-        elif interval == "week":
-            # Primera día de la semana
-            week_start = diagnosis.timestamp - timedelta(days=diagnosis.timestamp.weekday())
-            date_key = week_start.strftime("%Y-%m-%d")
-        else:  # month
-            date_key = diagnosis.timestamp.strftime("%Y-%m")
-        
-        # Inicializar si no existe
-        if date_key not in data_points:
-            data_points[date_key] = {
-                "date": date_key,
-                "total_diagnoses": 0,
-                "by_category": {
-                    "Deficiencias Nutricionales": 0,
-                    "Enfermedades": 0,
-                    "Plagas": 0,
-                    "Planta Saludable": 0,
-                    "Otros": 0
-                }
-            }
-        
-        # Incrementar contadores
-        data_points[date_key]["total_diagnoses"] += 1
-        category = categorize_issue(diagnosis.detected_issue)
-        data_points[date_key]["by_category"][category] += 1
+    # Tabla caliente + meses archivados en Parquet
+    counts = _gather_sums(
+        db,
+        lambda session: _hot_trend_counts(session, filters, where, interval),
+        lambda session: _sql_trend_counts(session, interval, where)
+    )
+    counts = archive.add_trend_counts(counts, filters, interval)
+    data_points = {
+        date_key: {
+            "date": date_key,
+            "total_diagnoses": sum(row),
+            "by_category": dict(zip(crud.CATEGORIES, row))
+        }
+        for date_key, row in counts.items()
+    }
     
     # Convertir a lista ordenada
     sorted_data = sorted(data_points.values(), key=lambda x: x["date"])
@@ -251,8 +443,9 @@ async def get_temporal_trends(
 # ============================================================================
 
 @router.get("/feedback-analysis")
-async def get_feedback_analysis(
-    db: Session = Depends(get_db),
+def get_feedback_analysis(
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("feedback-analysis")),
     current_user: UserRead = Depends(get_current_technician)
 ):
     """
@@ -277,10 +470,20 @@ async def get_feedback_analysis(
         ]
     }
     ```
+    
+    Solo cuenta el feedback de la tabla caliente, sin los meses archivados.
     """
+    where = filters.predicates(db)
+    if shard_router.enabled:
+        return _sharded_feedback_analysis(db, where)
+    
+    snapshot = _hot_snapshot(db)
+    if snapshot is not None:
+        return snapshot.feedback_analysis(filters)
+    
     # Diagnósticos con feedback
     with_feedback = db.query(DiagnosisRecord)\
-        .filter(DiagnosisRecord.user_feedback_correct.isnot(None))\
+        .filter(DiagnosisRecord.user_feedback_correct.isnot(None), *where)\
         .all()
     
     total_with_feedback = len(with_feedback)
@@ -312,8 +515,8 @@ async def get_feedback_analysis(
             "accuracy": round(accuracy, 2)
         })
     
-    # Ordenar por más errores
-    issues_analysis.sort(key=lambda x: x["incorrect"], reverse=True)
+    # Ordenar por más errores; los empates por nombre, igual que el almacén columnar
+    issues_analysis.sort(key=lambda x: (-x["incorrect"], x["issue"]))
     
     return {
         "total_with_feedback": total_with_feedback,
@@ -324,14 +527,51 @@ async def get_feedback_analysis(
     }
 
 
+def _sharded_feedback_analysis(db: Session, where: list) -> dict:
+    totals = merge_sums(shard_router.scatter(db, lambda session, _: {
+        issue: [total, correct or 0]
+        for issue, total, correct in session.query(
+            DiagnosisRecord.detected_issue,
+            func.count(DiagnosisRecord.id),
+            func.sum(case((DiagnosisRecord.user_feedback_correct == True, 1), else_=0))
+        ).filter(
+            DiagnosisRecord.user_feedback_correct.isnot(None),
+            *where
+        ).group_by(DiagnosisRecord.detected_issue).all()
+    }).values())
+    
+    total_with_feedback = sum(total for total, _ in totals.values())
+    correct = sum(issue_correct for _, issue_correct in totals.values())
+    issues_analysis = [
+        {
+            "issue": issue,
+            "total": total,
+            "correct": issue_correct,
+            "incorrect": total - issue_correct,
+            "accuracy": round(issue_correct / total * 100, 2) if total else 0
+        }
+        for issue, (total, issue_correct) in totals.items()
+    ]
+    issues_analysis.sort(key=lambda x: (-x["incorrect"], x["issue"]))
+    
+    return {
+        "total_with_feedback": total_with_feedback,
+        "correct_diagnoses": correct,
+        "incorrect_diagnoses": total_with_feedback - correct,
+        "accuracy_rate": round((correct / total_with_feedback * 100), 2) if total_with_feedback > 0 else 0,
+        "issues_with_most_errors": issues_analysis[:10]
+    }
+
+
 # ============================================================================
 # ENDPOINT 5: Usuarios Más Activos
 # ============================================================================
 
 @router.get("/active-users")
-async def get_active_users(
+def get_active_users(
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("active-users")),
     current_user: UserRead = Depends(get_current_technician)
 ):
     """
@@ -354,7 +594,11 @@ async def get_active_users(
         ]
     }
     ```
+    
+    Solo cuenta diagnósticos de la tabla caliente (sin los meses archivados).
     """
+    where = filters.predicates(db)
+    
     # Query de usuarios con conteo de diagnósticos
     user_stats = db.query(
         User.id,
@@ -364,6 +608,8 @@ async def get_active_users(
         func.count(DiagnosisRecord.id).label('diagnosis_count')
     ).join(
         DiagnosisRecord, User.id == DiagnosisRecord.user_id
+    ).filter(
+        *where
     ).group_by(
         User.id
     ).order_by(
@@ -374,7 +620,7 @@ async def get_active_users(
     for user_id, username, display_name, last_login, count in user_stats:
         # Obtener problema más común del usuario
         most_common = db.query(DiagnosisRecord.detected_issue)\
-            .filter(DiagnosisRecord.user_id == user_id)\
+            .filter(DiagnosisRecord.user_id == user_id, *where)\
             .group_by(DiagnosisRecord.detected_issue)\
             .order_by(desc(func.count()))\
             .first()
@@ -396,3 +642,268 @@ async def get_active_users(
         "showing": len(active_users),
         "active_users": active_users
     }
+
+
+# ============================================================================
+# ENDPOINT 6: Dispositivos Únicos por Región y Semana (HyperLogLog)
+# ============================================================================
+
+@router.get("/unique-devices")
+def get_unique_devices(
+    weeks: int = Query(12, ge=1, le=156, description="Últimas N semanas"),
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("unique-devices")),
+    current_user: UserRead = Depends(get_current_technician)
+):
+    """
+    Dispositivos distintos por región y semana, estimados con HyperLogLog.
+    
+    Los sketches se combinan (máximo por registro), por lo que el total por
+    semana no es la suma de regiones: un dispositivo que reporta en dos
+    regiones cuenta una sola vez. Error estándar aproximado: 3%. El rango de
+    fechas se redondea a semanas y los sketches no permiten filtrar por
+    confianza.
+    
+    **Respuesta:**
+    ```json
+    {
+        "weeks": 12,
+        "data_points": [
+            {
+                "week": "2025-11-17",
+                "unique_devices": 310,
+                "by_region": {"Chiapas": 190, "Oaxaca": 80, "Veracruz": 52}
+            },
+            ...
+        ]
+    }
+    ```
+    """
+    if filters.has_confidence_filter:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Los sketches de dispositivos no permiten filtrar por confianza"
+        )
+    from app.core.sketches import HyperLogLog  # NumPy, al primer uso
+    
+    since = datetime.utcnow() - timedelta(weeks=weeks)
+    sketches = crud.get_diagnosis_sketches(db, filters.sketch_predicates(db, since))
+    
+    # semana -> región -> HLL combinado
+    by_week: Dict[datetime, Dict[str, HyperLogLog]] = {}
+    for sketch in sketches:
+        regions = by_week.setdefault(sketch.bucket_start, {})
+        region = crud.region_of(sketch.location)
+        hll = HyperLogLog.from_bytes(sketch.devices_hll)
+        if region in regions:
+            regions[region].merge(hll)
+        else:
+            regions[region] = hll
+    
+    data_points = []
+    for week in sorted(by_week):
+        regions = by_week[week]
+        data_points.append({
+            "week": week.strftime("%Y-%m-%d"),
+            "unique_devices": HyperLogLog.union(list(regions.values())).estimate(),
+            "by_region": {region: hll.estimate() for region, hll in sorted(regions.items())}
+        })
+    
+    return {
+        "weeks": weeks,
+        "data_points": data_points
+    }
+
+
+# ============================================================================
+# ENDPOINT 7: Percentiles de Confianza por Problema
+# ============================================================================
+
+@router.get("/confidence-percentiles")
+def get_confidence_percentiles(
+    days: int = Query(90, ge=1, le=1095, description="Últimos N días (redondeado a semanas)"),
+    percentiles: str = Query("10,50,90", description="Percentiles separados por coma"),
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("confidence-percentiles")),
+    current_user: UserRead = Depends(get_current_technician)
+):
+    """
+    Percentiles de confianza del modelo por problema detectado.
+    
+    Se combinan los histogramas semanales (error máximo 0.001 en la confianza)
+    en lugar de ordenar las filas de diagnosis_records. El rango de fechas se
+    redondea a semanas y el de confianza a los bins del histograma.
+    
+    **Respuesta:**
+    ```json
+    {
+        "period": "last_90_days",
+        "issues": [
+            {
+                "issue": "Roya del Café",
+                "count": 450,
+                "percentiles": {"p10": 0.71, "p50": 0.88, "p90": 0.96}
+            },
+            ...
+        ]
+    }
+    ```
+    """
+    try:
+        requested = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Percentiles inválidos")
+    if not requested or any(p < 0 or p > 100 for p in requested):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Percentiles deben estar entre 0 y 100")
+    
+    from app.core.sketches import ConfidenceHistogram  # NumPy, al primer uso
+    
+    since = datetime.utcnow() - timedelta(days=days)
+    sketches = crud.get_diagnosis_sketches(db, filters.sketch_predicates(db, since))
+    
+    by_issue: Dict[str, ConfidenceHistogram] = {}
+    for sketch in sketches:
+        histogram = ConfidenceHistogram.from_bytes(sketch.confidence_hist)
+        if sketch.detected_issue in by_issue:
+            by_issue[sketch.detected_issue].merge(histogram)
+        else:
+            by_issue[sketch.detected_issue] = histogram
+    
+    issues = []
+    for issue, histogram in by_issue.items():
+        if filters.has_confidence_filter:
+            histogram = histogram.restricted(filters.min_confidence, filters.max_confidence)
+            if not histogram.total:
+                continue
+        issues.append({
+            "issue": issue,
+            "count": histogram.total,
+            "percentiles": {f"p{p:g}": histogram.percentile(p) for p in requested}
+        })
+    issues.sort(key=lambda x: x["count"], reverse=True)
+    
+    return {
+        "period": f"last_{days}_days",
+        "issues": issues
+    }
+
+
+# ============================================================================
+# ENDPOINT 8: Calibración del Modelo (Diagramas de Confiabilidad)
+# ============================================================================
+
+def _calibration_summary(counts, conf_sums, correct_sums, bins: int) -> dict:
+    """
+    Reliability bins and calibration errors from per-bin sums (one issue or overall)
+    """
+    import numpy as np
+    
+    total = int(counts.sum())
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_conf = np.where(counts > 0, conf_sums / counts, 0.0)
+        accuracy = np.where(counts > 0, correct_sums / counts, 0.0)
+    gaps = np.abs(accuracy - avg_conf)
+    filled = counts > 0
+    
+    return {
+        "count": total,
+        "ece": round(float((counts * gaps).sum() / total), 4) if total else None,
+        "mce": round(float(gaps[filled].max()), 4) if filled.any() else None,
+        "bins": [
+            {
+                "lower": round(b / bins, 4),
+                "upper": round((b + 1) / bins, 4),
+                "count": int(counts[b]),
+                "avg_confidence": round(float(avg_conf[b]), 4) if counts[b] else None,
+                "accuracy": round(float(accuracy[b]), 4) if counts[b] else None
+            }
+            for b in range(bins)
+        ]
+    }
+
+
+def _compute_calibration(db: Session, bins: int, filters: AnalyticsFilters, min_count: int) -> dict:
+    import numpy as np
+    
+    where = filters.predicates(db)
+    # Con un solo problema no hace falta leer detected_issue
+    issue = filters.issues[0] if filters.issues and len(filters.issues) == 1 and filters.category is None else None
+    parts = crud.scatter(db, lambda session: crud.get_feedback_columns(session, issue=issue, where=where))
+    if len(parts) == 1:
+        confidence, correct, codes, names = parts[0]
+    else:
+        # Re-codificar los problemas de todos los shards en un solo diccionario
+        confidence = np.concatenate([part[0] for part in parts])
+        correct = np.concatenate([part[1] for part in parts])
+        labels = np.concatenate([np.asarray(part[3], dtype=object)[part[2]] for part in parts])
+        names, codes = np.unique(labels, return_inverse=True)
+        codes, names = codes.astype(np.int64), list(names)
+    
+    # Bin por fila y agregación conjunta (problema, bin) con bincount
+    bin_index = np.minimum((np.clip(confidence, 0.0, 1.0) * bins).astype(np.int64), bins - 1)
+    flat = codes * bins + bin_index
+    size = max(len(names), 1) * bins
+    counts = np.bincount(flat, minlength=size).reshape(-1, bins)
+    conf_sums = np.bincount(flat, weights=confidence, minlength=size).reshape(-1, bins)
+    correct_sums = np.bincount(flat, weights=correct.astype(np.float64), minlength=size).reshape(-1, bins)
+    
+    issues = []
+    for code, name in enumerate(names):
+        if counts[code].sum() < min_count:
+            continue
+        issues.append({"issue": name, **_calibration_summary(counts[code], conf_sums[code], correct_sums[code], bins)})
+    issues.sort(key=lambda x: x["ece"] or 0, reverse=True)
+    
+    return {
+        "bins": bins,
+        "overall": _calibration_summary(counts.sum(axis=0), conf_sums.sum(axis=0), correct_sums.sum(axis=0), bins),
+        "issues": issues
+    }
+
+
+@router.get("/calibration")
+def get_model_calibration(
+    response: Response,
+    bins: int = Query(10, ge=2, le=50, description="Número de bins de confianza"),
+    min_count: int = Query(20, ge=1, description="Mínimo de diagnósticos con feedback por problema"),
+    filters: AnalyticsFilters = Depends(get_analytics_filters),
+    db: Session = Depends(read_db_with_deadline("calibration")),
+    current_user: UserRead = Depends(get_current_technician)
+):
+    """
+    Diagrama de confiabilidad: confianza del modelo contra la tasa observada
+    de feedback "correcto", por bins y por problema detectado, con el error de
+    calibración esperado (ECE) y máximo (MCE).
+    
+    **Respuesta:**
+    ```json
+    {
+        "bins": 10,
+        "overall": {
+            "count": 450,
+            "ece": 0.043,
+            "mce": 0.12,
+            "bins": [
+                {"lower": 0.8, "upper": 0.9, "count": 120, "avg_confidence": 0.85, "accuracy": 0.81},
+                ...
+            ]
+        },
+        "issues": [
+            {"issue": "Roya del Café", "count": 130, "ece": 0.06, "mce": 0.15, "bins": [...]},
+            ...
+        ]
+    }
+    ```
+    
+    Se calcula sobre la tabla caliente; los meses archivados en Parquet no
+    entran en los bins.
+    """
+    result, stale = compute_or_stale(
+        calibration_cache,
+        db,
+        (bins, min_count, filters.key()),
+        lambda: _compute_calibration(db, bins, filters, min_count)
+    )
+    if stale:
+        response.headers["X-Degraded"] = "stale"
+    return result
@@ -17,27 +17,12 @@ async def login(request: LoginRequest, db: Session = Depends(get_db)):
     """
     Login or register user with username
     """
-    # Check if user exists
-    user = crud.get_user_by_username(db, request.username)
+    # Create the user or update last login (one upsert)
+    user, created = crud.login_user(db, UserCreate(username=request.username))
+    message = "User created successfully" if created else "Login successful"
     
-    if not user:
-        # Create new user
-        user = crud.create_user(
-            db, 
-            UserCreate(username=request.username)
-        )
-        message = "User created successfully"
-    else:
-        # Update last login
-        user = crud.update_user_last_login(db, user)
-        message = "Login successful"
-    
-    # Create access token for technicians
-    token = None
-    if user.role == "Técnico":
-        token = create_access_token(
-            data={"sub": str(user.id), "role": user.role}
-        )
+    # Token for every user: technicians use it for the dashboard, devices for /sync/changes
+    token = create_access_token(data={"sub": str(user.id), "role": user.role})
     
     return AuthResponse(
         user_id=user.id,
@@ -52,23 +37,16 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     """
     Register a new user
     """
-    # Check if user already exists
-    existing_user = crud.get_user_by_username(db, user_data.username)
-    if existing_user:
+    # Create user (None if the username already exists)
+    user = crud.create_user(db, user_data)
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User with this username already exists"
         )
     
-    # Create user
-    user = crud.create_user(db, user_data)
-    
-    # Create access token for technicians
-    token = None
-    if user.role == "Técnico":
-        token = create_access_token(
-            data={"sub": str(user.id), "role": user.role}
-        )
+    # Token for every user: technicians use it for the dashboard, devices for /sync/changes
+    token = create_access_token(data={"sub": str(user.id), "role": user.role})
     
     return AuthResponse(
         user_id=user.id,
@@ -0,0 +1,53 @@
+"""
+Knowledge-base search endpoints
+
+Permite a dispositivos con poco hardware delegar la búsqueda RAG: la app envía
+el embedding de la pregunta (calculado con su ``EmbeddingService``) y recibe
+los chunks más similares sin tener que guardar ni recorrer todo el corpus.
+"""
+
+from fastapi import APIRouter, HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from app.schemas.schemas import KBSearchRequest, KBSearchResponse, KBStatsResponse
+
+router = APIRouter()
+
+
+@router.post("/search", response_model=KBSearchResponse)
+async def search_knowledge_base(payload: KBSearchRequest):
+    """
+    Top-k chunks by cosine similarity for each query embedding
+    """
+    import numpy as np
+
+    from app.services.retrieval import knowledge_base  # NumPy e índice, al primer uso
+
+    index = knowledge_base.index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Knowledge base index has not been built")
+    
+    if any(len(query) != index.dim for query in payload.queries):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Query embeddings must have dimension {index.dim}"
+        )
+    
+    results = await run_in_threadpool(
+        index.search,
+        np.array(payload.queries, dtype=np.float32),
+        payload.top_k,
+        payload.category,
+        payload.min_similarity
+    )
+    return {"results": results, "count": len(results)}
+
+
+@router.get("/stats", response_model=KBStatsResponse)
+async def knowledge_base_stats():
+    """
+    Size, embedding dimension and categories of the loaded index
+    """
+    from app.services.retrieval import knowledge_base
+
+    return knowledge_base.stats()
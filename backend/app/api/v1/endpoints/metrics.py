@@ -2,22 +2,49 @@
 Metrics endpoints for technician dashboard
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Header
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 from datetime import datetime
-from app.db.database import get_db
-from app.schemas.schemas import MetricsResponse, CategoryDistributionResponse
+from app.core.config import settings
+from app.db.database import get_read_db, SessionLocal
+from app.db.deadlines import read_db_with_deadline, compute_or_stale
+from app.schemas.schemas import (
+    MetricsResponse, CategoryDistributionResponse, MetricsHistoryResponse
+)
 from app.crud import crud
 from app.core.security import verify_token
+from app.core.cache import WatermarkCache
+from app.core.responses import FastJSONResponse
+from app.services.metrics_stream import MetricsBroadcaster, KEEPALIVE_FRAME, RETRY_FRAME
+from app.api.v1.endpoints.analytics import compute_trends
 
 router = APIRouter()
 
+# Agregados reutilizados entre requests hasta que /sync ingiera datos nuevos
+metrics_cache = WatermarkCache("metrics")
+
 
 def get_current_user(authorization: Optional[str] = Header(None)):
     """
     Verify technician authentication
     """
+    return _technician(authorization)
+
+
+def get_stream_user(
+    authorization: Optional[str] = Header(None),
+    access_token: Optional[str] = Query(None, description="Token para EventSource, que no envía headers")
+):
+    """
+    Technician authentication from the Authorization header or ?access_token=
+    """
+    return _technician(authorization or (f"Bearer {access_token}" if access_token else None))
+
+
+def _technician(authorization: Optional[str]):
     if not authorization:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
@@ -35,37 +62,82 @@ def get_current_user(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=401, detail="Invalid authentication")
 
 
+def compute_metrics(db: Session) -> dict:
+    distribution = crud.get_issue_distribution(db)
+    return {
+        "tpp": crud.calculate_tpp(db),
+        "cpm": crud.calculate_cpm(db),
+        # Suma de todos los shards, sin un COUNT(*) aparte
+        "total_diagnoses": sum(distribution.values()),
+        "issue_distribution": distribution,
+    }
+
+
 @router.get("/metrics", response_model=MetricsResponse)
-async def get_metrics(
-    db: Session = Depends(get_db),
+def get_metrics(
+    response: Response,
+    db: Session = Depends(read_db_with_deadline("metrics")),
     current_user: dict = Depends(get_current_user)
 ):
     """
     Get aggregated metrics for technician dashboard
     Requires technician authentication
+    
+    TPP, CPM y la distribución cubren la tabla caliente: los meses archivados
+    en Parquet (archive_cold_data.py) no se cuentan.
     """
-    # Calculate metrics
-    tpp = crud.calculate_tpp(db)
-    cpm = crud.calculate_cpm(db)
-    total_diagnoses = db.query(crud.DiagnosisRecord).count()
-    issue_distribution = crud.get_issue_distribution(db)
+    # NAS sale de los contadores que mantienen las escrituras de action items
+    nas = crud.get_nas(db)
     
-    # Calculate NAS (if action items are tracked)
-    nas = None  # TODO: Implement in Sprint 2
+    metrics, stale = compute_or_stale(metrics_cache, db, "metrics", lambda: compute_metrics(db))
+    if stale:
+        response.headers["X-Degraded"] = "stale"
     
     return MetricsResponse(
-        tpp=tpp,
-        cpm=cpm,
         nas=nas,
-        total_diagnoses=total_diagnoses,
-        issue_distribution=issue_distribution,
-        timestamp=datetime.utcnow()
+        timestamp=datetime.utcnow(),
+        **metrics
     )
 
 
+@router.get("/metrics/history", response_model=MetricsHistoryResponse)
+def get_metrics_history(
+    since: Optional[datetime] = Query(None, description="Desde (ISO 8601)"),
+    until: Optional[datetime] = Query(None, description="Hasta (ISO 8601)"),
+    limit: int = Query(500, ge=1, le=5000),
+    include_distribution: bool = Query(False, description="Incluir issue_distribution por punto"),
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Evolución histórica de TPP, CPM y NAS
+    
+    Se lee de los snapshots guardados por el scheduler; la historia nunca se
+    recalcula a partir de diagnosis_records. Los puntos se arman como dicts y
+    se serializan directo (hasta 5000 puntos, sin validar cada uno con
+    MetricsSnapshot).
+    """
+    snapshots = crud.get_metrics_history(db, since=since, until=until, limit=limit)
+    
+    points = [
+        {
+            "timestamp": snapshot.timestamp,
+            "tpp": snapshot.tpp,
+            "cpm": snapshot.cpm,
+            "nas": snapshot.nas,
+            "total_diagnoses": snapshot.total_diagnoses,
+            "issue_distribution": snapshot.issue_distribution if include_distribution else None,
+        }
+        for snapshot in snapshots
+    ]
+    
+    return FastJSONResponse({"snapshots": points, "count": len(points)})
+
+
 @router.get("/categories", response_model=CategoryDistributionResponse)
-async def get_category_distribution(
-    db: Session = Depends(get_db),
+def get_category_distribution(
+    response: Response,
+    db: Session = Depends(read_db_with_deadline("categories")),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -78,7 +150,8 @@ async def get_category_distribution(
     - Planta Saludable (1 clase)
     - Otros (desconocidos)
     
-    Requiere autenticación de técnico.
+    Requiere autenticación de técnico. Cubre solo la tabla caliente, sin los
+    meses archivados.
     
     Returns:
         CategoryDistributionResponse con el conteo por categoría
@@ -97,7 +170,11 @@ async def get_category_distribution(
         }
     """
     # Obtener distribución por categoría
-    category_distribution = crud.get_category_distribution(db)
+    category_distribution, stale = compute_or_stale(
+        metrics_cache, db, "categories", lambda: crud.get_category_distribution(db)
+    )
+    if stale:
+        response.headers["X-Degraded"] = "stale"
     
     # Calcular total
     total = sum(category_distribution.values())
@@ -107,3 +184,86 @@ async def get_category_distribution(
         total_diagnoses=total,
         timestamp=datetime.utcnow()
     )
+
+
+def _dashboard_state() -> dict:
+    """
+    What the dashboard polls: /metrics, /categories and daily /analytics/trends
+    
+    Se lee de la principal para incluir la ingesta que disparó el cálculo
+    (una réplica podría ir atrasada).
+    """
+    db = SessionLocal()
+    try:
+        metrics = metrics_cache.get_or_compute(db, "metrics", lambda: compute_metrics(db))
+        categories = metrics_cache.get_or_compute(db, "categories", lambda: crud.get_category_distribution(db))
+        trends = compute_trends(db, settings.SSE_TRENDS_DAYS, "day")
+        return {
+            "metrics": {**metrics, "nas": crud.get_nas(db)},
+            "categories": categories,
+            # Por fecha, para que el delta solo traiga los días que cambiaron
+            "trends": {
+                point["date"]: {"total_diagnoses": point["total_diagnoses"], "by_category": point["by_category"]}
+                for point in trends["data_points"]
+            },
+        }
+    finally:
+        db.close()
+
+
+dashboard_stream = MetricsBroadcaster(
+    _dashboard_state,
+    coalesce_seconds=settings.SSE_COALESCE_SECONDS,
+    max_subscribers=settings.SSE_MAX_SUBSCRIBERS,
+    max_frames=settings.SSE_QUEUE_SIZE,
+)
+
+
+@router.get("/metrics/stream", response_class=StreamingResponse)
+async def stream_metrics(
+    request: Request,
+    current_user: dict = Depends(get_stream_user)
+):
+    """
+    Métricas del dashboard en vivo (Server-Sent Events)
+    
+    Primero llega un ``snapshot`` con el estado completo y después, tras cada
+    lote de /sync, un ``delta`` con solo lo que cambió (JSON merge patch). El
+    estado se calcula una vez por worker y se comparte entre todas las
+    pantallas abiertas. Un cliente que no alcanza a leer recibe un
+    ``snapshot`` nuevo en lugar de los deltas que se perdió.
+    
+    Example:
+        event: snapshot
+        id: 12
+        data: {"metrics": {"tpp": 84.1, ...}, "categories": {...}, "trends": {"2025-11-21": {...}}}
+        
+        event: delta
+        id: 13
+        data: {"metrics": {"total_diagnoses": 1290, "tpp": 84.3}, "trends": {"2025-11-22": {...}}}
+    """
+    subscriber = await dashboard_stream.subscribe()
+    if subscriber is None:
+        raise HTTPException(status_code=503, detail="Too many live dashboard connections")
+    
+    async def frames():
+        # La conexión se cierra tras SSE_MAX_STREAM_SECONDS; EventSource se
+        # reconecta solo (posiblemente a otro worker) y recibe un snapshot
+        deadline = asyncio.get_running_loop().time() + settings.SSE_MAX_STREAM_SECONDS
+        try:
+            yield RETRY_FRAME
+            while asyncio.get_running_loop().time() < deadline:
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), timeout=settings.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield KEEPALIVE_FRAME
+        finally:
+            dashboard_stream.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -2,38 +2,339 @@
 Sync endpoints for data synchronization
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+import hmac
+import logging
+import secrets
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Path, Query, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Tuple
 from app.db.database import get_db
-from app.schemas.schemas import SyncPayload, SyncResponse
-from app.models.models import DiagnosisRecord
+from app.schemas.schemas import (
+    SyncPayload, SyncResponse, SyncChangesResponse, SyncUploadCreate, SyncUploadStatus, EdgeReplicationResponse
+)
+from app.crud import crud
+from app.core.config import settings
+from app.core.telemetry import sync_rows_ingested_total, sync_upload_chunks_total, sketch_update_failures_total
+from app.core.events import event_bus, INGEST_CHANNEL
+from app.core.security import get_current_user
+from app.core.responses import FastJSONResponse
+from app.services import sync_codec
+from app.db.shards import PRIMARY
 
 router = APIRouter()
+logger = logging.getLogger("kaapeh.sync")
+
+
+def _sync_request_body() -> dict:
+    """
+    OpenAPI requestBody for /sync: JSON (SyncPayload) or columnar MessagePack
+    """
+    schema = SyncPayload.model_json_schema()
+    schema["properties"]["diagnoses"]["items"] = schema.pop("$defs")["DiagnosisSyncData"]
+    return {
+        "required": True,
+        "content": {
+            "application/json": {"schema": schema},
+            sync_codec.MEDIA_TYPES[0]: {
+                "schema": {"type": "string", "format": "binary"},
+                "description": "Formato columnar descrito en app/services/sync_codec.py",
+            },
+        },
+    }
 
 
-@router.post("/sync", response_model=SyncResponse)
-async def sync_diagnoses(payload: SyncPayload, db: Session = Depends(get_db)):
+async def _parse_sync_body(request: Request) -> Tuple[List[dict], Optional[str], Optional[str]]:
+    """
+    Rows, device_id and cooperative_id of a /sync body (JSON or columnar MessagePack)
+    """
+    body = await request.body()
+    
+    if sync_codec.is_msgpack(request.headers.get("content-type")):
+        if not sync_codec.available():
+            raise HTTPException(status_code=415, detail="MessagePack uploads are not enabled on this server")
+        try:
+            upload = sync_codec.decode(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        rows, device_id, cooperative_id = upload.rows, upload.device_id, upload.cooperative_id
+    else:
+        try:
+            payload = SyncPayload.model_validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError([
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False, include_input=False)
+            ])
+        device_id, cooperative_id = payload.device_id, payload.cooperative_id
+        rows = [
+            {
+                "user_id": None,  # Anonymous for privacy
+                "timestamp": d.timestamp,
+                "detected_issue": d.detected_issue,
+                "confidence": d.confidence,
+                "user_feedback_correct": d.user_feedback_correct,
+                "location": d.location,
+            }
+            for d in payload.diagnoses
+        ]
+    return rows, device_id, cooperative_id
+
+
+@router.post("/sync", response_model=SyncResponse, openapi_extra={"requestBody": _sync_request_body()})
+async def sync_diagnoses(request: Request, db: Session = Depends(get_db)):
     """
     Sync anonymized diagnosis data from mobile app
+    
+    El cuerpo puede ser JSON (``SyncPayload``) o, con ``Content-Type:
+    application/msgpack``, el formato columnar de ``sync_codec``, que ocupa
+    varias veces menos bytes y se decodifica sin validar fila por fila. Todo
+    el lote se confirma o se pierde junto; para pendientes grandes con
+    conexión inestable, usar las subidas reanudables de ``/sync/uploads``.
     """
-    synced_count = 0
-    
-    for diagnosis_data in payload.diagnoses:
-        # Create anonymous diagnosis record
-        db_diagnosis = DiagnosisRecord(
-            user_id=None,  # Anonymous for privacy
-            timestamp=diagnosis_data.timestamp,
-            detected_issue=diagnosis_data.detected_issue,
-            confidence=diagnosis_data.confidence,
-            user_feedback_correct=diagnosis_data.user_feedback_correct,
-            location=diagnosis_data.location
-        )
-        db.add(db_diagnosis)
-        synced_count += 1
+    rows, device_id, cooperative_id = await _parse_sync_body(request)
     
+    synced_count = len(rows)
+    # Con shards regionales cada fila va a la base de su región
+    max_ids = crud.insert_diagnoses_by_region(db, rows, cooperative_id)
     db.commit()
+    _after_ingest(db, rows, max_ids, device_id)
     
     return SyncResponse(
         message="Data synced successfully",
         synced_count=synced_count
     )
+
+
+def _after_ingest(db: Session, rows: List[dict], max_ids: Dict[str, Optional[int]], device_id: Optional[str]) -> None:
+    """
+    Telemetry, worker notification and sketches for rows already committed
+    """
+    sync_rows_ingested_total.inc(len(rows))
+    
+    # Avisar a todos los workers para que invaliden su estado en memoria
+    for shard, max_id in max_ids.items():
+        if max_id is None:
+            continue
+        event = {"count": len(rows), "max_id": max_id}
+        if shard != PRIMARY:
+            event["shard"] = shard
+        event_bus.publish(INGEST_CHANNEL, event)
+    
+    # Sketches semanales (dispositivos distintos, percentiles de confianza).
+    # Son derivados y las filas ya están confirmadas: si fallan no se responde
+    # error, porque el dispositivo reenviaría el lote y lo duplicaría.
+    # rebuild_sketches.py los recupera.
+    identity = f"device:{device_id}" if device_id else None
+    try:
+        crud.update_diagnosis_sketches(db, ({**row, "identity": identity} for row in rows))
+    except SQLAlchemyError:
+        db.rollback()
+        sketch_update_failures_total.inc()
+        logger.exception("Sketch update failed for %d ingested rows", len(rows))
+
+
+def _upload_status(upload, stored: Optional[bool] = None) -> SyncUploadStatus:
+    total_chunks = -(-upload.total_rows // upload.chunk_size)
+    return SyncUploadStatus(
+        upload_id=upload.id,
+        total_rows=upload.total_rows,
+        chunk_size=upload.chunk_size,
+        total_chunks=total_chunks,
+        committed_offset=min(upload.committed_chunks * upload.chunk_size, upload.total_rows),
+        next_chunk=upload.committed_chunks,
+        complete=upload.committed_chunks >= total_chunks,
+        expires_at=upload.expires_at,
+        stored=stored,
+    )
+
+
+def _open_upload(db: Session, upload_id: str):
+    upload = crud.get_sync_upload(db, upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload session not found; start a new one")
+    if upload.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload session expired; start a new one")
+    return upload
+
+
+@router.post("/sync/uploads", response_model=SyncUploadStatus, status_code=201)
+async def create_sync_upload(payload: SyncUploadCreate, db: Session = Depends(get_db)):
+    """
+    Start a resumable upload of a large offline backlog
+    
+    El dispositivo parte su pendiente en chunks de ``chunk_size`` filas,
+    numerados desde 0, y envía cada uno con ``PUT
+    /sync/uploads/{upload_id}/chunks/{n}``. Cada chunk se guarda en cuanto
+    llega, así que un corte a la mitad solo obliga a reenviar desde
+    ``next_chunk``. La sesión vence ``SYNC_UPLOAD_TTL_SECONDS`` después del
+    último chunk.
+    """
+    if payload.total_rows > settings.SYNC_UPLOAD_MAX_ROWS:
+        raise HTTPException(status_code=422, detail=f"total_rows must be at most {settings.SYNC_UPLOAD_MAX_ROWS}")
+    chunk_size = min(payload.chunk_size or settings.SYNC_UPLOAD_CHUNK_ROWS, settings.SYNC_UPLOAD_MAX_CHUNK_ROWS)
+    upload = crud.create_sync_upload(
+        db, secrets.token_urlsafe(16), payload.total_rows, chunk_size, settings.SYNC_UPLOAD_TTL_SECONDS
+    )
+    return _upload_status(upload)
+
+
+@router.get("/sync/uploads/{upload_id}", response_model=SyncUploadStatus)
+async def get_sync_upload(upload_id: str, db: Session = Depends(get_db)):
+    """
+    Where a device must resume an interrupted upload
+    """
+    return _upload_status(_open_upload(db, upload_id))
+
+
+@router.put(
+    "/sync/uploads/{upload_id}/chunks/{chunk}",
+    response_model=SyncUploadStatus,
+    openapi_extra={"requestBody": _sync_request_body()},
+)
+async def put_sync_upload_chunk(
+    request: Request,
+    upload_id: str,
+    chunk: int = Path(..., ge=0),
+    db: Session = Depends(get_db)
+):
+    """
+    Store one numbered chunk of a resumable upload
+    
+    El cuerpo es el mismo de ``/sync`` (JSON o MessagePack) con exactamente
+    las filas del chunk: ``chunk_size``, salvo el último. Reenviar un chunk ya
+    guardado no duplica filas (``stored: false``). Los chunks pueden llegar
+    en cualquier orden; ``committed_offset`` solo avanza sobre los que no
+    dejan huecos.
+    """
+    upload = _open_upload(db, upload_id)
+    status = _upload_status(upload)
+    if chunk >= status.total_chunks:
+        raise HTTPException(status_code=422, detail=f"Chunk must be below {status.total_chunks}")
+    expected = min(upload.chunk_size, upload.total_rows - chunk * upload.chunk_size)
+    rows, device_id, cooperative_id = await _parse_sync_body(request)
+    if len(rows) != expected:
+        raise HTTPException(status_code=422, detail=f"Chunk {chunk} must contain {expected} rows, got {len(rows)}")
+    
+    stored, max_ids = crud.store_upload_chunk(
+        db, upload, chunk, rows, cooperative_id, settings.SYNC_UPLOAD_TTL_SECONDS
+    )
+    db.commit()
+    sync_upload_chunks_total.inc(result="stored" if stored else "duplicate")
+    if stored:
+        _after_ingest(db, rows, max_ids, device_id)
+    return _upload_status(crud.get_sync_upload(db, upload_id), stored)
+
+
+def _require_replication_token(authorization: Optional[str]) -> None:
+    if not settings.REPLICATION_TOKEN:
+        raise HTTPException(status_code=404, detail="Edge replication is not enabled on this server")
+    token = (authorization or "").replace("Bearer ", "")
+    if not hmac.compare_digest(token.encode(), settings.REPLICATION_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid replication token")
+
+
+@router.post(
+    "/sync/replicate",
+    response_model=EdgeReplicationResponse,
+    responses={409: {"description": "El lote empieza después del cursor; reenviar desde applied_through_id"}},
+)
+async def replicate_edge_batch(
+    request: Request,
+    node_id: str = Header(..., alias="X-Edge-Node", min_length=1, max_length=128),
+    after_id: int = Header(..., alias="X-Edge-After-Id", ge=0),
+    through_id: int = Header(..., alias="X-Edge-Through-Id", ge=0),
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Apply a batch of diagnoses replicated from an edge node (exactly once)
+    
+    El cuerpo es el formato columnar de ``sync_codec`` con la columna ``id``
+    (ids del nodo), normalmente con ``Content-Encoding: gzip``. Contiene las
+    filas del nodo con id en (``X-Edge-After-Id``, ``X-Edge-Through-Id``].
+    Reenviar un lote ya aplicado no duplica filas; un lote que empieza
+    después del cursor responde 409 con el ``applied_through_id`` desde el
+    que hay que seguir.
+    """
+    _require_replication_token(authorization)
+    if not sync_codec.available():
+        raise HTTPException(status_code=415, detail="MessagePack uploads are not enabled on this server")
+    try:
+        body = sync_codec.decompress(
+            await request.body(), request.headers.get("content-encoding"), settings.REPLICATION_MAX_BATCH_BYTES
+        )
+        upload = sync_codec.decode(body)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    ids = upload.ids if upload.ids is not None else []
+    if len(ids) != len(upload.rows):
+        raise HTTPException(status_code=422, detail="Replication batches need the 'id' column")
+    if through_id < after_id or (ids and (ids[0] <= after_id or ids[-1] > through_id)):
+        raise HTTPException(status_code=422, detail="Row ids must be within (after_id, through_id]")
+    
+    applied, rows, max_ids = crud.apply_edge_batch(
+        db, node_id, after_id, through_id, ids, upload.rows, upload.cooperative_id
+    )
+    db.commit()
+    if after_id > applied:
+        return FastJSONResponse(
+            {"detail": "Batch starts after the applied cursor", "node_id": node_id, "applied_through_id": applied},
+            status_code=409,
+        )
+    if rows:
+        _after_ingest(db, rows, max_ids, None)
+    
+    return EdgeReplicationResponse(
+        node_id=node_id,
+        applied_through_id=applied,
+        rows_applied=len(rows),
+        duplicates_skipped=len(upload.rows) - len(rows),
+    )
+
+
+@router.get("/sync/replicate/{node_id}", response_model=EdgeReplicationResponse)
+async def get_edge_replication_cursor(
+    node_id: str,
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Where an edge node must resume replication (0 if it never sent a batch)
+    """
+    _require_replication_token(authorization)
+    state = crud.get_edge_replication_state(db, node_id)
+    return EdgeReplicationResponse(
+        node_id=node_id,
+        applied_through_id=state.applied_through_id if state else 0,
+        rows_applied=state.rows_applied if state else 0,
+    )
+
+
+@router.get("/sync/changes", response_model=SyncChangesResponse)
+async def get_sync_changes(
+    since: int = Query(0, ge=0, description="Cursor devuelto por la llamada anterior (0 = desde el inicio)"),
+    limit: int = Query(500, ge=1, le=5000, description="Máximo de entradas del log por lote"),
+    user_id: Optional[int] = Query(None, description="Solo los cambios de este usuario"),
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Download only what changed since the device's cursor
+    
+    Devuelve perfiles de usuario, configuraciones de accesibilidad y action
+    items modificados (estado actual, en formato columnas + filas) y los ids
+    borrados. Requiere el token que devuelve /auth/login: un dispositivo solo
+    puede pedir los cambios de su propio ``user_id``; el log completo, o el de
+    otro usuario, requiere token de técnico.
+    """
+    payload = get_current_user(authorization)
+    if payload.get("role") != "Técnico" and (user_id is None or str(user_id) != payload.get("sub")):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    # Lotes de hasta 5000 filas: se serializan sin revalidar SyncChangesResponse
+    return FastJSONResponse(crud.get_changes(db, since, user_id=user_id, limit=limit))
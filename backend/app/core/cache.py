@@ -0,0 +1,154 @@
+"""
+In-process caches invalidated by ingest events
+
+Cada worker sigue la "marca de agua" de ingesta (el id más alto de
+``diagnosis_records`` que conoce). Los eventos de /sync que llegan por el bus
+la avanzan, y las entradas de caché calculadas con una marca anterior dejan
+de ser válidas. Una edad máxima protege contra escrituras que no pasan por
+/sync (scripts de carga, migraciones).
+
+Con shards regionales cada shard tiene su propia marca (los ids se repiten
+entre bases) y la versión de las cachés es la tupla de todas.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.events import event_bus, INGEST_CHANNEL
+from app.core.telemetry import record_cache_lookup
+
+
+class IngestState:
+    """
+    Highest diagnosis id this worker knows has been ingested
+    """
+
+    def __init__(self):
+        self._watermark: Optional[int] = None
+        self._shard_watermarks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def advance(self, max_id: Optional[int], shard: Optional[str] = None) -> None:
+        if max_id is None:
+            return
+        with self._lock:
+            if shard is not None:
+                if shard in self._shard_watermarks and max_id > self._shard_watermarks[shard]:
+                    self._shard_watermarks[shard] = max_id
+            elif self._watermark is None or max_id > self._watermark:
+                self._watermark = max_id
+
+    def watermark(self, db: Session) -> int:
+        """
+        Current watermark, read once from the database on first use
+        """
+        if self._watermark is None:
+            from app.db.database import SessionLocal
+            from app.models.models import DiagnosisRecord
+            if db.info.get("replica") is None:
+                self.advance(db.query(func.max(DiagnosisRecord.id)).scalar() or 0)
+            else:
+                # Una réplica atrasada daría una marca vieja: leerla de la principal
+                with SessionLocal() as primary:
+                    self.advance(primary.query(func.max(DiagnosisRecord.id)).scalar() or 0)
+        return self._watermark
+
+    def version(self, db: Session) -> Hashable:
+        """
+        Watermark of the primary, plus those of the regional shards if configured
+        """
+        from app.db.shards import shard_router
+        watermark = self.watermark(db)
+        if not shard_router.enabled:
+            return watermark
+        if len(self._shard_watermarks) != len(shard_router.names):
+            current = shard_router.max_ids()
+            with self._lock:
+                for name, max_id in current.items():
+                    self._shard_watermarks[name] = max(max_id, self._shard_watermarks.get(name, 0))
+        return (watermark, *(self._shard_watermarks[name] for name in shard_router.names))
+
+    def reset(self) -> None:
+        """
+        Forget the watermarks; cached entries are revalidated against a fresh read
+        """
+        with self._lock:
+            self._watermark = None
+            self._shard_watermarks.clear()
+
+
+ingest_state = IngestState()
+
+
+def _on_ingest(payload: dict) -> None:
+    if payload.get("resync"):
+        ingest_state.reset()
+    else:
+        ingest_state.advance(payload.get("max_id"), payload.get("shard"))
+
+
+event_bus.subscribe(INGEST_CHANNEL, _on_ingest)
+
+
+def _replica_behind(db: Session, version: Hashable) -> bool:
+    """
+    Whether ``db`` is a read replica that has not replayed up to the primary watermark
+    """
+    if db.info.get("replica") is None:
+        return False
+    from app.models.models import DiagnosisRecord
+    watermark = version[0] if isinstance(version, tuple) else version
+    return (db.query(func.max(DiagnosisRecord.id)).scalar() or 0) < watermark
+
+
+class WatermarkCache:
+    """
+    Small LRU of computed results keyed by (key, ingest watermark)
+    """
+
+    def __init__(self, name: str, max_entries: int = 64, max_age: Optional[float] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_age = settings.CACHE_MAX_AGE_SECONDS if max_age is None else max_age
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, db: Session, key: Hashable, compute: Callable[[], Any]) -> Any:
+        watermark = ingest_state.version(db)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == watermark and now - entry[1] < self.max_age:
+                self._entries.move_to_end(key)
+                record_cache_lookup(self.name, hit=True)
+                return entry[2]
+
+        record_cache_lookup(self.name, hit=False)
+        value = compute()
+        if _replica_behind(db, watermark):
+            # Calculado en una réplica que aún no tiene la ingesta más reciente
+            return value
+        with self._lock:
+            self._entries[key] = (watermark, now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def get_stale(self, key: Hashable) -> Any:
+        """
+        Last value computed for ``key`` whatever its watermark or age (None if never)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
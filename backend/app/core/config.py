@@ -3,7 +3,7 @@ Application configuration settings
 """
 
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -23,6 +23,109 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "Káapeh Copiloto API"
     VERSION: str = "1.0.0"
     
+    # Startup: si el esquema no coincide con SCHEMA_VERSION, crearlo (dev) o fallar (prod)
+    AUTO_CREATE_SCHEMA: bool = True
+    
+    # Multi-worker: bus de eventos entre procesos ("auto", "postgres" o "local")
+    EVENT_BUS_BACKEND: str = "auto"
+    CACHE_MAX_AGE_SECONDS: float = 300.0  # Red de seguridad para escrituras fuera de /sync
+    
+    # Snapshots periódicos de AggregatedMetrics (0 desactiva el scheduler)
+    METRICS_SNAPSHOT_INTERVAL_SECONDS: float = 3600.0
+    # Recuento de metric_counters desde las tablas, por escrituras que no pasan por crud (0 lo desactiva)
+    METRIC_COUNTERS_RECONCILE_INTERVAL_SECONDS: float = 6 * 3600.0
+    
+    # Operational metrics (Prometheus text format), separate from technician /metrics
+    INTERNAL_METRICS_PATH: str = "/metrics/internal"
+    
+    # Analytics: copia columnar en memoria por worker (opt-in)
+    COLUMNAR_STORE_ENABLED: bool = False
+    COLUMNAR_STORE_MAX_BYTES: int = 256 * 1024 * 1024  # Si se supera, se vuelve a SQL
+    COLUMNAR_STORE_MAX_AGE_SECONDS: float = 900.0  # Recarga completa (feedback, borrados)
+    
+    # Archivo de datos fríos en Parquet (requiere pyarrow; 0 desactiva el job)
+    ARCHIVE_DIR: str = "archive"
+    ARCHIVE_HOT_MONTHS: int = 3  # Meses cerrados que se quedan en la tabla caliente
+    ARCHIVE_DELETE_BATCH_SIZE: int = 5000
+    ARCHIVE_INTERVAL_SECONDS: float = 0.0
+    
+    # Re-categorización en segundo plano tras cambios de taxonomía (recategorize_issues.py)
+    RECATEGORIZE_CHUNK_IDS: int = 5000  # Rango de ids por UPDATE
+    RECATEGORIZE_MAX_DUTY: float = 0.5  # Fracción máxima del tiempo escribiendo; el resto es pausa
+    RECATEGORIZE_INTERVAL_SECONDS: float = 60.0  # El scheduler retoma trabajos pendientes (0 lo desactiva)
+    RECATEGORIZE_TICK_SECONDS: float = 45.0  # Tiempo máximo de trabajo por turno del scheduler
+    RECATEGORIZE_STALE_SECONDS: float = 120.0  # Sin heartbeat por más tiempo, otro proceso lo retoma
+    
+    # Subidas reanudables de /sync (/sync/uploads): el dispositivo envía chunks numerados
+    SYNC_UPLOAD_CHUNK_ROWS: int = 500  # Tamaño de chunk si el dispositivo no elige uno
+    SYNC_UPLOAD_MAX_CHUNK_ROWS: int = 5000
+    SYNC_UPLOAD_MAX_ROWS: int = 1_000_000
+    SYNC_UPLOAD_TTL_SECONDS: float = 7 * 24 * 3600.0  # Desde el último chunk; luego la sesión se borra
+    SYNC_UPLOAD_CLEANUP_INTERVAL_SECONDS: float = 3600.0
+    
+    # Modo edge: backend en una laptop del beneficio con internet intermitente
+    EDGE_MODE: bool = False  # Aplica SQLITE_PRAGMAS a cada conexión SQLite
+    SQLITE_PRAGMAS: Dict[str, str] = {
+        "journal_mode": "WAL",  # Lecturas del dashboard sin bloquear las escrituras de /sync
+        "synchronous": "NORMAL",  # Con WAL no corrompe; un corte de luz pierde a lo sumo el último commit
+        "busy_timeout": "5000",
+        "cache_size": "-65536",  # 64 MB
+        "temp_store": "MEMORY",
+        "mmap_size": "268435456",
+    }
+    EDGE_NODE_ID: str = ""  # Identificador ante la instancia central (default: hostname)
+    EDGE_UPSTREAM_URL: str = ""  # API central, p. ej. "https://central.example/api/v1" (vacío = sin réplica)
+    EDGE_COOPERATIVE_ID: Optional[str] = None  # Shard de destino en la central
+    EDGE_REPLICATION_INTERVAL_SECONDS: float = 30.0
+    EDGE_REPLICATION_TICK_SECONDS: float = 25.0  # Tiempo máximo enviando lotes por turno
+    EDGE_BATCH_MIN_ROWS: int = 100
+    EDGE_BATCH_MAX_ROWS: int = 20000
+    EDGE_BATCH_TARGET_SECONDS: float = 5.0  # Cada envío debería tardar esto con el ancho de banda medido
+    EDGE_UPLOAD_TIMEOUT_SECONDS: float = 60.0
+    EDGE_MAX_BACKOFF_SECONDS: float = 600.0  # Espera máxima entre intentos sin enlace
+    # Token compartido de réplica: la central lo exige y los nodos edge lo envían (vacío = desactivada)
+    REPLICATION_TOKEN: str = ""
+    REPLICATION_MAX_BATCH_BYTES: int = 64 * 1024 * 1024  # Tamaño máximo de un lote descomprimido
+    
+    # Presupuesto de tiempo por ruta de lectura (statement_timeout + cancelación)
+    QUERY_BUDGET_DEFAULT_SECONDS: float = 15.0
+    QUERY_BUDGETS_SECONDS: Dict[str, float] = {
+        "metrics": 5.0,
+        "categories": 5.0,
+        "heatmap": 10.0,
+        "trends": 10.0,
+        "frequent-issues": 10.0,
+        "calibration": 20.0,
+    }
+    
+    # Stream en vivo del dashboard (/metrics/stream, Server-Sent Events)
+    SSE_MAX_SUBSCRIBERS: int = 500  # Por worker
+    SSE_QUEUE_SIZE: int = 8  # Frames pendientes por cliente antes de reemplazarlos por un snapshot
+    SSE_COALESCE_SECONDS: float = 1.0  # Ingestas dentro de esta ventana salen en un solo delta
+    SSE_KEEPALIVE_SECONDS: float = 15.0
+    SSE_MAX_STREAM_SECONDS: float = 300.0  # Luego el cliente se reconecta (no retrasa apagados ni despliegues)
+    SSE_TRENDS_DAYS: int = 30  # Ventana de tendencias diarias incluida en el stream
+    
+    # Búsqueda en la base de conocimiento (índice creado con build_kb_index.py)
+    KB_INDEX_DIR: str = "kb_index"
+    
+    # Shards regionales de diagnosis_records (vacío = una sola base)
+    SHARD_DATABASE_URLS: Dict[str, str] = {}  # {"oaxaca": "postgresql://...", ...}
+    SHARD_REGIONS: Dict[str, str] = {}  # Región de location -> shard, {"Oaxaca": "oaxaca", ...}
+    SHARD_COOPERATIVES: Dict[str, str] = {}  # cooperative_id -> shard (tiene prioridad)
+    
+    # Réplicas de lectura para analytics y métricas (vacío = todo a la principal)
+    READ_REPLICA_URLS: List[str] = []
+    REPLICA_MAX_LAG_SECONDS: float = 10.0  # Con más retraso la réplica no recibe lecturas
+    REPLICA_CHECK_INTERVAL_SECONDS: float = 5.0  # Cada cuánto se revisa salud y retraso
+    
+    # SQL profiler (opt-in): query count, DB time, N+1 shapes and slow-query plans
+    SQL_PROFILER_ENABLED: bool = False
+    SQL_PROFILER_HEADER: bool = False  # Add X-SQL-Profile header to responses
+    SQL_PROFILER_TOP_N: int = 5
+    SQL_PROFILER_N_PLUS_ONE_THRESHOLD: int = 5
+    SQL_PROFILER_EXPLAIN_THRESHOLD_MS: Optional[float] = None  # None disables EXPLAIN capture
+    
     # CORS
     BACKEND_CORS_ORIGINS: list = ["*"] # Allow all origins for development; restrict in production
     
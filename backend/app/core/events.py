@@ -0,0 +1,162 @@
+"""
+Cross-process event bus
+
+Cuando se corren varios workers (``uvicorn app.main:app --workers 4`` o
+gunicorn con workers uvicorn), cada proceso guarda su propio estado en memoria
+(cachés, contadores). El bus difunde eventos como "se ingirieron diagnósticos"
+a todos los workers para que invaliden o actualicen ese estado sin consultar
+la base de datos periódicamente.
+
+- ``PostgresEventBus``: NOTIFY al publicar y un hilo por worker con LISTEN
+- ``LocalEventBus``: despacho inmediato en el mismo proceso (SQLite, pruebas)
+"""
+
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.db.database import engine
+
+logger = logging.getLogger("kaapeh.events")
+
+# Canales
+INGEST_CHANNEL = "kaapeh_ingest"
+
+EventCallback = Callable[[dict], None]
+
+
+class EventBus:
+    """
+    Publish/subscribe interface shared by all backends
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[EventCallback]] = defaultdict(list)
+
+    def subscribe(self, channel: str, callback: EventCallback) -> None:
+        self._subscribers[channel].append(callback)
+
+    def publish(self, channel: str, payload: dict) -> None:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def _dispatch(self, channel: str, payload: dict) -> None:
+        for callback in self._subscribers.get(channel, []):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Event subscriber failed on %s", channel)
+
+
+class LocalEventBus(EventBus):
+    """
+    In-process bus: publish calls subscribers synchronously
+    """
+
+    def publish(self, channel: str, payload: dict) -> None:
+        self._dispatch(channel, payload)
+
+
+class PostgresEventBus(EventBus):
+    """
+    Bus over PostgreSQL LISTEN/NOTIFY
+
+    El propio worker que publica también recibe la notificación por LISTEN, así
+    que todos los procesos aplican el evento por el mismo camino.
+    """
+
+    def __init__(self, engine: Engine, poll_timeout: float = 5.0):
+        super().__init__()
+        self.engine = engine
+        self.poll_timeout = poll_timeout
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def publish(self, channel: str, payload: dict) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": channel, "payload": json.dumps(payload, default=str)}
+            )
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen_forever, name="event-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_timeout + 1)
+            self._thread = None
+
+    def _listen_forever(self) -> None:
+        resync = False
+        while not self._stopping.is_set():
+            try:
+                self._listen(resync)
+            except Exception:
+                logger.exception("LISTEN connection lost, reconnecting")
+                self._stopping.wait(1.0)
+            resync = True
+
+    def _listen(self, resync: bool) -> None:
+        raw = self.engine.raw_connection()
+        try:
+            dbapi_conn = raw.dbapi_connection
+            dbapi_conn.autocommit = True
+            with dbapi_conn.cursor() as cursor:
+                for channel in self._subscribers:
+                    cursor.execute(f'LISTEN "{channel}"')
+
+            # Tras una reconexión pudieron perderse eventos: pedir a los
+            # suscriptores que descarten su estado local
+            if resync:
+                for channel in list(self._subscribers):
+                    self._dispatch(channel, {"resync": True})
+
+            while not self._stopping.is_set():
+                ready, _, _ = select.select([dbapi_conn], [], [], self.poll_timeout)
+                if not ready:
+                    continue
+                dbapi_conn.poll()
+                while dbapi_conn.notifies:
+                    notify = dbapi_conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload) if notify.payload else {}
+                    except ValueError:
+                        logger.warning("Discarding malformed event on %s", notify.channel)
+                        continue
+                    self._dispatch(notify.channel, payload)
+        finally:
+            raw.invalidate()
+
+
+def create_event_bus(engine: Engine) -> EventBus:
+    """
+    Pick the bus backend from settings ("auto" uses Postgres when available)
+    """
+    backend = settings.EVENT_BUS_BACKEND
+    if backend == "auto":
+        backend = "postgres" if engine.dialect.name == "postgresql" else "local"
+    if backend == "postgres":
+        return PostgresEventBus(engine)
+    return LocalEventBus()
+
+
+# Bus del proceso (se inicia en el startup de la app)
+event_bus = create_event_bus(engine)
@@ -0,0 +1,70 @@
+"""
+Fast JSON responses
+
+``FastJSONResponse`` es la clase de respuesta por defecto de la app: serializa
+con orjson (varias veces más rápido que ``json`` de la stdlib en las
+respuestas grandes de analytics) y cae a la stdlib si orjson no está
+instalado.
+
+FastAPI igual pasa lo que retorna un endpoint por ``jsonable_encoder`` y, si
+tiene ``response_model``, lo vuelve a validar. Las rutas de lectura calientes
+retornan directamente una respuesta ya construida para saltarse ambos pasos:
+``FastJSONResponse(content)`` o, para resultados en caché, los bytes
+serializados una sola vez con ``CachedJSONResponse(body)``.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson está en requirements.txt
+    orjson = None
+
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+
+def _default(value: Any):
+    """
+    Types neither serializer handles natively (Decimal de PostgreSQL, escalares numpy)
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        return value.item()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize to compact UTF-8 JSON bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class CachedJSONResponse(Response):
+    """
+    Response for a body that is already serialized JSON
+    """
+    media_type = "application/json"
@@ -0,0 +1,65 @@
+"""
+In-process periodic job scheduler
+
+Corre tareas periódicas (p. ej. snapshots de métricas) en el event loop de la
+app; el trabajo de base de datos se ejecuta en el threadpool para no bloquear
+las requests. Con varios workers cada uno tiene su scheduler, por lo que los
+trabajos deben ser idempotentes o coordinarse por su cuenta (advisory locks).
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger("kaapeh.scheduler")
+
+
+@dataclass
+class Job:
+    name: str
+    interval: float
+    func: Callable[[], None]
+    task: Optional[asyncio.Task] = None
+
+
+class Scheduler:
+    """
+    Runs registered jobs every ``interval`` seconds until stopped
+    """
+
+    def __init__(self):
+        self.jobs: List[Job] = []
+
+    def add_job(self, name: str, interval: float, func: Callable[[], None]) -> None:
+        if interval <= 0:
+            return
+        self.jobs.append(Job(name, interval, func))
+
+    def start(self) -> None:
+        for job in self.jobs:
+            if job.task is None:
+                job.task = asyncio.create_task(self._run(job))
+
+    async def stop(self) -> None:
+        for job in self.jobs:
+            if job.task is not None:
+                job.task.cancel()
+                try:
+                    await job.task
+                except asyncio.CancelledError:
+                    pass
+                job.task = None
+
+    async def _run(self, job: Job) -> None:
+        while True:
+            try:
+                await run_in_threadpool(job.func)
+            except Exception:
+                logger.exception("Scheduled job %s failed", job.name)
+            await asyncio.sleep(job.interval)
+
+
+scheduler = Scheduler()
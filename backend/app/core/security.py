@@ -4,17 +4,31 @@ Security utilities for authentication and authorization
 
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from fastapi import Header, HTTPException
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# jose y passlib (cryptography, bcrypt) se importan al primer uso para no
+# cargarlos en el arranque de cada worker
+_pwd_context = None
+
+
+def get_pwd_context():
+    """
+    Lazily build the password hashing context
+    """
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token
     """
+    from jose import jwt
+    
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -30,6 +44,8 @@ def verify_token(token: str) -> Optional[dict]:
     """
     Verify and decode a JWT token
     """
+    from jose import JWTError, jwt
+    
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         return payload
@@ -41,11 +57,45 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify a password against its hash
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
     """
     Hash a password
     """
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+
+def warm_up() -> None:
+    """
+    Import the crypto dependencies ahead of the first authenticated request
+    """
+    from jose import jwt  # noqa: F401
+    get_pwd_context()
+
+
+def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
+    """
+    Dependency that requires a valid token of any role (sub = user id)
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    payload = verify_token(authorization.replace("Bearer ", ""))
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    return payload
+
+
+def get_current_technician(authorization: Optional[str] = Header(None)) -> dict:
+    """
+    Dependency that requires a valid technician token
+    """
+    payload = get_current_user(authorization)
+    
+    if payload.get("role") != "Técnico":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return payload
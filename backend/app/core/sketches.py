@@ -0,0 +1,138 @@
+"""
+Mergeable sketches for approximate analytics
+
+- ``HyperLogLog``: cardinalidad aproximada (dispositivos/usuarios distintos)
+  con error estándar ~1.04/sqrt(2^p). Se combina con el máximo por registro.
+- ``ConfidenceHistogram``: distribución de valores en [0, 1] con bins fijos de
+  ancho 1/bins; se combina sumando y da percentiles con error <= 1/bins.
+
+Ambos se serializan comprimidos (zlib) para guardarse en la base de datos y
+combinarse sobre cualquier rango de buckets sin volver a leer las filas.
+"""
+
+import hashlib
+import math
+import zlib
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality sketch with 2^p one-byte registers
+    """
+
+    def __init__(self, p: int = 10, registers: Optional[np.ndarray] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def add(self, value: str) -> None:
+        h = self._hash(value)
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @classmethod
+    def union(cls, sketches: List["HyperLogLog"], p: int = 10) -> "HyperLogLog":
+        if not sketches:
+            return cls(p)
+        return cls(sketches[0].p, np.maximum.reduce([s.registers for s in sketches]))
+
+    def estimate(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / float(np.sum(np.power(2.0, -self.registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Corrección para rangos pequeños (linear counting)
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.p]) + zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "HyperLogLog":
+        if not data:
+            return cls()
+        p = data[0]
+        registers = np.frombuffer(zlib.decompress(data[1:]), dtype=np.uint8).copy()
+        return cls(p, registers)
+
+
+class ConfidenceHistogram:
+    """
+    Fixed-width histogram over [0, 1] that answers percentiles
+    """
+
+    def __init__(self, bins: int = 1000, counts: Optional[np.ndarray] = None):
+        self.bins = bins
+        self.counts = counts if counts is not None else np.zeros(bins, dtype=np.uint32)
+
+    def update(self, values: Iterable[float]) -> None:
+        array = np.clip(np.fromiter(values, dtype=np.float64), 0.0, 1.0)
+        if array.size:
+            index = np.minimum((array * self.bins).astype(np.int64), self.bins - 1)
+            self.counts += np.bincount(index, minlength=self.bins).astype(np.uint32)
+
+    def merge(self, other: "ConfidenceHistogram") -> "ConfidenceHistogram":
+        self.counts += other.counts
+        return self
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Percentile (0-100) interpolated linearly inside the bin
+        """
+        total = self.total
+        if not total:
+            return None
+        target = pct / 100.0 * total
+        cumulative = np.cumsum(self.counts, dtype=np.int64)
+        index = int(np.searchsorted(cumulative, max(target, 1e-12)))
+        index = min(index, self.bins - 1)
+        before = cumulative[index - 1] if index else 0
+        in_bin = self.counts[index]
+        fraction = (target - before) / in_bin if in_bin else 0.0
+        return round((index + min(max(fraction, 0.0), 1.0)) / self.bins, 4)
+
+    def restricted(self, lower: Optional[float], upper: Optional[float]) -> "ConfidenceHistogram":
+        """
+        Copy that keeps only the bins inside [lower, upper] (bin resolution)
+        """
+        counts = self.counts.copy()
+        if lower is not None:
+            counts[:min(int(lower * self.bins), self.bins)] = 0
+        if upper is not None:
+            counts[min(int(upper * self.bins) + 1, self.bins):] = 0
+        return ConfidenceHistogram(self.bins, counts)
+
+    def to_bytes(self) -> bytes:
+        return self.bins.to_bytes(4, "big") + zlib.compress(self.counts.astype("<u4").tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "ConfidenceHistogram":
+        if not data:
+            return cls()
+        bins = int.from_bytes(data[:4], "big")
+        counts = np.frombuffer(zlib.decompress(data[4:]), dtype="<u4").astype(np.uint32)
+        return cls(bins, counts)
@@ -0,0 +1,76 @@
+"""
+Startup timing report
+
+Mide las fases del arranque de cada worker (importación de la app, conexión a
+la base de datos, verificación del esquema) y el tiempo hasta servir la primera
+respuesta. Los tiempos se imprimen al arrancar y se exponen como gauges en
+/metrics/internal (``kaapeh_startup_seconds{phase=...}``).
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from app.core.telemetry import registry, Gauge
+
+startup_seconds = registry.register(Gauge(
+    "kaapeh_startup_seconds",
+    "Duration of each worker startup phase",
+    ("phase",),
+))
+
+
+class StartupReport:
+    """
+    Collects startup phase durations for the current worker
+    """
+
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+
+    def begin(self, started_at: float) -> None:
+        self.started_at = started_at
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = seconds
+        startup_seconds.set(seconds, phase=phase)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_first_request(self) -> None:
+        """
+        Record time from import start to the first completed response
+        """
+        if self.ready:
+            return
+        self.ready = True
+        if self.started_at is not None:
+            self.record("first_request", time.perf_counter() - self.started_at)
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+
+
+report = StartupReport()
+
+
+class FirstRequestMiddleware:
+    """
+    ASGI middleware that marks the worker ready after its first HTTP response
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if not report.ready and scope["type"] == "http":
+            report.mark_first_request()
@@ -0,0 +1,433 @@
+"""
+Operational telemetry in Prometheus text exposition format
+
+Registro de métricas en memoria (contadores, gauges e histogramas) sin
+dependencias externas. Cada operación es O(1) bajo un lock por métrica, y
+renderizar el registro completo solo recorre las series existentes, por lo que
+el endpoint puede consultarse cada pocos segundos sin costo apreciable.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Buckets por defecto (segundos) para latencias HTTP y de base de datos
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    Base class for labelled metrics
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing counter
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """
+    Cumulative histogram with fixed upper bounds
+    """
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por serie: [conteos por bucket..., +Inf], suma
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0])
+                self._series[key] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(c), s[0])) for k, (c, s) in self._series.items()]
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Collection of metrics rendered together
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """
+        Register a callback that refreshes gauges right before rendering
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ==================== HTTP ====================
+
+http_request_duration_seconds = registry.register(Histogram(
+    "kaapeh_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ("method", "route", "status"),
+))
+
+http_requests_in_flight = registry.register(Gauge(
+    "kaapeh_http_requests_in_flight",
+    "HTTP requests currently being served",
+))
+
+# ==================== SYNC INGEST ====================
+
+sync_rows_ingested_total = registry.register(Counter(
+    "kaapeh_sync_rows_ingested_total",
+    "Diagnosis rows ingested through /sync",
+))
+
+sync_upload_chunks_total = registry.register(Counter(
+    "kaapeh_sync_upload_chunks_total",
+    "Chunks received by resumable /sync uploads (stored or duplicate)",
+    ("result",),
+))
+
+sketch_update_failures_total = registry.register(Counter(
+    "kaapeh_sketch_update_failures_total",
+    "Ingested batches whose weekly sketch update failed (rows were kept)",
+))
+
+sync_rows_per_second = registry.register(Gauge(
+    "kaapeh_sync_rows_per_second",
+    "Rows ingested per second over the last scrape window",
+))
+
+# ==================== DATABASE ====================
+
+db_pool_checkout_seconds = registry.register(Histogram(
+    "kaapeh_db_pool_checkout_seconds",
+    "Time spent waiting for a pooled database connection",
+))
+
+db_read_sessions_total = registry.register(Counter(
+    "kaapeh_db_read_sessions_total",
+    "Read-only sessions handed out, by target (replica index or primary)",
+    ("target",),
+))
+
+db_replica_lag_seconds = registry.register(Gauge(
+    "kaapeh_db_replica_lag_seconds",
+    "Replication lag measured on the last health check (-1 = unreachable)",
+    ("replica",),
+))
+
+# ==================== LIVE STREAM ====================
+
+sse_subscribers = registry.register(Gauge(
+    "kaapeh_sse_subscribers",
+    "Open /metrics/stream connections on this worker",
+))
+
+sse_broadcasts_total = registry.register(Counter(
+    "kaapeh_sse_broadcasts_total",
+    "Dashboard deltas computed and fanned out to subscribers",
+))
+
+sse_overflows_total = registry.register(Counter(
+    "kaapeh_sse_overflows_total",
+    "Slow subscribers whose pending deltas were replaced by a snapshot",
+))
+
+query_cancellations_total = registry.register(Counter(
+    "kaapeh_query_cancellations_total",
+    "Queries cancelled by route deadline or client disconnect",
+    ("route", "reason"),
+))
+
+degraded_responses_total = registry.register(Counter(
+    "kaapeh_degraded_responses_total",
+    "Responses served from a stale cached result after a query deadline",
+    ("route",),
+))
+
+# ==================== BACKGROUND JOBS ====================
+
+maintenance_rows_updated_total = registry.register(Counter(
+    "kaapeh_maintenance_rows_updated_total",
+    "Rows rewritten by resumable background jobs",
+    ("kind",),
+))
+
+maintenance_job_progress = registry.register(Gauge(
+    "kaapeh_maintenance_job_progress_ratio",
+    "Fraction of the id range processed by the running background job",
+    ("kind",),
+))
+
+# ==================== EDGE REPLICATION ====================
+
+edge_replicated_rows_total = registry.register(Counter(
+    "kaapeh_edge_replicated_rows_total",
+    "Local diagnosis rows acknowledged by the central instance",
+))
+
+edge_replicated_bytes_total = registry.register(Counter(
+    "kaapeh_edge_replicated_bytes_total",
+    "Compressed bytes uploaded to the central instance",
+))
+
+edge_replication_failures_total = registry.register(Counter(
+    "kaapeh_edge_replication_failures_total",
+    "Failed replication uploads, by reason",
+    ("reason",),
+))
+
+edge_replication_backlog_rows = registry.register(Gauge(
+    "kaapeh_edge_replication_backlog_rows",
+    "Local diagnosis rows not yet acknowledged by the central instance",
+))
+
+edge_replication_batch_rows = registry.register(Gauge(
+    "kaapeh_edge_replication_batch_rows",
+    "Rows per batch chosen from the measured upload bandwidth",
+))
+
+edge_replication_bandwidth = registry.register(Gauge(
+    "kaapeh_edge_replication_bandwidth_bytes_per_second",
+    "Smoothed upload throughput to the central instance",
+))
+
+# ==================== CACHES ====================
+
+cache_hits_total = registry.register(Counter(
+    "kaapeh_cache_hits_total",
+    "Cache lookups served from cache",
+    ("cache",),
+))
+
+cache_misses_total = registry.register(Counter(
+    "kaapeh_cache_misses_total",
+    "Cache lookups that had to be computed",
+    ("cache",),
+))
+
+cache_hit_ratio = registry.register(Gauge(
+    "kaapeh_cache_hit_ratio",
+    "Cache hit ratio since process start",
+    ("cache",),
+))
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """
+    Count a cache hit or miss for the given cache name
+    """
+    if hit:
+        cache_hits_total.inc(cache=cache)
+    else:
+        cache_misses_total.inc(cache=cache)
+
+
+def _collect_cache_ratios() -> None:
+    caches = {key[0] for key in list(cache_hits_total._values) + list(cache_misses_total._values)}
+    for cache in caches:
+        hits = cache_hits_total.value(cache=cache)
+        total = hits + cache_misses_total.value(cache=cache)
+        cache_hit_ratio.set(hits / total if total else 0.0, cache=cache)
+
+
+class _RateTracker:
+    """
+    Turns a counter into a per-second rate between consecutive scrapes
+    """
+
+    def __init__(self, counter: Counter, gauge: Gauge):
+        self.counter = counter
+        self.gauge = gauge
+        self._last_value = 0.0
+        self._last_time: Optional[float] = None
+
+    def __call__(self) -> None:
+        now = time.monotonic()
+        value = self.counter.value()
+        if self._last_time is None or now <= self._last_time:
+            self.gauge.set(0.0)
+        else:
+            self.gauge.set((value - self._last_value) / (now - self._last_time))
+        self._last_value = value
+        self._last_time = now
+
+
+registry.add_collector(_collect_cache_ratios)
+registry.add_collector(_RateTracker(sync_rows_ingested_total, sync_rows_per_second))
+
+
+class TelemetryMiddleware:
+    """
+    ASGI middleware recording latency per route template and in-flight requests
+
+    Se usa la plantilla de la ruta (``/api/v1/analytics/heatmap``) y no la URL
+    concreta, para que la cardinalidad de las series quede acotada.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            http_request_duration_seconds.observe(
+                elapsed,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_holder["status"]),
+            )
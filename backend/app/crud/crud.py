@@ -3,14 +3,42 @@ CRUD operations for database models
 """
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Optional, Dict
-from datetime import datetime
+from sqlalchemy import func, case, text, update, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from typing import Optional, Dict, List, Iterable, Sequence, Tuple
+from datetime import datetime, timedelta
 
-from app.models.models import User, DiagnosisRecord, AccessibilityConfig, ActionItem
+from app.models.models import (
+    User, DiagnosisRecord, AccessibilityConfig, ActionItem, AggregatedMetrics, DiagnosisSketch, ChangeLogEntry,
+    MetricCounter, IssueTaxonomy, EdgeReplicationState, SyncUpload, SyncUploadChunk
+)
+from app.db import change_log, database  # change_log registra además el listener del change log
+from app.db.shards import shard_router, merge_sums, PRIMARY
 from app.schemas.schemas import UserCreate
 
 
+# Las escrituras son un solo INSERT/UPDATE ... RETURNING (más el change log
+# cuando aplica) y no hacen refresh: SessionLocal no expira los objetos al
+# hacer commit, así que lo devuelto por RETURNING ya es el estado confirmado.
+
+def _insert(db: Session, model):
+    """
+    INSERT with ON CONFLICT support for the session's dialect (PostgreSQL / SQLite)
+    """
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model)
+
+
+def _log_change(db: Session, entity: str, entity_id: int, user_id, op: str = "upsert") -> None:
+    """
+    Record one change for GET /sync/changes (RETURNING writes skip the flush listener)
+    """
+    change_log.record_changes(
+        db.connection(), [{"entity": entity, "entity_id": entity_id, "user_id": user_id, "op": op}]
+    )
+
+
 # ==================== USER OPERATIONS ====================
 
 def get_user_by_username(db: Session, username: str) -> Optional[User]:
@@ -27,55 +55,224 @@ def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
     return db.query(User).filter(User.id == user_id).first()
 
 
-def create_user(db: Session, user: UserCreate) -> User:
+def _user_values(user: UserCreate, now: datetime) -> dict:
+    return {
+        "username": user.username,
+        "display_name": user.display_name,
+        "device_id": user.device_id,
+        "role": user.role,
+        "preferred_language": user.preferred_language,
+        "created_at": now,
+        "last_login_at": now,
+    }
+
+
+def create_user(db: Session, user: UserCreate) -> Optional[User]:
     """
     Create new user with device_id support
+    
+    Returns None if the username already exists (ON CONFLICT DO NOTHING, so
+    two concurrent registrations never fail with an IntegrityError).
     """
-    db_user = User(
-        username=user.username,
-        display_name=user.display_name,
-        device_id=user.device_id,
-        role=user.role,
-        preferred_language=user.preferred_language,
-        created_at=datetime.utcnow(),
-        last_login_at=datetime.utcnow()
-    )
-    db.add(db_user)
+    db_user = db.execute(
+        _insert(db, User)
+        .values(**_user_values(user, datetime.utcnow()))
+        .on_conflict_do_nothing(index_elements=[User.username])
+        .returning(User)
+    ).scalar_one_or_none()
+    
+    if db_user is None:
+        return None
+    
+    _log_change(db, "user", db_user.id, db_user.id)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
+def login_user(db: Session, user: UserCreate) -> Tuple[User, bool]:
+    """
+    Create the user or update its last login in one upsert
+    
+    Returns:
+        (user, created)
+    """
+    now = datetime.utcnow()
+    db_user = db.execute(
+        _insert(db, User)
+        .values(**_user_values(user, now))
+        .on_conflict_do_update(index_elements=[User.username], set_={"last_login_at": now})
+        .returning(User),
+        execution_options={"populate_existing": True}
+    ).scalar_one()
+    
+    # Una fila recién insertada conserva created_at == now; una existente no
+    created = db_user.created_at == now
+    if created:
+        _log_change(db, "user", db_user.id, db_user.id)
+    db.commit()
+    return db_user, created
+
+
 def update_user_last_login(db: Session, user: User) -> User:
     """
     Update user's last login timestamp
     """
-    user.last_login_at = datetime.utcnow()
+    user = db.execute(
+        update(User)
+        .where(User.id == user.id)
+        .values(last_login_at=datetime.utcnow())
+        .returning(User),
+        execution_options={"populate_existing": True}
+    ).scalar_one()
     db.commit()
-    db.refresh(user)
     return user
 
 
 # ==================== DIAGNOSIS OPERATIONS ====================
 
+# Inserciones de diagnósticos (compartido, hasta el commit) contra el horizonte de snapshots (exclusivo)
+INGEST_LOCK_KEY = 0x4B4150_494E
+
+
+def _lock_ingest(db: Session) -> None:
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock_shared(:key)"), {"key": INGEST_LOCK_KEY})
+
+
 def create_diagnosis(db: Session, user_id: Optional[int], diagnosis_data: dict) -> DiagnosisRecord:
     """
     Create new diagnosis record
     """
-    db_diagnosis = DiagnosisRecord(
-        user_id=user_id,
-        timestamp=diagnosis_data.get("timestamp", datetime.utcnow()),
-        detected_issue=diagnosis_data["detected_issue"],
-        confidence=diagnosis_data["confidence"],
-        user_feedback_correct=diagnosis_data.get("user_feedback_correct"),
-        location=diagnosis_data.get("location")
-    )
-    db.add(db_diagnosis)
+    _lock_ingest(db)
+    db_diagnosis = db.execute(
+        _insert(db, DiagnosisRecord)
+        .values(
+            user_id=user_id,
+            timestamp=diagnosis_data.get("timestamp", datetime.utcnow()),
+            detected_issue=canonical_issue(diagnosis_data["detected_issue"]),
+            confidence=diagnosis_data["confidence"],
+            user_feedback_correct=diagnosis_data.get("user_feedback_correct"),
+            location=diagnosis_data.get("location")
+        )
+        .returning(DiagnosisRecord)
+    ).scalar_one()
     db.commit()
-    db.refresh(db_diagnosis)
     return db_diagnosis
 
 
+def insert_diagnoses(db: Session, rows: List[dict]) -> Optional[int]:
+    """
+    Insert many diagnosis rows with one executemany INSERT ... RETURNING id
+
+    Las filas ya vienen listas (user_id, timestamp, detected_issue, confidence,
+    user_feedback_correct, location); no se construye un objeto ORM por fila.
+    No hace commit.
+    
+    Returns:
+        Highest inserted id, or None if there were no rows
+    """
+    if not rows:
+        return None
+    _lock_ingest(db)
+    ids = db.execute(insert(DiagnosisRecord.__table__).returning(DiagnosisRecord.id), rows).scalars().all()
+    return max(ids)
+
+
+def insert_diagnoses_by_region(
+    db: Session, rows: List[dict], cooperative_id: Optional[str] = None
+) -> Dict[str, Optional[int]]:
+    """
+    Insert each row into the shard of its region (or the cooperative's shard)
+
+    Cada shard confirma su propia transacción; la parte de la base principal
+    queda en ``db`` sin commit, como en insert_diagnoses. No hay transacción
+    entre bases: un fallo a medias deja confirmados los shards ya escritos.
+    
+    Returns:
+        {shard: highest inserted id} for the shards that received rows
+    """
+    if ISSUE_REPLACEMENTS:
+        # Dispositivos con el modelo anterior siguen enviando los nombres viejos
+        for row in rows:
+            row["detected_issue"] = canonical_issue(row["detected_issue"])
+    
+    if not shard_router.enabled:
+        return {PRIMARY: insert_diagnoses(db, rows)}
+    
+    groups: Dict[str, List[dict]] = {}
+    for row in rows:
+        shard = shard_router.shard_for(region_of(row.get("location")), cooperative_id)
+        groups.setdefault(shard, []).append(row)
+    
+    max_ids = {}
+    for shard, shard_rows in groups.items():
+        if shard == PRIMARY:
+            max_ids[shard] = insert_diagnoses(db, shard_rows)
+            continue
+        shard_db = shard_router.session(shard)
+        try:
+            max_ids[shard] = insert_diagnoses(shard_db, shard_rows)
+            shard_db.commit()
+        finally:
+            shard_db.close()
+    return max_ids
+
+
+def apply_edge_batch(
+    db: Session,
+    node_id: str,
+    after_id: int,
+    through_id: int,
+    ids: List[int],
+    rows: List[dict],
+    cooperative_id: Optional[str] = None,
+) -> Tuple[int, List[dict], Dict[str, Optional[int]]]:
+    """
+    Apply a replication batch from an edge node exactly once (no commit)
+
+    ``rows`` son las filas del nodo con id en (after_id, through_id]. Las que
+    ya se aplicaron (reintento tras perder la respuesta, o un lote más grande
+    que el anterior) se omiten. Si el lote empieza después de lo aplicado no
+    se inserta nada: el nodo debe reenviar desde el ``applied_through_id``
+    devuelto. La fila de estado queda bloqueada hasta el commit, así dos
+    envíos simultáneos del mismo nodo no insertan dos veces. Con shards
+    regionales, las filas de otros shards se confirman antes que el cursor
+    (ver insert_diagnoses_by_region).
+    
+    Returns:
+        (applied_through_id, inserted rows, {shard: highest inserted id})
+    """
+    db.execute(
+        _insert(db, EdgeReplicationState)
+        .values(node_id=node_id, applied_through_id=0, rows_applied=0, batches_applied=0)
+        .on_conflict_do_nothing(index_elements=[EdgeReplicationState.node_id])
+    )
+    query = db.query(EdgeReplicationState).filter(EdgeReplicationState.node_id == node_id).populate_existing()
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update()
+    state = query.one()
+    
+    applied = state.applied_through_id
+    if after_id > applied or through_id <= applied:
+        return applied, [], {}
+    
+    new_rows = [row for row_id, row in zip(ids, rows) if row_id > applied]
+    max_ids = insert_diagnoses_by_region(db, new_rows, cooperative_id) if new_rows else {}
+    state.applied_through_id = through_id
+    state.rows_applied += len(new_rows)
+    state.batches_applied += 1
+    state.last_batch_at = datetime.utcnow()
+    db.flush()
+    return through_id, new_rows, max_ids
+
+
+def get_edge_replication_state(db: Session, node_id: str) -> Optional[EdgeReplicationState]:
+    """
+    Replication cursor of an edge node on this instance
+    """
+    return db.query(EdgeReplicationState).filter(EdgeReplicationState.node_id == node_id).first()
+
+
 def get_user_diagnoses(db: Session, user_id: int, limit: int = 100) -> list[DiagnosisRecord]:
     """
     Get user's diagnosis history
@@ -87,23 +284,115 @@ def get_user_diagnoses(db: Session, user_id: int, limit: int = 100) -> list[Diag
         .all()
 
 
+# ==================== RESUMABLE UPLOADS ====================
+
+def create_sync_upload(db: Session, upload_id: str, total_rows: int, chunk_size: int, ttl_seconds: float) -> SyncUpload:
+    """
+    Open a resumable upload session
+    """
+    now = datetime.utcnow()
+    upload = db.execute(
+        insert(SyncUpload).values(
+            id=upload_id, total_rows=total_rows, chunk_size=chunk_size, committed_chunks=0, rows_stored=0,
+            created_at=now, updated_at=now, expires_at=now + timedelta(seconds=ttl_seconds),
+        ).returning(SyncUpload)
+    ).scalar_one()
+    db.commit()
+    return upload
+
+
+def get_sync_upload(db: Session, upload_id: str) -> Optional[SyncUpload]:
+    """
+    Current state of an upload session (reloaded from the database)
+    """
+    return db.query(SyncUpload).filter(SyncUpload.id == upload_id).populate_existing().first()
+
+
+def store_upload_chunk(
+    db: Session, upload: SyncUpload, chunk: int, rows: List[dict], cooperative_id: Optional[str], ttl_seconds: float
+) -> Tuple[bool, Dict[str, Optional[int]]]:
+    """
+    Store one chunk of a resumable upload and advance its contiguous prefix (no commit)
+
+    La marca del chunk y sus filas se confirman juntas: un chunk que se
+    reenvía (la respuesta se perdió) no se vuelve a insertar. Con shards
+    regionales, las filas de otros shards se confirman antes que la marca
+    (ver insert_diagnoses_by_region).
+    
+    Returns:
+        (stored, {shard: highest inserted id}); stored is False for a chunk already received
+    """
+    now = datetime.utcnow()
+    marked = db.execute(
+        _insert(db, SyncUploadChunk)
+        .values(upload_id=upload.id, chunk=chunk, row_count=len(rows), received_at=now)
+        .on_conflict_do_nothing(index_elements=[SyncUploadChunk.upload_id, SyncUploadChunk.chunk])
+        .returning(SyncUploadChunk.chunk)
+    ).first()
+    max_ids = insert_diagnoses_by_region(db, rows, cooperative_id) if marked is not None else {}
+    
+    # Prefijo sin huecos; también en un reenvío, por si dos chunks llegaron a la vez
+    received = db.query(SyncUploadChunk.chunk).filter(
+        SyncUploadChunk.upload_id == upload.id, SyncUploadChunk.chunk >= upload.committed_chunks
+    ).order_by(SyncUploadChunk.chunk).all()
+    committed = upload.committed_chunks
+    for (index,) in received:
+        if index != committed:
+            break
+        committed += 1
+    
+    values = {"updated_at": now, "expires_at": now + timedelta(seconds=ttl_seconds)}
+    if marked is not None:
+        values["rows_stored"] = SyncUpload.rows_stored + len(rows)
+    if committed > upload.committed_chunks:
+        values["committed_chunks"] = func.max(SyncUpload.committed_chunks, committed) \
+            if db.get_bind().dialect.name == "sqlite" else func.greatest(SyncUpload.committed_chunks, committed)
+        if committed * upload.chunk_size >= upload.total_rows:
+            values["completed_at"] = func.coalesce(SyncUpload.completed_at, now)
+    db.execute(update(SyncUpload).where(SyncUpload.id == upload.id).values(**values))
+    return marked is not None, max_ids
+
+
+def purge_expired_uploads(db: Session) -> int:
+    """
+    Delete upload sessions (and their chunk marks) past expires_at; stored rows stay
+    """
+    now = datetime.utcnow()
+    expired = select(SyncUpload.id).where(SyncUpload.expires_at < now)
+    db.query(SyncUploadChunk).filter(SyncUploadChunk.upload_id.in_(expired)).delete(synchronize_session=False)
+    deleted = db.query(SyncUpload).filter(SyncUpload.expires_at < now).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
 # ==================== METRICS CALCULATIONS ====================
+# Con shards regionales cada métrica se calcula como conteos y sumas parciales
+# en todas las bases (en paralelo) y se combina aquí.
+
+def scatter(db: Session, fn) -> list:
+    """
+    fn(session) on the primary and, if configured, on every regional shard
+    """
+    if not shard_router.enabled:
+        return [fn(db)]
+    return list(shard_router.scatter(db, lambda shard_db, _: fn(shard_db)).values())
+
 
 def calculate_tpp(db: Session) -> float:
     """
     Calculate Tasa de Precisión Percibida (TPP)
     Percentage of diagnoses where user feedback was positive
     """
-    total = db.query(DiagnosisRecord)\
-        .filter(DiagnosisRecord.user_feedback_correct.isnot(None))\
-        .count()
+    parts = scatter(db, lambda session: session.query(
+        func.count(DiagnosisRecord.user_feedback_correct),
+        func.sum(case((DiagnosisRecord.user_feedback_correct == True, 1), else_=0))
+    ).one())
+    total = sum(part[0] for part in parts)
     
     if total == 0:
         return 0.0
     
-    correct = db.query(DiagnosisRecord)\
-        .filter(DiagnosisRecord.user_feedback_correct == True)\
-        .count()
+    correct = sum(part[1] or 0 for part in parts)
     
     return round((correct / total) * 100, 2)
 
@@ -113,25 +402,36 @@ def calculate_cpm(db: Session) -> float:
     Calculate Confiabilidad Promedio del Modelo (CPM)
     Average confidence of all diagnoses
     """
-    avg_confidence = db.query(func.avg(DiagnosisRecord.confidence))\
-        .scalar()
+    parts = scatter(db, lambda session: session.query(
+        func.count(DiagnosisRecord.confidence),
+        func.sum(DiagnosisRecord.confidence)
+    ).one())
+    count = sum(part[0] for part in parts)
     
-    if avg_confidence is None:
+    if count == 0:
         return 0.0
     
-    return round(float(avg_confidence) * 100, 2)
+    avg_confidence = sum(float(part[1] or 0) for part in parts) / count
+    return round(avg_confidence * 100, 2)
 
 
 def get_issue_distribution(db: Session) -> Dict[str, int]:
     """
     Get distribution of detected issues
     """
-    results = db.query(
-        DiagnosisRecord.detected_issue,
-        func.count(DiagnosisRecord.id)
-    ).group_by(DiagnosisRecord.detected_issue).all()
+    parts = scatter(db, lambda session: {
+        issue: [count] for issue, count in session.query(
+            DiagnosisRecord.detected_issue,
+            func.count(DiagnosisRecord.id)
+        ).group_by(DiagnosisRecord.detected_issue).all()
+    })
     
-    return {issue: count for issue, count in results}
+    distribution: Dict[str, int] = {}
+    for issue, (count,) in merge_sums(parts).items():
+        # Durante una re-categorización conviven nombres viejos y nuevos
+        issue = canonical_issue(issue)
+        distribution[issue] = distribution.get(issue, 0) + count
+    return distribution
 
 
 def calculate_nas(db: Session) -> Optional[float]:
@@ -151,8 +451,602 @@ def calculate_nas(db: Session) -> Optional[float]:
     return round((completed_actions / total_actions) * 100, 2)
 
 
+def get_nas(db: Session) -> Optional[float]:
+    """
+    NAS from the maintained action counters (no scan of action_items)
+    """
+    actions_total, actions_completed = get_action_counts(db)
+    if actions_total == 0:
+        return None
+    return round((actions_completed / actions_total) * 100, 2)
+
+
+# ==================== METRIC COUNTERS ====================
+
+def bump_metric_counters(db: Session, **deltas: int) -> None:
+    """
+    Add deltas to running counters inside the caller's transaction
+
+    Es un UPDATE atómico (value = value + delta), así que escrituras
+    concurrentes no pierden incrementos.
+    """
+    for name, delta in deltas.items():
+        if delta:
+            db.execute(
+                update(MetricCounter)
+                .where(MetricCounter.name == name)
+                .values(value=MetricCounter.value + delta, updated_at=datetime.utcnow())
+            )
+
+
+def reconcile_metric_counters(db: Session) -> Dict[str, int]:
+    """
+    Reset the counters to the table counts (after bulk writes that bypass crud)
+    """
+    values = database.reconcile_metric_counters(db.connection())
+    db.commit()
+    return values
+
+
+def get_action_counts(db: Session) -> Tuple[int, int]:
+    """
+    (total, completed) action items from the counters, counting the table only if they are missing
+    """
+    counters = dict(
+        db.query(MetricCounter.name, MetricCounter.value)
+        .filter(MetricCounter.name.in_(("actions_total", "actions_completed")))
+        .all()
+    )
+    if len(counters) == 2:
+        return counters["actions_total"], counters["actions_completed"]
+    
+    actions_total, actions_completed = db.query(
+        func.count(ActionItem.id),
+        func.sum(case((ActionItem.is_completed == True, 1), else_=0))
+    ).one()
+    return actions_total, actions_completed or 0
+
+
+# ==================== METRICS SNAPSHOTS ====================
+
+METRICS_SNAPSHOT_LOCK_KEY = 0x4B4150_4D53  # Un solo worker toma el snapshot
+
+def get_latest_metrics_snapshot(db: Session) -> Optional[AggregatedMetrics]:
+    """
+    Get the most recent metrics snapshot
+    """
+    return db.query(AggregatedMetrics)\
+        .order_by(AggregatedMetrics.timestamp.desc(), AggregatedMetrics.id.desc())\
+        .first()
+
+
+def committed_horizon(session: Session) -> int:
+    """
+    Highest diagnosis id such that no lower id can still be committed later
+
+    En PostgreSQL el id se asigna al insertar y se ve al confirmar: una
+    transacción lenta puede confirmar un id menor que otro ya visible, y un
+    cursor que pasara de largo no lo contaría nunca. Cada inserción toma
+    INGEST_LOCK_KEY compartido hasta su commit; aquí se toma exclusivo, en una
+    conexión aparte y solo para leer el máximo: en ese momento no hay
+    inserciones a medias y las siguientes reciben ids mayores. En SQLite hay un
+    solo escritor y los ids se ven en orden.
+    """
+    bind = session.get_bind()
+    if bind.dialect.name != "postgresql":
+        return session.query(func.max(DiagnosisRecord.id)).scalar() or 0
+    with bind.connect() as conn, conn.begin():
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": INGEST_LOCK_KEY})
+        return conn.execute(select(func.max(DiagnosisRecord.id))).scalar() or 0
+
+
+def create_metrics_snapshot(db: Session) -> AggregatedMetrics:
+    """
+    Create a metrics snapshot from the previous one plus the new diagnoses
+
+    Solo se agregan los diagnósticos con id entre el último incluido y el
+    horizonte confirmado (``committed_horizon``), de modo que el costo depende
+    de lo ingerido desde el snapshot anterior y no del tamaño de la historia.
+    Los diagnósticos solo se insertan (vía /sync), así que los acumulados no
+    necesitan recalcularse.
+    """
+    previous = get_latest_metrics_snapshot(db)
+    last_id = getattr(previous, "last_diagnosis_id", None) or 0
+    shard_cursors = dict(getattr(previous, "shard_cursors", None) or {})
+    total = getattr(previous, "total_diagnoses", None) or 0
+    feedback_total = getattr(previous, "feedback_total", None) or 0
+    feedback_correct = getattr(previous, "feedback_correct", None) or 0
+    confidence_sum = getattr(previous, "confidence_sum", None) or 0.0
+    distribution = {}
+    for issue, count in (getattr(previous, "issue_distribution", None) or {}).items():
+        # Las clases renombradas desde el snapshot anterior se suman a su sucesora
+        issue = canonical_issue(issue)
+        distribution[issue] = distribution.get(issue, 0) + count
+    
+    def delta(session: Session, after_id: int) -> Tuple[int, list]:
+        horizon = max(committed_horizon(session), after_id)
+        return horizon, session.query(
+            DiagnosisRecord.detected_issue,
+            func.count(DiagnosisRecord.id),
+            func.sum(DiagnosisRecord.confidence),
+            func.count(DiagnosisRecord.user_feedback_correct),
+            func.sum(case((DiagnosisRecord.user_feedback_correct == True, 1), else_=0))
+        ).filter(DiagnosisRecord.id > after_id, DiagnosisRecord.id <= horizon)\
+            .group_by(DiagnosisRecord.detected_issue)\
+            .all()
+    
+    # Cada shard tiene su propio cursor de ids (los ids se repiten entre bases)
+    if shard_router.enabled:
+        deltas = shard_router.scatter(
+            db,
+            lambda shard_db, shard: delta(shard_db, shard_cursors.get(shard, 0)),
+            primary_fn=lambda primary_db: delta(primary_db, last_id)
+        )
+    else:
+        deltas = {PRIMARY: delta(db, last_id)}
+    
+    for shard, (horizon, rows) in deltas.items():
+        for issue, count, conf_sum, fb_count, fb_correct in rows:
+            distribution[issue] = distribution.get(issue, 0) + count
+            total += count
+            confidence_sum += conf_sum or 0.0
+            feedback_total += fb_count or 0
+            feedback_correct += fb_correct or 0
+        # Todo id hasta el horizonte ya está contado (o nunca se confirmará)
+        if shard == PRIMARY:
+            last_id = horizon
+        else:
+            shard_cursors[shard] = horizon
+    
+    # Las acciones cambian de estado, así que NAS se toma del estado actual
+    actions_total, actions_completed = get_action_counts(db)
+    
+    snapshot = AggregatedMetrics(
+        timestamp=datetime.utcnow(),
+        tpp=round(feedback_correct / feedback_total * 100, 2) if feedback_total else 0.0,
+        cpm=round(confidence_sum / total * 100, 2) if total else 0.0,
+        nas=round(actions_completed / actions_total * 100, 2) if actions_total else None,
+        total_diagnoses=total,
+        issue_distribution=distribution,
+        last_diagnosis_id=last_id,
+        shard_cursors=shard_cursors or None,
+        feedback_total=feedback_total,
+        feedback_correct=feedback_correct,
+        confidence_sum=confidence_sum,
+        actions_total=actions_total,
+        actions_completed=actions_completed
+    )
+    db.add(snapshot)
+    db.commit()
+    db.refresh(snapshot)
+    return snapshot
+
+
+def create_metrics_snapshot_if_due(db: Session, interval_seconds: float) -> Optional[AggregatedMetrics]:
+    """
+    Create a snapshot unless another worker already took one this period
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        locked = db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": METRICS_SNAPSHOT_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            return None
+    
+    latest = get_latest_metrics_snapshot(db)
+    if latest and (datetime.utcnow() - latest.timestamp).total_seconds() < interval_seconds * 0.9:
+        db.rollback()
+        return None
+    
+    return create_metrics_snapshot(db)
+
+
+def get_metrics_history(
+    db: Session,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 500
+) -> List[AggregatedMetrics]:
+    """
+    Get stored snapshots in chronological order (no recomputation)
+    """
+    query = db.query(AggregatedMetrics)
+    if since:
+        query = query.filter(AggregatedMetrics.timestamp >= since)
+    if until:
+        query = query.filter(AggregatedMetrics.timestamp <= until)
+    
+    # Los más recientes primero para aplicar el límite, luego en orden cronológico
+    snapshots = query.order_by(AggregatedMetrics.timestamp.desc()).limit(limit).all()
+    return list(reversed(snapshots))
+
+
+# ==================== SKETCH OPERATIONS ====================
+
+def week_start(timestamp: datetime) -> datetime:
+    """
+    Monday 00:00 of the timestamp's week (sketch time bucket)
+    """
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    return day - timedelta(days=day.weekday())
+
+
+def region_of(location: Optional[str]) -> str:
+    """
+    Region of a location string ("Tapachula, Chiapas" -> "Chiapas")
+    """
+    if not location:
+        return "Sin ubicación"
+    return location.rsplit(",", 1)[-1].strip() or location
+
+
+def _merge_sketch_rows(db: Session, groups: dict) -> None:
+    """
+    Merge grouped partial sketches into diagnosis_sketches (one SELECT + writes)
+    """
+    buckets = {key[0] for key in groups}
+    issues = {key[1] for key in groups}
+    query = db.query(DiagnosisSketch).filter(
+        DiagnosisSketch.bucket_start.in_(buckets),
+        DiagnosisSketch.detected_issue.in_(issues)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update()
+    existing = {(s.bucket_start, s.detected_issue, s.location): s for s in query.all()}
+    
+    from app.core.sketches import HyperLogLog, ConfidenceHistogram  # numpy, al primer uso
+    
+    now = datetime.utcnow()
+    for key, (count, devices, confidences) in groups.items():
+        sketch = existing.get(key)
+        if sketch is None:
+            sketch = DiagnosisSketch(
+                bucket_start=key[0], detected_issue=key[1], location=key[2], diagnoses_count=0
+            )
+            db.add(sketch)
+        
+        hll = HyperLogLog.from_bytes(sketch.devices_hll)
+        hll.update(devices)
+        histogram = ConfidenceHistogram.from_bytes(sketch.confidence_hist)
+        histogram.update(confidences)
+        
+        sketch.diagnoses_count = (sketch.diagnoses_count or 0) + count
+        sketch.devices_hll = hll.to_bytes()
+        sketch.confidence_hist = histogram.to_bytes()
+        sketch.updated_at = now
+
+
+def update_diagnosis_sketches(db: Session, rows: Iterable[dict], attempts: int = 2) -> None:
+    """
+    Fold new diagnoses into the weekly sketches
+
+    Cada fila es un dict con timestamp, detected_issue, confidence, location y
+    ``identity`` (dispositivo o usuario, puede ser None). Los sketches son
+    derivados: se actualizan en su propia transacción después de guardar los
+    diagnósticos y pueden reconstruirse con rebuild_diagnosis_sketches.
+    """
+    groups: Dict[tuple, list] = {}
+    for row in rows:
+        key = (week_start(row["timestamp"]), row["detected_issue"], row.get("location") or "")
+        group = groups.setdefault(key, [0, [], []])
+        group[0] += 1
+        if row.get("identity"):
+            group[1].append(row["identity"])
+        group[2].append(row["confidence"])
+    
+    if not groups:
+        return
+    
+    for attempt in range(attempts):
+        try:
+            _merge_sketch_rows(db, groups)
+            db.commit()
+            return
+        except IntegrityError:
+            # Otro worker creó la misma llave al mismo tiempo: reintentar sobre su fila
+            db.rollback()
+            if attempt == attempts - 1:
+                raise
+
+
+def rebuild_diagnosis_sketches(db: Session, batch_size: int = 50000,
+                               archived_until: Optional[datetime] = None) -> int:
+    """
+    Rebuild the sketches from diagnosis_records (user-linked rows count as identities)
+
+    Los meses archivados en Parquet ya no están en diagnosis_records: con
+    ``archived_until`` (``archive.archived_until()``) se conservan tal cual
+    los sketches de las semanas que empiezan antes de esa fecha, incluida la
+    que la cruza, y solo se reconstruyen las semanas siguientes.
+    """
+    since = None
+    if archived_until is not None:
+        since = week_start(archived_until)
+        if since < archived_until:
+            since += timedelta(days=7)
+    
+    sketches = db.query(DiagnosisSketch)
+    if since is not None:
+        sketches = sketches.filter(DiagnosisSketch.bucket_start >= since)
+    sketches.delete()
+    db.commit()
+    
+    last_id = 0
+    processed = 0
+    while True:
+        query = db.query(
+            DiagnosisRecord.id,
+            DiagnosisRecord.timestamp,
+            DiagnosisRecord.detected_issue,
+            DiagnosisRecord.confidence,
+            DiagnosisRecord.location,
+            DiagnosisRecord.user_id
+        ).filter(DiagnosisRecord.id > last_id)
+        if since is not None:
+            query = query.filter(DiagnosisRecord.timestamp >= since)
+        batch = query.order_by(DiagnosisRecord.id)\
+            .limit(batch_size)\
+            .all()
+        if not batch:
+            return processed
+        
+        update_diagnosis_sketches(db, (
+            {
+                "timestamp": r.timestamp,
+                "detected_issue": r.detected_issue,
+                "confidence": r.confidence,
+                "location": r.location,
+                "identity": f"user:{r.user_id}" if r.user_id else None,
+            }
+            for r in batch
+        ))
+        last_id = batch[-1].id
+        processed += len(batch)
+
+
+def merge_sketch_issues(db: Session, mapping: Dict[str, str], attempts: int = 2) -> int:
+    """
+    Fold the weekly sketches of renamed issues into those of their successors
+
+    Returns:
+        Number of sketch rows folded
+    """
+    for attempt in range(attempts):
+        try:
+            old_rows = db.query(DiagnosisSketch).filter(DiagnosisSketch.detected_issue.in_(list(mapping))).all()
+            if not old_rows:
+                return 0
+            query = db.query(DiagnosisSketch).filter(
+                DiagnosisSketch.bucket_start.in_({row.bucket_start for row in old_rows}),
+                DiagnosisSketch.detected_issue.in_(set(mapping.values()))
+            )
+            if db.get_bind().dialect.name == "postgresql":
+                query = query.with_for_update()
+            targets = {(s.bucket_start, s.detected_issue, s.location): s for s in query.all()}
+            
+            from app.core.sketches import HyperLogLog, ConfidenceHistogram  # numpy, al primer uso
+            
+            now = datetime.utcnow()
+            for row in old_rows:
+                key = (row.bucket_start, mapping[row.detected_issue], row.location)
+                target = targets.get(key)
+                if target is None:
+                    target = targets[key] = DiagnosisSketch(
+                        bucket_start=key[0], detected_issue=key[1], location=key[2], diagnoses_count=0
+                    )
+                    db.add(target)
+                target.diagnoses_count = (target.diagnoses_count or 0) + (row.diagnoses_count or 0)
+                target.devices_hll = HyperLogLog.from_bytes(target.devices_hll)\
+                    .merge(HyperLogLog.from_bytes(row.devices_hll)).to_bytes()
+                target.confidence_hist = ConfidenceHistogram.from_bytes(target.confidence_hist)\
+                    .merge(ConfidenceHistogram.from_bytes(row.confidence_hist)).to_bytes()
+                target.updated_at = now
+                db.delete(row)
+            db.commit()
+            return len(old_rows)
+        except IntegrityError:
+            # /sync creó la misma llave al mismo tiempo: reintentar sobre su fila
+            db.rollback()
+            if attempt == attempts - 1:
+                raise
+
+
+def get_diagnosis_sketches(db: Session, where: Sequence = ()) -> List[DiagnosisSketch]:
+    """
+    Load the sketch rows that match the given conditions
+
+    Las condiciones salen de ``AnalyticsFilters.sketch_predicates``.
+    """
+    return db.query(DiagnosisSketch).filter(*where).all()
+
+
+# ==================== BULK COLUMN READS ====================
+
+def get_feedback_columns(db: Session, issue: Optional[str] = None, where: Sequence = ()):
+    """
+    Bulk-read confidence and feedback of diagnoses with feedback as NumPy arrays
+
+    Se leen solo las columnas necesarias directo del cursor (sin objetos ORM);
+    detected_issue solo se lee cuando no se filtra por un problema concreto,
+    y se devuelve codificado como enteros.
+
+    Returns:
+        (confidence float64[], correct bool[], issue_codes int64[], issue_names list)
+    """
+    import numpy as np
+    
+    columns = [DiagnosisRecord.confidence, DiagnosisRecord.user_feedback_correct]
+    if issue is None:
+        columns.append(DiagnosisRecord.detected_issue)
+    
+    query = db.query(*columns).filter(DiagnosisRecord.user_feedback_correct.isnot(None), *where)
+    if issue is not None:
+        query = query.filter(DiagnosisRecord.detected_issue == issue)
+    
+    rows = db.execute(query.statement).all()
+    values = list(zip(*rows)) if rows else [(), (), ()]
+    confidence = np.asarray(values[0], dtype=np.float64)
+    correct = np.asarray(values[1], dtype=bool)
+    
+    if issue is not None:
+        return confidence, correct, np.zeros(len(confidence), dtype=np.int64), [issue]
+    
+    names, codes = np.unique(np.asarray(values[2], dtype=object), return_inverse=True)
+    return confidence, correct, codes.astype(np.int64), list(names)
+
+
+# ==================== CATEGORY OPERATIONS ====================
+
+# Las 15 clases del modelo CoreML (como las envía la app) agrupadas en categorías
+ISSUE_CATEGORIES: Dict[str, str] = {
+    "Deficiencia de Nitrógeno (N)": "Deficiencias Nutricionales",
+    "Deficiencia de Fósforo (P)": "Deficiencias Nutricionales",
+    "Deficiencia de Potasio (K)": "Deficiencias Nutricionales",
+    "Deficiencia de Calcio (Ca)": "Deficiencias Nutricionales",
+    "Deficiencia de Magnesio (Mg)": "Deficiencias Nutricionales",
+    "Deficiencia de Hierro (Fe)": "Deficiencias Nutricionales",
+    "Deficiencia de Manganeso (Mn)": "Deficiencias Nutricionales",
+    "Deficiencia de Boro (B)": "Deficiencias Nutricionales",
+    "Múltiples Deficiencias Nutricionales": "Deficiencias Nutricionales",
+    "Roya del Café": "Enfermedades",
+    "Mancha de Phoma": "Enfermedades",
+    "Ojo de Gallo (Cercospora)": "Enfermedades",
+    "Minador de la Hoja": "Plagas",
+    "Araña Roja": "Plagas",
+    "Planta Saludable": "Planta Saludable",
+}
+
+CATEGORIES = [
+    "Deficiencias Nutricionales",
+    "Enfermedades",
+    "Plagas",
+    "Planta Saludable",
+    "Otros",
+]
+
+# Palabras clave para variantes de texto que no coinciden exactamente
+_CATEGORY_KEYWORDS = [
+    (("deficiencia",), "Deficiencias Nutricionales"),
+    (("roya", "phoma", "cercospora", "ojo de gallo"), "Enfermedades"),
+    (("minador", "araña", "broca"), "Plagas"),
+    (("saludable", "sana"), "Planta Saludable"),
+]
+
+
+def categorize_issue(issue: Optional[str]) -> str:
+    """
+    Map a detected issue to one of the 5 dashboard categories
+    """
+    if not issue:
+        return "Otros"
+    
+    category = ISSUE_CATEGORIES.get(issue)
+    if category:
+        return category
+    
+    lowered = issue.lower()
+    for keywords, keyword_category in _CATEGORY_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return keyword_category
+    
+    return "Otros"
+
+
+# ==================== TAXONOMY ====================
+
+# Clases del código, antes de aplicar las filas de issue_taxonomy
+_BASE_ISSUE_CATEGORIES = dict(ISSUE_CATEGORIES)
+
+# Renombres vigentes (issue_taxonomy.replaced_by): nombre anterior -> nombre nuevo
+ISSUE_REPLACEMENTS: Dict[str, str] = {}
+
+
+def canonical_issue(issue: Optional[str]) -> Optional[str]:
+    """
+    Current name of a detected issue, following renames and splits
+    """
+    seen = set()
+    while issue in ISSUE_REPLACEMENTS and issue not in seen:
+        seen.add(issue)
+        issue = ISSUE_REPLACEMENTS[issue]
+    return issue
+
+
+def load_issue_taxonomy(db: Session) -> int:
+    """
+    Apply issue_taxonomy on top of ISSUE_CATEGORIES in this process
+
+    Los diccionarios se modifican en el lugar (otros módulos los importaron)
+    y sin vaciarlos antes, para que un request concurrente no vea un
+    estado intermedio.
+    
+    Returns:
+        Number of taxonomy rows
+    """
+    rows = db.query(IssueTaxonomy).all()
+    categories = dict(_BASE_ISSUE_CATEGORIES)
+    replacements = {}
+    for row in rows:
+        categories[row.issue] = row.category
+        if row.replaced_by:
+            replacements[row.issue] = row.replaced_by
+    
+    for target, values in ((ISSUE_CATEGORIES, categories), (ISSUE_REPLACEMENTS, replacements)):
+        target.update(values)
+        for key in set(target) - set(values):
+            target.pop(key, None)
+    return len(rows)
+
+
+def save_issue_taxonomy(db: Session, renames: Dict[str, str], categories: Dict[str, str]) -> None:
+    """
+    Upsert taxonomy rows for new classes and renamed ones (no commit)
+
+    Una clase renombrada o dividida apunta a su sucesora (en una división,
+    a la que hereda los diagnósticos históricos); un nombre que vuelve a ser
+    destino deja de estar reemplazado.
+    """
+    now = datetime.utcnow()
+    values = {}
+    for issue, category in categories.items():
+        values[issue] = {"issue": issue, "category": category, "replaced_by": None, "updated_at": now}
+    for old, new in renames.items():
+        values.setdefault(new, {
+            "issue": new, "category": categories.get(new) or ISSUE_CATEGORIES.get(new) or categorize_issue(old),
+            "replaced_by": None, "updated_at": now,
+        })
+        values[old] = {"issue": old, "category": values[new]["category"], "replaced_by": new, "updated_at": now}
+    
+    if not values:
+        return
+    statement = _insert(db, IssueTaxonomy).values(list(values.values()))
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[IssueTaxonomy.issue],
+        set_={
+            "category": statement.excluded.category,
+            "replaced_by": statement.excluded.replaced_by,
+            "updated_at": statement.excluded.updated_at,
+        }
+    ))
+
+
+def get_category_distribution(db: Session) -> Dict[str, int]:
+    """
+    Get distribution of diagnoses grouped by category
+    """
+    distribution = {category: 0 for category in CATEGORIES}
+    for issue, count in get_issue_distribution(db).items():
+        distribution[categorize_issue(issue)] += count
+    return distribution
+
+
 # ==================== ACCESSIBILITY CONFIG OPERATIONS ====================
 
+_CONFIG_FIELDS = (
+    "large_text_enabled", "high_contrast_enabled", "voice_interaction_preferred", "onboarding_completed"
+)
+
+
 def get_or_create_accessibility_config(db: Session, user_id: int) -> AccessibilityConfig:
     """
     Get or create accessibility configuration for user
@@ -160,28 +1054,43 @@ def get_or_create_accessibility_config(db: Session, user_id: int) -> Accessibili
     config = db.query(AccessibilityConfig)\
         .filter(AccessibilityConfig.user_id == user_id)\
         .first()
+    if config:
+        return config
     
-    if not config:
-        config = AccessibilityConfig(user_id=user_id)
-        db.add(config)
-        db.commit()
-        db.refresh(config)
+    config = db.execute(
+        _insert(db, AccessibilityConfig)
+        .values(user_id=user_id)
+        .on_conflict_do_nothing(index_elements=[AccessibilityConfig.user_id])
+        .returning(AccessibilityConfig)
+    ).scalar_one_or_none()
     
+    if config is None:
+        # Otro request la creó entre el SELECT y el INSERT
+        return db.query(AccessibilityConfig).filter(AccessibilityConfig.user_id == user_id).one()
+    
+    _log_change(db, "accessibility_config", config.id, user_id)
+    db.commit()
     return config
 
 
 def update_accessibility_config(db: Session, user_id: int, config_data: dict) -> AccessibilityConfig:
     """
-    Update accessibility configuration
+    Update accessibility configuration (created if missing, in the same upsert)
     """
-    config = get_or_create_accessibility_config(db, user_id)
+    values = {key: value for key, value in config_data.items() if key in _CONFIG_FIELDS}
+    if not values:
+        return get_or_create_accessibility_config(db, user_id)
     
-    for key, value in config_data.items():
-        if hasattr(config, key):
-            setattr(config, key, value)
+    config = db.execute(
+        _insert(db, AccessibilityConfig)
+        .values(user_id=user_id, **values)
+        .on_conflict_do_update(index_elements=[AccessibilityConfig.user_id], set_=values)
+        .returning(AccessibilityConfig),
+        execution_options={"populate_existing": True}
+    ).scalar_one()
     
+    _log_change(db, "accessibility_config", config.id, user_id)
     db.commit()
-    db.refresh(config)
     return config
 
 
@@ -191,24 +1100,165 @@ def create_action_item(db: Session, diagnosis_id: int, description: str) -> Acti
     """
     Create action item for a diagnosis
     """
-    action = ActionItem(
-        diagnosis_id=diagnosis_id,
-        description_text=description,
-        is_completed=False
-    )
-    db.add(action)
+    action = db.execute(
+        _insert(db, ActionItem)
+        .values(diagnosis_id=diagnosis_id, description_text=description, is_completed=False)
+        .returning(ActionItem)
+    ).scalar_one()
+    bump_metric_counters(db, actions_total=1)
+    _log_change(db, "action_item", action.id, change_log.action_item_owner(diagnosis_id))
     db.commit()
-    db.refresh(action)
     return action
 
 
+def _completion_differs(is_completed: bool):
+    """
+    Rows whose completion state is not already ``is_completed``
+    """
+    if is_completed:
+        return or_(ActionItem.is_completed.is_(None), ActionItem.is_completed == False)
+    return ActionItem.is_completed == True
+
+
 def update_action_item_status(db: Session, action_id: int, is_completed: bool) -> ActionItem:
     """
     Update action item completion status
     """
-    action = db.query(ActionItem).filter(ActionItem.id == action_id).first()
-    if action:
-        action.is_completed = is_completed
-        db.commit()
-        db.refresh(action)
+    action = db.execute(
+        update(ActionItem)
+        .where(ActionItem.id == action_id, _completion_differs(is_completed))
+        .values(is_completed=is_completed)
+        .returning(ActionItem),
+        execution_options={"populate_existing": True}
+    ).scalar_one_or_none()
+    
+    if action is None:
+        # No existe o ya tenía ese estado: nada que escribir
+        return db.query(ActionItem).filter(ActionItem.id == action_id).first()
+    
+    bump_metric_counters(db, actions_completed=1 if is_completed else -1)
+    _log_change(db, "action_item", action.id, change_log.action_item_owner(action.diagnosis_id))
+    db.commit()
     return action
+
+
+def create_action_items(db: Session, diagnosis_id: int, items: List[dict]) -> List[ActionItem]:
+    """
+    Create all action items of a diagnosis in one transaction
+
+    Un solo flush (INSERT en lote con RETURNING de los ids) y los contadores
+    de NAS en la misma transacción.
+    """
+    actions = [
+        ActionItem(
+            diagnosis_id=diagnosis_id,
+            description_text=item["description_text"],
+            is_completed=bool(item.get("is_completed"))
+        )
+        for item in items
+    ]
+    db.add_all(actions)
+    db.flush()
+    bump_metric_counters(
+        db,
+        actions_total=len(actions),
+        actions_completed=sum(1 for action in actions if action.is_completed)
+    )
+    db.commit()
+    return actions
+
+
+def update_action_items_status(db: Session, updates: Dict[int, bool]) -> Tuple[List[int], List[int]]:
+    """
+    Set the completion state of many action items in one transaction
+
+    Un UPDATE ... RETURNING por estado destino, que solo toca las filas cuyo
+    estado cambia; con esas filas se ajustan los contadores de NAS y se
+    registra el change log.
+    
+    Returns:
+        (ids whose state changed, ids that do not exist)
+    """
+    existing = {
+        action_id for (action_id,) in
+        db.query(ActionItem.id).filter(ActionItem.id.in_(list(updates))).all()
+    }
+    
+    changed: Dict[int, Optional[int]] = {}
+    completed_delta = 0
+    for value in (True, False):
+        ids = [action_id for action_id, target in updates.items() if target == value and action_id in existing]
+        if not ids:
+            continue
+        rows = db.execute(
+            update(ActionItem)
+            .where(ActionItem.id.in_(ids), _completion_differs(value))
+            .values(is_completed=value)
+            .returning(ActionItem.id, ActionItem.diagnosis_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        changed.update(rows)
+        completed_delta += len(rows) if value else -len(rows)
+    
+    bump_metric_counters(db, actions_completed=completed_delta)
+    
+    # El UPDATE masivo no pasa por el flush: registrar el change log aquí
+    entries = [
+        {"entity": "action_item", "entity_id": action_id, "user_id": None, "op": "upsert"}
+        for action_id in changed
+    ]
+    if entries:
+        conn = db.connection()
+        change_log.fill_action_item_owners(conn, entries, changed)
+        change_log.record_changes(conn, entries)
+    
+    db.commit()
+    return sorted(changed), sorted(set(updates) - existing)
+
+
+# ==================== CHANGE LOG OPERATIONS ====================
+
+def get_changes(db: Session, since: int, user_id: Optional[int] = None, limit: int = 500) -> dict:
+    """
+    Changes after the ``since`` cursor, compacted to the latest state per entity
+
+    Cada entidad se devuelve como columnas + filas (sin repetir nombres de
+    campo) con su estado actual, más los ids borrados. Si una entidad cambió
+    varias veces dentro del lote se envía una sola vez.
+    """
+    query = db.query(ChangeLogEntry.seq, ChangeLogEntry.entity, ChangeLogEntry.entity_id, ChangeLogEntry.op)\
+        .filter(ChangeLogEntry.seq > since)
+    if user_id is not None:
+        query = query.filter(ChangeLogEntry.user_id == user_id)
+    
+    entries = query.order_by(ChangeLogEntry.seq).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    
+    # Última operación por entidad dentro del lote
+    latest: Dict[tuple, str] = {}
+    for _, entity, entity_id, op in entries:
+        latest[(entity, entity_id)] = op
+    
+    changes = {}
+    for entity, (model, columns, _) in change_log.ENTITIES.items():
+        upserted = [entity_id for (name, entity_id), op in latest.items() if name == entity and op == "upsert"]
+        deleted = sorted(entity_id for (name, entity_id), op in latest.items() if name == entity and op == "delete")
+        rows = []
+        if upserted:
+            rows = db.query(*[getattr(model, column) for column in columns])\
+                .filter(model.id.in_(upserted))\
+                .order_by(model.id)\
+                .all()
+        if rows or deleted:
+            changes[entity] = {
+                "columns": list(columns),
+                "rows": [list(row) for row in rows],
+                "deleted": deleted
+            }
+    
+    return {
+        "cursor": entries[-1].seq if entries else since,
+        "has_more": has_more,
+        "changes": changes
+    }
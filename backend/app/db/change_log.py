@@ -0,0 +1,128 @@
+"""
+Change log for delta download sync
+
+Un listener ``after_flush`` de las sesiones registra en ``change_log`` cada
+alta, cambio o baja de los registros que los dispositivos descargan (perfil de
+usuario, AccessibilityConfig y ActionItem), en la misma transacción que el
+cambio. ``GET /sync/changes?since=<seq>`` solo lee las entradas posteriores al
+cursor del dispositivo, así que el costo depende de lo que cambió y no del
+tamaño de las tablas.
+
+En PostgreSQL las inserciones al log toman un advisory lock de transacción:
+los números de secuencia quedan en el mismo orden en que se confirman las
+transacciones y un cursor nunca salta una entrada que se confirma más tarde.
+
+Las sentencias que no pasan por el flush (``update()``/``insert()`` con
+RETURNING de crud y las operaciones masivas) registran sus cambios con
+``record_changes``.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, insert, select, text
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+from app.models.models import AccessibilityConfig, ActionItem, ChangeLogEntry, DiagnosisRecord, User
+
+CHANGE_LOG_LOCK_KEY = 0x4B4150_434C  # Serializa las escrituras al log
+
+# Entidad -> (modelo, columnas que se envían, columnas cuyo cambio se registra; None = todas)
+ENTITIES = {
+    "user": (
+        User,
+        ("id", "username", "display_name", "role", "preferred_language", "device_id"),
+        ("username", "display_name", "role", "preferred_language", "device_id"),
+    ),
+    "accessibility_config": (
+        AccessibilityConfig,
+        ("id", "user_id", "large_text_enabled", "high_contrast_enabled",
+         "voice_interaction_preferred", "onboarding_completed"),
+        None,
+    ),
+    "action_item": (
+        ActionItem,
+        ("id", "diagnosis_id", "description_text", "is_completed", "created_at"),
+        None,
+    ),
+}
+
+_ENTITY_BY_MODEL = {model: name for name, (model, _, _) in ENTITIES.items()}
+
+
+def _changed(obj, fields: Optional[Tuple[str, ...]]) -> bool:
+    state = inspect(obj)
+    names = fields or [attr.key for attr in state.mapper.column_attrs]
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def fill_action_item_owners(conn, entries: List[dict], action_diagnoses: Dict[int, Optional[int]]) -> None:
+    """
+    Fill user_id of action items from their diagnosis (one query)
+    """
+    diagnosis_ids = {diagnosis_id for diagnosis_id in action_diagnoses.values() if diagnosis_id is not None}
+    owners = {}
+    if diagnosis_ids:
+        owners = dict(conn.execute(
+            select(DiagnosisRecord.id, DiagnosisRecord.user_id).where(DiagnosisRecord.id.in_(diagnosis_ids))
+        ).all())
+    for entry in entries:
+        if entry["entity"] == "action_item":
+            entry["user_id"] = owners.get(action_diagnoses.get(entry["entity_id"]))
+
+
+def action_item_owner(diagnosis_id: int):
+    """
+    user_id of an action item as a subquery, so logging it needs no extra SELECT
+    """
+    return select(DiagnosisRecord.user_id).where(DiagnosisRecord.id == diagnosis_id).scalar_subquery()
+
+
+def record_changes(conn, entries: Iterable[dict]) -> None:
+    """
+    Append entries ({entity, entity_id, user_id, op}) to the change log on ``conn``
+
+    Una sola entrada puede traer expresiones SQL como valor (``action_item_owner``).
+    """
+    entries = list(entries)
+    if not entries:
+        return
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGE_LOG_LOCK_KEY})
+    now = datetime.utcnow()
+    if len(entries) == 1:
+        conn.execute(insert(ChangeLogEntry).values(**entries[0], changed_at=now))
+    else:
+        conn.execute(insert(ChangeLogEntry), [{**entry, "changed_at": now} for entry in entries])
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    entries = []
+    action_diagnoses = {}
+
+    for objects, op in ((session.new, "upsert"), (session.dirty, "upsert"), (session.deleted, "delete")):
+        for obj in objects:
+            entity = _ENTITY_BY_MODEL.get(type(obj))
+            if entity is None:
+                continue
+            if op == "upsert" and obj not in session.new and not _changed(obj, ENTITIES[entity][2]):
+                continue
+            if entity == "user":
+                user_id = obj.id
+            elif entity == "accessibility_config":
+                user_id = obj.user_id
+            else:
+                user_id = None
+                action_diagnoses[obj.id] = obj.diagnosis_id
+            entries.append({"entity": entity, "entity_id": obj.id, "user_id": user_id, "op": op})
+
+    if not entries:
+        return
+    conn = session.connection()
+    if action_diagnoses:
+        fill_action_item_owners(conn, entries, action_diagnoses)
+    record_changes(conn, entries)
+
+
+event.listen(SessionLocal, "after_flush", _after_flush)
@@ -2,10 +2,16 @@
 Database connection and session management
 """
 
-from sqlalchemy import create_engine
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from app.core.config import settings
+from app.core.telemetry import db_pool_checkout_seconds, db_read_sessions_total, db_replica_lag_seconds
 
 # Create engine
 engine = create_engine(
@@ -13,26 +19,318 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
 )
 
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # journal_mode=WAL queda guardado en el archivo; el resto es por conexión
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+# Modo edge: SQLite local con WAL y pragmas ajustados (ver SQLITE_PRAGMAS)
+if settings.EDGE_MODE and engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: los objetos devueltos por INSERT/UPDATE ... RETURNING
+# siguen cargados después del commit (sin SELECT de refresh)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Create base class for models
 Base = declarative_base()
 
+# Incrementar cada vez que cambien las tablas (se guarda en schema_version)
+SCHEMA_VERSION = 11
+_SCHEMA_LOCK_KEY = 0x4B41504548  # "KAPEH"
+
+
+def _checkout(db: Session) -> None:
+    # Tomar la conexión del pool aquí para medir la espera de checkout
+    start = time.perf_counter()
+    db.connection()
+    db_pool_checkout_seconds.observe(time.perf_counter() - start)
+
 
 def get_db():
     """
     Dependency to get database session
     """
     db = SessionLocal()
+    try:
+        _checkout(db)
+        yield db
+    finally:
+        db.close()
+
+
+# Retraso de una réplica PostgreSQL en segundos; 0 si ya aplicó todo lo recibido
+# (pg_last_xact_replay_timestamp no avanza en una réplica sin escrituras nuevas)
+_REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class ReplicaSet:
+    """
+    Read replicas with a periodic health and replication-lag check
+
+    Las réplicas se revisan como mucho una vez por intervalo, en el request
+    que encuentra el estado vencido. Solo reciben lecturas las que
+    respondieron y están dentro de REPLICA_MAX_LAG_SECONDS; se reparten en
+    round robin.
+    """
+
+    def __init__(self, urls: List[str], max_lag: float, check_interval: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._engines = [
+            create_engine(
+                url,
+                pool_pre_ping=True,
+                connect_args={"check_same_thread": False} if "sqlite" in url else {"connect_timeout": 3}
+            )
+            for url in urls
+        ]
+        self._sessions = [
+            sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=replica_engine)
+            for replica_engine in self._engines
+        ]
+        # Por réplica: (revisada en, lista para lecturas)
+        self._state = [(float("-inf"), False)] * len(self._engines)
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def engines(self) -> list:
+        return list(self._engines)
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+    def session(self, index: int) -> Session:
+        return self._sessions[index]()
+
+    def _check(self, index: int) -> bool:
+        try:
+            with self._engines[index].connect() as conn:
+                lag = float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0) \
+                    if conn.dialect.name == "postgresql" else 0.0
+        except DBAPIError:
+            db_replica_lag_seconds.set(-1, replica=str(index))
+            return False
+        db_replica_lag_seconds.set(lag, replica=str(index))
+        return lag <= self.max_lag
+
+    def pick(self) -> Optional[int]:
+        """
+        Index of the next usable replica, or None to read from the primary
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [index for index, (checked_at, _) in enumerate(self._state)
+                   if now - checked_at >= self.check_interval]
+            # Marcar antes de revisar para que otros requests no repitan la revisión
+            for index in due:
+                self._state[index] = (now, self._state[index][1])
+        for index in due:
+            ready = self._check(index)
+            with self._lock:
+                self._state[index] = (now, ready)
+
+        ready = [index for index, (_, ok) in enumerate(self._state) if ok]
+        if not ready:
+            return None
+        return ready[next(self._next) % len(ready)]
+
+    def mark_down(self, index: int) -> None:
+        """
+        Take a replica out of rotation until its next check
+        """
+        with self._lock:
+            self._state[index] = (time.monotonic(), False)
+
+
+replicas = ReplicaSet(
+    settings.READ_REPLICA_URLS,
+    settings.REPLICA_MAX_LAG_SECONDS,
+    settings.REPLICA_CHECK_INTERVAL_SECONDS,
+)
+
+
+def open_read_session() -> Session:
+    """
+    Session on a usable replica, or on the primary
+    """
+    if len(replicas):
+        index = replicas.pick()
+        if index is not None:
+            db = replicas.session(index)
+            try:
+                _checkout(db)
+            except DBAPIError:
+                db.close()
+                replicas.mark_down(index)
+            else:
+                db.info["replica"] = index
+                db_read_sessions_total.inc(target=f"replica-{index}")
+                return db
+    
+    db = SessionLocal()
+    _checkout(db)
+    db_read_sessions_total.inc(target="primary")
+    return db
+
+
+def get_read_db():
+    """
+    Dependency for read-only sessions (dashboard analytics and metrics)
+    
+    Usa una réplica sana y al día si hay alguna y, si no, la principal. Las
+    escrituras y lo que debe leer lo recién escrito (login, /sync,
+    action items) siguen usando get_db.
+    """
+    db = open_read_session()
     try:
         yield db
     finally:
         db.close()
 
 
-def init_db():
+def init_db(attempts: int = 3):
+    """
+    Initialize database tables and stamp the schema version
+
+    Varios workers pueden arrancar a la vez contra una base vacía: en
+    PostgreSQL un advisory lock serializa la creación; en otros motores se
+    reintenta, ya que create_all omite las tablas que otro worker ya creó.
+    """
+    for attempt in range(attempts):
+        try:
+            with engine.begin() as conn:
+                if conn.dialect.name == "postgresql":
+                    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEMA_LOCK_KEY})
+                Base.metadata.create_all(bind=conn)
+                _add_missing_columns(conn)
+                create_missing_indexes(conn)
+                _seed_metric_counters(conn)
+                conn.execute(text("DELETE FROM schema_version"))
+                conn.execute(
+                    text("INSERT INTO schema_version (version, applied_at) VALUES (:version, CURRENT_TIMESTAMP)"),
+                    {"version": SCHEMA_VERSION}
+                )
+            break
+        except DBAPIError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.2 * (attempt + 1))
+    
+    # Los shards regionales solo tienen diagnosis_records (ver app/db/shards.py)
+    from app.db.shards import shard_router
+    shard_router.create_tables()
+
+
+def _add_missing_columns(conn) -> None:
+    """
+    Add model columns that are missing from tables created by older versions
+
+    create_all no modifica tablas existentes; las columnas nuevas deben ser
+    nullable o tener default para poder agregarse así.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            if column.index:
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table.name}_{column.name} ON {table.name} ({column.name})"
+                ))
+
+
+def create_missing_indexes(conn, tables=None) -> None:
+    """
+    Create model indexes that are missing from tables created by older versions
+
+    create_all tampoco agrega índices a tablas existentes. En tablas grandes
+    de PostgreSQL conviene crearlos antes con CREATE INDEX CONCURRENTLY (mismo
+    nombre); aquí se omiten los que ya existen.
     """
-    Initialize database tables
+    inspector = inspect(conn)
+    for table in tables or Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=conn)
+
+
+# Contador -> consulta con su valor inicial a partir de los datos existentes
+_METRIC_COUNTER_SEEDS = {
+    "actions_total": "SELECT COUNT(*) FROM action_items",
+    "actions_completed": "SELECT COUNT(*) FROM action_items WHERE is_completed = :true",
+}
+
+
+def _seed_metric_counters(conn) -> None:
     """
-    Base.metadata.create_all(bind=engine)
+    Create missing metric counters with their value recomputed from the data
+
+    A partir de ahí los mantienen las escrituras de crud (no se vuelven a
+    contar las tablas).
+    """
+    existing = {row[0] for row in conn.execute(text("SELECT name FROM metric_counters"))}
+    for name, query in _METRIC_COUNTER_SEEDS.items():
+        if name in existing:
+            continue
+        value = conn.execute(text(query), {"true": True}).scalar() or 0
+        conn.execute(
+            text("INSERT INTO metric_counters (name, value, updated_at) VALUES (:name, :value, CURRENT_TIMESTAMP)"),
+            {"name": name, "value": value}
+        )
+
+
+def reconcile_metric_counters(conn) -> Dict[str, int]:
+    """
+    Recompute every metric counter from the data, inside the caller's transaction
+
+    Para escrituras que no pasan por crud (carga masiva, SQL a mano). En
+    PostgreSQL primero bloquea las filas de los contadores: las escrituras de
+    crud en curso se confirman antes del conteo y las siguientes esperan a que
+    termine, así que ningún incremento se pierde ni se cuenta dos veces.
+    """
+    _seed_metric_counters(conn)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT name FROM metric_counters FOR UPDATE"))
+    values = {}
+    for name, query in _METRIC_COUNTER_SEEDS.items():
+        values[name] = conn.execute(text(query), {"true": True}).scalar() or 0
+        conn.execute(
+            text("UPDATE metric_counters SET value = :value, updated_at = CURRENT_TIMESTAMP WHERE name = :name"),
+            {"name": name, "value": values[name]}
+        )
+    return values
+
+
+def get_schema_version(conn) -> int:
+    """
+    Read the stamped schema version (0 if the database was never initialized)
+    """
+    try:
+        version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    except DBAPIError:
+        conn.rollback()
+        return 0
+    return version or 0
@@ -0,0 +1,229 @@
+"""
+Per-route query deadlines and cancellation on client disconnect
+
+Las rutas pesadas de lectura (analytics, métricas) usan
+``read_db_with_deadline(nombre)`` en lugar de ``get_read_db``. La sesión
+resultante:
+
+- en PostgreSQL fija ``SET LOCAL statement_timeout`` al presupuesto de la ruta
+  (``QUERY_BUDGETS_SECONDS``, o ``QUERY_BUDGET_DEFAULT_SECONDS``)
+- tiene un vigilante en el event loop que, si el cliente se desconecta o se
+  acaba el presupuesto, cancela la consulta en curso en el servidor
+  (``cancel()`` de psycopg2, ``interrupt()`` de sqlite3) y hace fallar las
+  siguientes sin enviarlas
+- con shards regionales, ``ShardRouter.scatter`` ata la sesión de cada shard
+  al mismo plazo (``QueryDeadline.attach``): heredan lo que queda del
+  presupuesto como ``statement_timeout`` y se cancelan junto con la principal
+
+Las cancelaciones salen como ``QueryCancelledError``; main las convierte en
+504 (o 499 si el cliente ya no está) y las rutas con caché pueden responder
+el último resultado calculado en su lugar (``compute_or_stale``, con el
+header ``X-Degraded: stale``). Para que el vigilante corra
+mientras la consulta se ejecuta, las rutas deben ser ``def`` (threadpool) y
+no ``async def``.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.telemetry import query_cancellations_total, degraded_responses_total
+from app.db.database import engine, replicas, open_read_session
+from app.db.shards import shard_router
+
+logger = logging.getLogger("kaapeh.deadlines")
+
+_INFO_KEY = "kaapeh_deadline"
+_POLL_SECONDS = 0.1
+
+DEADLINE = "deadline"
+DISCONNECT = "disconnect"
+
+
+class QueryCancelledError(RuntimeError):
+    """
+    A query was cancelled because its route ran out of time or the client left
+    """
+
+    def __init__(self, route: str, reason: str):
+        super().__init__(f"Query for '{route}' cancelled ({reason})")
+        self.route = route
+        self.reason = reason
+
+
+class QueryDeadline:
+    """
+    Time budget of one request and the connections its queries run on
+    """
+
+    def __init__(self, route: str, budget: float):
+        self.route = route
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.reason: Optional[str] = None
+        self.dbapi_connections = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def attach(self, db: Session) -> Connection:
+        """
+        Bind a session's connection to this deadline (statement_timeout, cancellation)
+        """
+        conn = db.connection()
+        if conn.dialect.name == "postgresql":
+            ms = max(int(self.remaining() * 1000), 1)
+            conn.execute(text("SET LOCAL statement_timeout = :ms"), {"ms": ms})
+        conn.info[_INFO_KEY] = self
+        db.info[_INFO_KEY] = self
+        with self._lock:
+            self.dbapi_connections.append(conn.connection.dbapi_connection)
+        return conn
+
+    def expire(self) -> None:
+        """
+        Cancel for running out of budget (callers that wait on other threads)
+        """
+        self.cancel(DEADLINE)
+
+    def detach(self, conn: Connection) -> None:
+        """
+        Release a connection before it goes back to the pool
+        """
+        conn.info.pop(_INFO_KEY, None)
+        with self._lock:
+            if conn.connection.dbapi_connection in self.dbapi_connections:
+                self.dbapi_connections.remove(conn.connection.dbapi_connection)
+
+    def cancel(self, reason: str) -> None:
+        """
+        Mark the request as cancelled and interrupt whatever its connections are running
+
+        Sobre una conexión inactiva no tiene efecto; las sentencias siguientes
+        fallan en _before_execute. Solo se cuenta en métricas lo que
+        efectivamente se cortó (ver _handle_error).
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            connections = list(self.dbapi_connections)
+        for dbapi_connection in connections:
+            try:
+                if hasattr(dbapi_connection, "cancel"):
+                    dbapi_connection.cancel()  # psycopg2: cancel request al backend
+                elif hasattr(dbapi_connection, "interrupt"):
+                    dbapi_connection.interrupt()  # sqlite3
+            except Exception:
+                logger.exception("Could not cancel query for %s", self.route)
+
+
+def _is_timeout(error: BaseException) -> bool:
+    # 57014 = query_canceled (statement_timeout o cancel request)
+    return getattr(error, "pgcode", None) == "57014" or "interrupted" in str(error)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    deadline = conn.info.get(_INFO_KEY)
+    if deadline is None:
+        return
+    if deadline.reason is None and deadline.remaining() <= 0:
+        deadline.cancel(DEADLINE)
+    if deadline.reason is not None:
+        query_cancellations_total.inc(route=deadline.route, reason=deadline.reason)
+        raise QueryCancelledError(deadline.route, deadline.reason)
+
+
+def _handle_error(context):
+    conn = context.connection
+    deadline = conn.info.get(_INFO_KEY) if conn is not None else None
+    if deadline is None:
+        return
+    if isinstance(context.original_exception, QueryCancelledError):
+        return
+    if deadline.reason is not None:
+        query_cancellations_total.inc(route=deadline.route, reason=deadline.reason)
+        raise QueryCancelledError(deadline.route, deadline.reason) from context.original_exception
+    if _is_timeout(context.original_exception):
+        # statement_timeout de PostgreSQL: cortar también lo que siga corriendo en los shards
+        deadline.cancel(DEADLINE)
+        query_cancellations_total.inc(route=deadline.route, reason="statement_timeout")
+        raise QueryCancelledError(deadline.route, DEADLINE) from context.original_exception
+
+
+def _instrument(target: Engine) -> None:
+    event.listen(target, "before_cursor_execute", _before_execute)
+    event.listen(target, "handle_error", _handle_error)
+
+
+for _engine in [engine, *replicas.engines, *shard_router.engines]:
+    _instrument(_engine)
+
+
+def _open(route: str, budget: float):
+    db = open_read_session()
+    deadline = QueryDeadline(route, budget)
+    conn = deadline.attach(db)
+    return db, conn, deadline
+
+
+def _close(db, conn, deadline: QueryDeadline) -> None:
+    deadline.detach(conn)
+    db.close()
+
+
+async def _watch(request: Request, deadline: QueryDeadline) -> None:
+    # La primera lectura consume el mensaje http.request del cuerpo (vacío en GET)
+    await request.is_disconnected()
+    while deadline.reason is None:
+        await asyncio.sleep(min(_POLL_SECONDS, max(deadline.remaining(), 0)))
+        if await request.is_disconnected():
+            deadline.cancel(DISCONNECT)
+        elif deadline.remaining() <= 0:
+            deadline.cancel(DEADLINE)
+
+
+def read_db_with_deadline(route: str):
+    """
+    Read-only session dependency bounded by the route's time budget
+    """
+    budget = settings.QUERY_BUDGETS_SECONDS.get(route, settings.QUERY_BUDGET_DEFAULT_SECONDS)
+
+    async def dependency(request: Request):
+        db, conn, deadline = await run_in_threadpool(_open, route, budget)
+        request.state.query_deadline = deadline
+        watcher = asyncio.create_task(_watch(request, deadline))
+        try:
+            yield db
+        finally:
+            watcher.cancel()
+            await run_in_threadpool(_close, db, conn, deadline)
+
+    return dependency
+
+
+def compute_or_stale(cache, db, key, compute) -> Tuple[Any, bool]:
+    """
+    ``cache.get_or_compute`` that answers with the last result when the route runs out of time
+
+    Returns:
+        (value, stale)
+    """
+    try:
+        return cache.get_or_compute(db, key, compute), False
+    except QueryCancelledError as e:
+        stale = cache.get_stale(key)
+        if e.reason == DISCONNECT or stale is None:
+            raise
+        degraded_responses_total.inc(route=e.route)
+        return stale, True
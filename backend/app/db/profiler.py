@@ -0,0 +1,206 @@
+"""
+Per-request SQL profiler
+
+Middleware opcional que engancha los eventos del engine de SQLAlchemy para
+registrar, por cada request HTTP:
+- número de consultas y tiempo total en base de datos
+- las sentencias más lentas
+- formas de sentencia repetidas (patrón N+1)
+- opcionalmente el plan ``EXPLAIN (ANALYZE, BUFFERS)`` de las consultas lentas
+
+El resultado se escribe como una línea JSON en el logger ``kaapeh.sql_profiler``
+y, si se habilita, en el header ``X-SQL-Profile`` de la respuesta.
+"""
+
+import json
+import logging
+import re
+import time
+from collections import Counter as ShapeCounter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.telemetry import registry, Counter
+
+logger = logging.getLogger("kaapeh.sql_profiler")
+
+sql_n_plus_one_total = registry.register(Counter(
+    "kaapeh_sql_n_plus_one_total",
+    "Requests where a statement shape repeated above the N+1 threshold",
+    ("route",),
+))
+
+_NUMBER_RE = re.compile(r"\b\d+(\.\d+)?\b")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*[?%:\w()]+\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """
+    Normalize a SQL statement so that calls differing only in literals match
+    """
+    shape = _STRING_RE.sub("?", statement)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _IN_LIST_RE.sub("IN (...)", shape)
+    return _WHITESPACE_RE.sub(" ", shape).strip()
+
+
+@dataclass
+class QueryRecord:
+    statement: str
+    parameters: object
+    duration: float
+
+
+@dataclass
+class QueryProfile:
+    """
+    Queries executed while serving one request
+    """
+    queries: List[QueryRecord] = field(default_factory=list)
+
+    @property
+    def query_count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_time(self) -> float:
+        return sum(q.duration for q in self.queries)
+
+    def slowest(self, n: int) -> List[QueryRecord]:
+        return sorted(self.queries, key=lambda q: q.duration, reverse=True)[:n]
+
+    def repeated_shapes(self, threshold: int) -> List[dict]:
+        counts = ShapeCounter(statement_shape(q.statement) for q in self.queries)
+        return [
+            {"shape": shape, "count": count}
+            for shape, count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def summary(self) -> dict:
+        return {
+            "query_count": self.query_count,
+            "db_time_ms": round(self.total_time * 1000, 2),
+            "slowest": [
+                {"statement": q.statement, "duration_ms": round(q.duration * 1000, 2)}
+                for q in self.slowest(settings.SQL_PROFILER_TOP_N)
+            ],
+            "n_plus_one": self.repeated_shapes(settings.SQL_PROFILER_N_PLUS_ONE_THRESHOLD),
+        }
+
+
+_current_profile: ContextVar[Optional[QueryProfile]] = ContextVar("sql_profile", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profiler_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is None:
+        return
+    starts = conn.info.get("profiler_start")
+    if not starts:
+        return
+    profile.queries.append(QueryRecord(statement, parameters, time.perf_counter() - starts.pop()))
+
+
+def install_profiler(engine: Engine) -> None:
+    """
+    Attach the profiling hooks to an engine (no-op for requests without a profile)
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _explain(engine: Engine, records: List[QueryRecord]) -> List[dict]:
+    """
+    Capture execution plans for slow SELECT statements
+
+    EXPLAIN ANALYZE vuelve a ejecutar la consulta, por eso solo se aplica a
+    SELECT y siempre dentro de una transacción que se revierte.
+    """
+    plans = []
+    is_postgres = engine.dialect.name == "postgresql"
+    prefix = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " if is_postgres else "EXPLAIN QUERY PLAN "
+    with engine.connect() as conn:
+        for record in records:
+            if not record.statement.lstrip().upper().startswith("SELECT"):
+                continue
+            try:
+                result = conn.exec_driver_sql(prefix + record.statement, record.parameters)
+                plan = [list(row) for row in result]
+                plans.append({
+                    "statement": record.statement,
+                    "duration_ms": round(record.duration * 1000, 2),
+                    "plan": plan[0][0] if is_postgres else plan,
+                })
+            except Exception as e:
+                plans.append({"statement": record.statement, "error": str(e)})
+            finally:
+                conn.rollback()
+    return plans
+
+
+class SQLProfilerMiddleware:
+    """
+    ASGI middleware that profiles the SQL executed by each request
+    """
+
+    def __init__(self, app, engine: Engine):
+        self.app = app
+        self.engine = engine
+        install_profiler(engine)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile()
+        token = _current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and settings.SQL_PROFILER_HEADER:
+                header = json.dumps({
+                    "query_count": profile.query_count,
+                    "db_time_ms": round(profile.total_time * 1000, 2),
+                    "n_plus_one": len(profile.repeated_shapes(settings.SQL_PROFILER_N_PLUS_ONE_THRESHOLD)),
+                })
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-sql-profile", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+
+        if profile.query_count:
+            await self._report(scope, profile)
+
+    async def _report(self, scope, profile: QueryProfile) -> None:
+        route = getattr(scope.get("route"), "path", scope.get("path", ""))
+        report = {"method": scope.get("method"), "route": route, **profile.summary()}
+
+        if report["n_plus_one"]:
+            sql_n_plus_one_total.inc(route=route)
+
+        threshold = settings.SQL_PROFILER_EXPLAIN_THRESHOLD_MS
+        if threshold is not None:
+            slow = [q for q in profile.queries if q.duration * 1000 >= threshold]
+            if slow:
+                report["explain"] = await run_in_threadpool(_explain, self.engine, slow)
+
+        logger.info(json.dumps(report, default=str, ensure_ascii=False))
@@ -0,0 +1,188 @@
+"""
+Regional shards for diagnosis_records
+
+Con ``SHARD_DATABASE_URLS`` configurado, los diagnósticos que llegan por
+/sync se guardan en la base de su región (Oaxaca, Veracruz, Guatemala, ...)
+en lugar de la principal. La región sale de ``location`` ("Tapachula,
+Chiapas" -> "Chiapas", ver ``SHARD_REGIONS``) o del id de cooperativa que
+envía el dispositivo (``SHARD_COOPERATIVES``, tiene prioridad). Lo que no
+corresponde a ningún shard, y todo lo anterior al sharding, queda en la
+principal, que sigue siendo un shard más para las lecturas.
+
+La base principal conserva todo lo demás (usuarios, action items, change log,
+sketches, snapshots); los shards solo tienen ``diagnosis_records`` (y
+``users`` vacía, para la llave foránea).
+
+Las agregaciones de /metrics y /analytics/* se calculan como agregados
+parciales combinables (conteos y sumas, nunca promedios ni top-k parciales)
+en todos los shards en paralelo, y se combinan en el worker.
+
+Sin shards configurados todo funciona como antes con una sola base.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import settings
+from app.db.database import Base, create_missing_indexes
+from app.models.models import DiagnosisRecord, User
+
+PRIMARY = "primary"
+
+
+class ShardUnavailableError(RuntimeError):
+    """
+    A shard could not answer its part of a fan-out query
+    """
+
+    def __init__(self, shard: str, error: Exception):
+        super().__init__(f"Shard '{shard}' unavailable: {error}")
+        self.shard = shard
+
+
+class ShardRouter:
+    """
+    Engines of the configured shards and the region -> shard mapping
+    """
+
+    def __init__(self, urls: Dict[str, str], regions: Dict[str, str], cooperatives: Dict[str, str]):
+        self.urls = {name: url for name, url in urls.items() if name != PRIMARY}
+        self.regions = {region.strip().lower(): shard for region, shard in regions.items()}
+        self.cooperatives = dict(cooperatives)
+        unknown = (set(self.regions.values()) | set(self.cooperatives.values())) - set(self.urls) - {PRIMARY}
+        if unknown:
+            raise ValueError(f"Shard mapping points to unconfigured shards: {sorted(unknown)}")
+
+        self._engines = {
+            name: create_engine(url, connect_args={"check_same_thread": False} if "sqlite" in url else {})
+            for name, url in self.urls.items()
+        }
+        self._sessions = {
+            name: sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+            for name, engine in self._engines.items()
+        }
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.urls), 1), thread_name_prefix="shard")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.urls)
+
+    @property
+    def names(self) -> list:
+        return list(self.urls)
+
+    @property
+    def engines(self) -> list:
+        return list(self._engines.values())
+
+    def session(self, name: str) -> Session:
+        return self._sessions[name]()
+
+    def shard_for(self, region: str, cooperative_id: Optional[str] = None) -> str:
+        """
+        Shard that stores a diagnosis (PRIMARY when nothing matches)
+        """
+        if cooperative_id is not None and cooperative_id in self.cooperatives:
+            return self.cooperatives[cooperative_id]
+        return self.regions.get(region.strip().lower(), PRIMARY)
+
+    def create_tables(self) -> None:
+        """
+        Create diagnosis_records (and users, for its foreign key) on every shard
+        """
+        tables = [User.__table__, DiagnosisRecord.__table__]
+        for engine in self._engines.values():
+            with engine.begin() as conn:
+                Base.metadata.create_all(bind=conn, tables=tables)
+                create_missing_indexes(conn, tables)
+
+    def _run(self, name: str, fn: Callable[[Session, str], Any], deadline=None) -> Any:
+        db = self.session(name)
+        conn = None
+        try:
+            if deadline is not None:
+                conn = deadline.attach(db)
+            return fn(db, name)
+        except Exception as e:
+            if deadline is not None and deadline.reason is not None:
+                raise  # QueryCancelledError: 504/499, no shard caído
+            raise ShardUnavailableError(name, e) from e
+        finally:
+            if conn is not None:
+                deadline.detach(conn)
+            db.close()
+
+    def scatter(
+        self,
+        db: Session,
+        fn: Callable[[Session, str], Any],
+        primary_fn: Optional[Callable[[Session], Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Run ``fn(session, shard)`` on every shard in parallel and ``primary_fn(db)`` here
+
+        ``primary_fn`` (por defecto ``fn``) corre sobre la sesión del request en
+        el hilo actual mientras los shards responden. Si la sesión tiene plazo
+        (``read_db_with_deadline``), las de los shards quedan atadas a él.
+
+        Returns:
+            {shard name: result}, with PRIMARY first
+        """
+        deadline = db.info.get("kaapeh_deadline")  # QueryDeadline de app/db/deadlines.py
+        futures = {name: self._executor.submit(self._run, name, fn, deadline) for name in self.urls}
+        try:
+            results = {PRIMARY: primary_fn(db) if primary_fn else fn(db, PRIMARY)}
+            for name, future in futures.items():
+                if deadline is None:
+                    results[name] = future.result()
+                    continue
+                try:
+                    results[name] = future.result(timeout=max(deadline.remaining(), 0))
+                except FutureTimeoutError:
+                    # Se acabó el presupuesto de la ruta: interrumpir los shards que siguen
+                    deadline.expire()
+                    results[name] = future.result()
+        except BaseException:
+            # Las consultas que aún no empezaron ya no le sirven a nadie
+            for future in futures.values():
+                future.cancel()
+            raise
+        return results
+
+    def max_ids(self) -> Dict[str, int]:
+        """
+        Highest diagnosis id on each shard (its ingest watermark)
+        """
+        futures = {
+            name: self._executor.submit(
+                self._run, name, lambda db, _: db.query(func.max(DiagnosisRecord.id)).scalar() or 0
+            )
+            for name in self.urls
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def merge_sums(parts) -> Dict[Any, list]:
+    """
+    Combine {key: [numbers...]} partial aggregates by adding them element-wise
+    """
+    merged: Dict[Any, list] = {}
+    for part in parts:
+        for key, values in part.items():
+            current = merged.get(key)
+            if current is None:
+                merged[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    current[index] += value
+    return merged
+
+
+shard_router = ShardRouter(
+    settings.SHARD_DATABASE_URLS,
+    settings.SHARD_REGIONS,
+    settings.SHARD_COOPERATIVES,
+)
@@ -2,20 +2,37 @@
 Main FastAPI application
 """
 
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import threading
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 
 from app.core.config import settings
-from app.db.database import init_db
-from app.api.v1.endpoints import auth, sync, metrics
+from app.db.database import init_db, engine, get_schema_version, SCHEMA_VERSION, SessionLocal
+from app.api.v1.endpoints import auth, sync, metrics, analytics, knowledge, actions
 from app.schemas.schemas import HealthResponse
+from app.core.telemetry import TelemetryMiddleware, registry
+from app.core import startup
+from app.core.responses import FastJSONResponse
+from app.core.security import warm_up
+from app.core.events import event_bus
+from app.core.scheduler import scheduler
+from app.crud import crud
+from app.services import archive, recategorize
+from app.db.shards import shard_router, ShardUnavailableError
+from app.db.deadlines import QueryCancelledError, DISCONNECT
 
 # Initialize FastAPI app
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
-    description="API Backend for Kaapeh Copiloto - Sprint 1"
+    description="API Backend for Kaapeh Copiloto - Sprint 1",
+    default_response_class=FastJSONResponse
 )
 
 # Configure CORS
@@ -26,23 +43,173 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TelemetryMiddleware)
+app.add_middleware(startup.FirstRequestMiddleware)
+
+if settings.SQL_PROFILER_ENABLED:
+    from app.db.profiler import SQLProfilerMiddleware
+    app.add_middleware(SQLProfilerMiddleware, engine=engine)
 
 # Include routers
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["Authentication"])
 app.include_router(sync.router, prefix=f"{settings.API_V1_STR}", tags=["Sync"])
+app.include_router(actions.router, prefix=f"{settings.API_V1_STR}", tags=["Action Items"])
 app.include_router(metrics.router, prefix=f"{settings.API_V1_STR}", tags=["Metrics"])
+app.include_router(analytics.router, prefix=f"{settings.API_V1_STR}/analytics", tags=["Analytics"])
+app.include_router(knowledge.router, prefix=f"{settings.API_V1_STR}/kb", tags=["Knowledge Base"])
+
+
+def snapshot_metrics_job():
+    """
+    Periodic AggregatedMetrics snapshot (incremental since the previous one)
+    """
+    db = SessionLocal()
+    try:
+        crud.create_metrics_snapshot_if_due(db, settings.METRICS_SNAPSHOT_INTERVAL_SECONDS)
+    finally:
+        db.close()
+
+
+def reconcile_counters_job():
+    """
+    Recount metric_counters from the tables (bulk loads and manual SQL bypass crud)
+    """
+    db = SessionLocal()
+    try:
+        crud.reconcile_metric_counters(db)
+    finally:
+        db.close()
+
+
+def archive_job():
+    """
+    Move closed months past ARCHIVE_HOT_MONTHS to the Parquet archive
+    """
+    db = SessionLocal()
+    try:
+        archive.archive_closed_months(db)
+    finally:
+        db.close()
+
+
+def recategorize_job():
+    """
+    Pick up taxonomy changes and advance any pending re-categorization job
+    """
+    db = SessionLocal()
+    try:
+        recategorize.sync_local_state(db)
+        recategorize.run_job(db, time_budget=settings.RECATEGORIZE_TICK_SECONDS)
+    finally:
+        db.close()
+
+
+def edge_replication_job():
+    """
+    Ship diagnoses ingested on this edge node to the central instance
+    """
+    from app.services import edge_replication  # httpx, solo en nodos edge
+    
+    db = SessionLocal()
+    try:
+        edge_replication.get_replicator().run(db, time_budget=settings.EDGE_REPLICATION_TICK_SECONDS)
+    finally:
+        db.close()
+
+
+def sync_uploads_cleanup_job():
+    """
+    Drop resumable upload sessions nobody resumed within SYNC_UPLOAD_TTL_SECONDS
+    """
+    db = SessionLocal()
+    try:
+        crud.purge_expired_uploads(db)
+    finally:
+        db.close()
+
+
+scheduler.add_job("metrics_snapshot", settings.METRICS_SNAPSHOT_INTERVAL_SECONDS, snapshot_metrics_job)
+scheduler.add_job(
+    "metric_counters_reconcile", settings.METRIC_COUNTERS_RECONCILE_INTERVAL_SECONDS, reconcile_counters_job
+)
+scheduler.add_job("recategorize", settings.RECATEGORIZE_INTERVAL_SECONDS, recategorize_job)
+scheduler.add_job("sync_uploads_cleanup", settings.SYNC_UPLOAD_CLEANUP_INTERVAL_SECONDS, sync_uploads_cleanup_job)
+if settings.EDGE_UPSTREAM_URL:
+    # El archivo borra filas de la tabla que el replicador todavía podría no haber enviado
+    scheduler.add_job("edge_replication", settings.EDGE_REPLICATION_INTERVAL_SECONDS, edge_replication_job)
+else:
+    scheduler.add_job("archive", settings.ARCHIVE_INTERVAL_SECONDS, archive_job)
+
+startup.report.begin(_IMPORT_STARTED)
+startup.report.record("import", time.perf_counter() - _IMPORT_STARTED)
 
 
 @app.on_event("startup")
 async def startup_event():
     """
-    Initialize database on startup
+    Check the schema version on startup (create tables only when it is behind)
     """
-    init_db()
-    print(f"🚀 {settings.PROJECT_NAME} v{settings.VERSION} started")
+    with startup.report.phase("db_connect"):
+        conn = engine.connect()
+    try:
+        with startup.report.phase("schema_check"):
+            version = get_schema_version(conn)
+    finally:
+        conn.close()
+    
+    if version < SCHEMA_VERSION:
+        if not settings.AUTO_CREATE_SCHEMA:
+            raise RuntimeError(
+                f"Database schema is at version {version}, expected {SCHEMA_VERSION}. Run init_db.py"
+            )
+        with startup.report.phase("schema_create"):
+            init_db()
+    elif shard_router.enabled:
+        with startup.report.phase("shard_schema"):
+            shard_router.create_tables()
+    
+    with startup.report.phase("taxonomy"):
+        db = SessionLocal()
+        try:
+            recategorize.sync_local_state(db)
+        finally:
+            db.close()
+    
+    event_bus.start()
+    scheduler.start()
+    threading.Thread(target=warm_up, daemon=True).start()
+    
+    print(f"🚀 {settings.PROJECT_NAME} v{settings.VERSION} started ({startup.report.summary()})")
     print(f"📚 Documentation available at http://localhost:8000/docs")
 
 
+@app.exception_handler(ShardUnavailableError)
+async def shard_unavailable_handler(request, exc: ShardUnavailableError):
+    """
+    A regional shard that cannot answer makes fan-out reads fail fast with 503
+    """
+    return FastJSONResponse(status_code=503, content={"detail": str(exc), "shard": exc.shard})
+
+
+@app.exception_handler(QueryCancelledError)
+async def query_cancelled_handler(request, exc: QueryCancelledError):
+    """
+    Route deadline exceeded: 504; client gone: 499 (nobody reads it, only logs)
+    """
+    status_code = 499 if exc.reason == DISCONNECT else 504
+    return FastJSONResponse(status_code=status_code, content={"detail": str(exc), "reason": exc.reason})
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Stop background listeners
+    """
+    await scheduler.stop()
+    await metrics.dashboard_stream.stop()
+    event_bus.stop()
+
+
 @app.get("/", tags=["Root"])
 async def root():
     """
@@ -67,6 +234,17 @@ async def health_check():
     )
 
 
+@app.get(settings.INTERNAL_METRICS_PATH, response_class=PlainTextResponse, include_in_schema=False)
+async def internal_metrics():
+    """
+    Operational metrics in Prometheus text exposition format
+    """
+    return PlainTextResponse(
+        registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
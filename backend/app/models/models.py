@@ -2,7 +2,7 @@
 SQLAlchemy database models
 """
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.database import Base
@@ -13,6 +13,8 @@ class User(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
+    display_name = Column(String, nullable=True)
+    device_id = Column(String, nullable=True, index=True)
     role = Column(String, nullable=False, default="Productor")
     preferred_language = Column(String, default="es")
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -39,9 +41,15 @@ class AccessibilityConfig(Base):
 
 class DiagnosisRecord(Base):
     __tablename__ = "diagnosis_records"
+    __table_args__ = (
+        # Filtros de /analytics (ver app/services/analytics_filters.py)
+        Index("ix_diagnosis_records_issue_timestamp", "detected_issue", "timestamp"),
+        Index("ix_diagnosis_records_location_timestamp", "location", "timestamp"),
+        Index("ix_diagnosis_records_confidence", "confidence"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     detected_issue = Column(String, nullable=False)
     confidence = Column(Float, nullable=False)
@@ -78,3 +86,151 @@ class AggregatedMetrics(Base):
     nas = Column(Float, nullable=True)
     total_diagnoses = Column(Integer)
     issue_distribution = Column(JSON)
+    
+    # Estado acumulado para calcular el siguiente snapshot solo con el delta
+    last_diagnosis_id = Column(Integer, nullable=True)
+    shard_cursors = Column(JSON, nullable=True)  # {shard: último id incluido} con shards regionales
+    feedback_total = Column(Integer, nullable=True)
+    feedback_correct = Column(Integer, nullable=True)
+    confidence_sum = Column(Float, nullable=True)
+    actions_total = Column(Integer, nullable=True)
+    actions_completed = Column(Integer, nullable=True)
+
+
+class DiagnosisSketch(Base):
+    """
+    Mergeable sketches per (week, issue, location) for approximate analytics
+    """
+    __tablename__ = "diagnosis_sketches"
+    __table_args__ = (
+        UniqueConstraint("bucket_start", "detected_issue", "location", name="uq_diagnosis_sketch_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    bucket_start = Column(DateTime, nullable=False, index=True)  # Lunes 00:00 de la semana
+    detected_issue = Column(String, nullable=False)
+    location = Column(String, nullable=False, default="")  # "" = sin ubicación
+    diagnoses_count = Column(Integer, nullable=False, default=0)
+    devices_hll = Column(LargeBinary, nullable=True)
+    confidence_hist = Column(LargeBinary, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ChangeLogEntry(Base):
+    """
+    Monotonic log of changes to rows that devices download (GET /sync/changes)
+    """
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("ix_change_log_user_seq", "user_id", "seq"),
+        {"sqlite_autoincrement": True},  # No reutilizar números de secuencia
+    )
+    
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String, nullable=False)  # "user", "accessibility_config", "action_item"
+    entity_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=True)  # Dueño del registro (None = sin dueño)
+    op = Column(String, nullable=False)  # "upsert" o "delete"
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+
+class MetricCounter(Base):
+    """
+    Running counters kept up to date by the writes that change them (NAS)
+    """
+    __tablename__ = "metric_counters"
+    
+    name = Column(String, primary_key=True)  # "actions_total", "actions_completed"
+    value = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IssueTaxonomy(Base):
+    """
+    Taxonomy changes on top of ISSUE_CATEGORIES: new classes and renamed or split ones
+    """
+    __tablename__ = "issue_taxonomy"
+    
+    issue = Column(String, primary_key=True)  # Nombre como lo envía (o enviaba) la app
+    category = Column(String, nullable=False)
+    replaced_by = Column(String, nullable=True)  # Nombre vigente si la clase se renombró o dividió
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class MaintenanceJob(Base):
+    """
+    State of a resumable background batch job over diagnosis_records
+    """
+    __tablename__ = "maintenance_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # "recategorize"
+    status = Column(String, nullable=False, default="pending")  # pending, running, paused, complete, failed
+    params = Column(JSON, nullable=False)
+    cursors = Column(JSON, nullable=True)  # {base: último id procesado}
+    upper_ids = Column(JSON, nullable=True)  # {base: id más alto visto} (para el progreso)
+    rows_updated = Column(Integer, nullable=False, default=0)
+    owner = Column(String, nullable=True)  # Proceso que lo está corriendo (host:pid)
+    heartbeat_at = Column(DateTime, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class EdgeReplicationState(Base):
+    """
+    Per edge node, highest local diagnosis id already applied on this (central) instance
+    """
+    __tablename__ = "edge_replication_state"
+    
+    node_id = Column(String, primary_key=True)
+    applied_through_id = Column(Integer, nullable=False, default=0)  # id en la base del nodo edge
+    rows_applied = Column(Integer, nullable=False, default=0)
+    batches_applied = Column(Integer, nullable=False, default=0)
+    last_batch_at = Column(DateTime, nullable=True)
+
+
+class SyncUpload(Base):
+    """
+    Resumable /sync upload: the device sends numbered chunks of a fixed size
+    """
+    __tablename__ = "sync_uploads"
+    
+    id = Column(String, primary_key=True)  # Token aleatorio entregado al dispositivo
+    total_rows = Column(Integer, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    committed_chunks = Column(Integer, nullable=False, default=0)  # Chunks guardados sin huecos desde el 0
+    rows_stored = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class SyncUploadChunk(Base):
+    """
+    Chunk of a resumable upload already stored in diagnosis_records
+    """
+    __tablename__ = "sync_upload_chunks"
+    
+    upload_id = Column(String, ForeignKey("sync_uploads.id", ondelete="CASCADE"), primary_key=True)
+    chunk = Column(Integer, primary_key=True)
+    row_count = Column(Integer, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivePendingDelete(Base):
+    """
+    Diagnosis copied to a month's Parquet archive and not yet deleted from the hot table
+    """
+    __tablename__ = "archive_pending_deletes"
+    
+    diagnosis_id = Column(Integer, primary_key=True)
+    month = Column(String, nullable=False, index=True)  # YYYY-MM
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
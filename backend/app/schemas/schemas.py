@@ -4,7 +4,7 @@ Pydantic schemas for request/response validation
 
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Any, Optional, Dict, List
 
 
 # User Schemas
@@ -69,6 +69,42 @@ class DiagnosisResponse(BaseModel):
         from_attributes = True
 
 
+# Action Item Schemas
+class ActionItemCreate(BaseModel):
+    description_text: str = Field(..., min_length=1, description="Acción recomendada")
+    is_completed: bool = False
+
+
+class ActionItemBatchCreate(BaseModel):
+    items: List[ActionItemCreate] = Field(..., min_length=1, max_length=100)
+
+
+class ActionItemResponse(BaseModel):
+    id: int
+    diagnosis_id: int
+    description_text: str
+    is_completed: bool
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class ActionItemStatusUpdate(BaseModel):
+    id: int
+    is_completed: bool
+
+
+class ActionItemBatchUpdate(BaseModel):
+    updates: List[ActionItemStatusUpdate] = Field(..., min_length=1, max_length=500)
+
+
+class ActionItemBatchUpdateResponse(BaseModel):
+    updated: List[int] = Field(..., description="Ids cuyo estado cambió")
+    unchanged: List[int] = Field(..., description="Ids que ya tenían ese estado")
+    not_found: List[int]
+
+
 # Sync Schemas
 class DiagnosisSyncData(BaseModel):
     timestamp: datetime
@@ -80,6 +116,12 @@ class DiagnosisSyncData(BaseModel):
 
 class SyncPayload(BaseModel):
     diagnoses: List[DiagnosisSyncData]
+    device_id: Optional[str] = Field(
+        None, description="Identificador del dispositivo; solo alimenta el conteo aproximado de dispositivos, no se guarda"
+    )
+    cooperative_id: Optional[str] = Field(
+        None, description="Cooperativa del productor; con shards regionales decide la base de destino"
+    )
 
 
 class SyncResponse(BaseModel):
@@ -87,6 +129,51 @@ class SyncResponse(BaseModel):
     synced_count: int
 
 
+class SyncUploadCreate(BaseModel):
+    total_rows: int = Field(..., ge=1, description="Filas que el dispositivo tiene pendientes de enviar")
+    chunk_size: Optional[int] = Field(None, ge=1, description="Filas por chunk (default del servidor)")
+
+
+class SyncUploadStatus(BaseModel):
+    """
+    Estado de una subida reanudable: el dispositivo sigue enviando desde ``next_chunk``
+    """
+    upload_id: str
+    total_rows: int
+    chunk_size: int
+    total_chunks: int
+    committed_offset: int = Field(..., description="Filas guardadas sin huecos desde el inicio de la subida")
+    next_chunk: int = Field(..., description="Primer chunk que falta después de committed_offset")
+    complete: bool
+    expires_at: datetime
+    stored: Optional[bool] = Field(None, description="En PUT de un chunk: false si ya se había recibido")
+
+
+class EdgeReplicationResponse(BaseModel):
+    """
+    Cursor de réplica de un nodo edge: el siguiente lote empieza después de ``applied_through_id``
+    """
+    node_id: str
+    applied_through_id: int
+    rows_applied: int = 0
+    duplicates_skipped: int = 0
+
+
+class EntityChanges(BaseModel):
+    columns: List[str]
+    rows: List[List[Any]]
+    deleted: List[int] = []
+
+
+class SyncChangesResponse(BaseModel):
+    """
+    Lote de cambios posteriores al cursor; repetir con ``since=cursor`` mientras ``has_more``
+    """
+    cursor: int
+    has_more: bool
+    changes: Dict[str, EntityChanges]
+
+
 # Metrics Schemas
 class MetricsResponse(BaseModel):
     tpp: float = Field(..., description="Tasa de Precisión Percibida (%)")
@@ -97,6 +184,26 @@ class MetricsResponse(BaseModel):
     timestamp: datetime
 
 
+class MetricsSnapshot(BaseModel):
+    timestamp: datetime
+    tpp: Optional[float]
+    cpm: Optional[float]
+    nas: Optional[float] = None
+    total_diagnoses: Optional[int]
+    issue_distribution: Optional[Dict[str, int]] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class MetricsHistoryResponse(BaseModel):
+    """
+    Serie de tiempo de métricas tomada directamente de los snapshots
+    """
+    snapshots: List[MetricsSnapshot]
+    count: int
+
+
 # Category Distribution Schema
 class CategoryDistributionResponse(BaseModel):
     """
@@ -114,6 +221,39 @@ class CategoryDistributionResponse(BaseModel):
     timestamp: datetime = Field(..., description="Timestamp de la consulta")
 
 
+# Knowledge Base Schemas
+class KBSearchRequest(BaseModel):
+    """
+    Una o varias consultas como embeddings (mismo modelo que el índice)
+    """
+    queries: List[List[float]] = Field(..., min_length=1, max_length=64)
+    top_k: int = Field(3, ge=1, le=50)
+    category: Optional[str] = None
+    min_similarity: float = Field(0.0, ge=-1.0, le=1.0)
+
+
+class KBSearchHit(BaseModel):
+    id: Optional[str] = None
+    title: Optional[str] = None
+    content: Optional[str] = None
+    category: Optional[str] = None
+    originalDocumentId: Optional[str] = None
+    score: float
+
+
+class KBSearchResponse(BaseModel):
+    results: List[List[KBSearchHit]]
+    count: int
+
+
+class KBStatsResponse(BaseModel):
+    available: bool
+    count: int
+    dim: Optional[int] = None
+    categories: List[str]
+    built_at: Optional[str] = None
+
+
 # Health Check Schema
 class HealthResponse(BaseModel):
     status: str
@@ -0,0 +1,221 @@
+"""
+Uniform filters for the /analytics endpoints
+
+Todos los endpoints de /analytics aceptan el mismo conjunto de filtros:
+rango de fechas (``since`` / ``until``), categoría, lista de problemas
+detectados, prefijo de ubicación y rango de confianza. ``AnalyticsFilters``
+los traduce a cada camino de lectura:
+
+- SQL: predicados que usan los índices de ``diagnosis_records`` (timestamp,
+  (detected_issue, timestamp), (location, timestamp), confidence). La
+  categoría se compila a ``detected_issue IN (...)`` con los problemas
+  conocidos de esa categoría y el prefijo de ubicación a un rango
+  ``location >= prefijo AND location < siguiente`` en lugar de ``LIKE``
+  (SQLite no usa índices para ``LIKE`` sin distinguir mayúsculas).
+- Almacén columnar y archivo Parquet: una máscara NumPy sobre las columnas
+  ya codificadas como diccionario; los meses archivados fuera del rango de
+  fechas ni se abren.
+
+``explain_analytics_filters.py`` verifica con EXPLAIN que cada filtro llega a
+la base como un predicado indexado.
+"""
+
+from datetime import datetime
+from typing import FrozenSet, List, Optional, Sequence
+
+from sqlalchemy import distinct
+from sqlalchemy.orm import Session
+
+from app.crud.crud import ISSUE_CATEGORIES, ISSUE_REPLACEMENTS, canonical_issue, categorize_issue, week_start
+from app.models.models import DiagnosisRecord, DiagnosisSketch
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Smallest string greater than every string that starts with ``prefix``
+    """
+    last = ord(prefix[-1])
+    if last >= 0x10FFFF:
+        return None
+    return prefix[:-1] + chr(last + 1)
+
+
+class AnalyticsFilters:
+    """
+    Filters shared by every analytics endpoint (all optional)
+    """
+
+    def __init__(
+        self,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        category: Optional[str] = None,
+        issues: Optional[Sequence[str]] = None,
+        location_prefix: Optional[str] = None,
+        min_confidence: Optional[float] = None,
+        max_confidence: Optional[float] = None,
+    ):
+        self.since = since
+        self.until = until  # exclusivo
+        self.category = category
+        self.issues = tuple(sorted(set(issues))) if issues else None
+        self.location_prefix = location_prefix or None
+        self.min_confidence = min_confidence
+        self.max_confidence = max_confidence
+        self._issue_names: Optional[FrozenSet[str]] = None
+
+    @property
+    def active(self) -> bool:
+        return any(value is not None for value in self.key())
+
+    @property
+    def has_issue_filter(self) -> bool:
+        return self.category is not None or self.issues is not None
+
+    @property
+    def has_confidence_filter(self) -> bool:
+        return self.min_confidence is not None or self.max_confidence is not None
+
+    def key(self) -> tuple:
+        """
+        Hashable form for cache keys
+        """
+        return (
+            self.since, self.until, self.category, self.issues,
+            self.location_prefix, self.min_confidence, self.max_confidence,
+        )
+
+    def narrowed(self, since: Optional[datetime]) -> "AnalyticsFilters":
+        """
+        Copy whose start is the later of ``since`` and the filter's own
+        """
+        if since is None or (self.since is not None and self.since >= since):
+            return self
+        return AnalyticsFilters(
+            since, self.until, self.category, self.issues,
+            self.location_prefix, self.min_confidence, self.max_confidence,
+        )
+
+    # ---------------- problemas y categorías ----------------
+
+    def matches_issue(self, issue: str) -> bool:
+        # Un nombre reemplazado cuenta como su sucesor mientras se reescribe el histórico
+        if self.issues is not None and issue not in self.issues and canonical_issue(issue) not in self.issues:
+            return False
+        return self.category is None or categorize_issue(issue) == self.category
+
+    def issue_names(self, db: Session) -> Optional[FrozenSet[str]]:
+        """
+        Detected issues allowed by the issue and category filters (None = all)
+
+        Para una categoría se toman las 15 clases del modelo más los problemas
+        que aparecen en diagnosis_sketches (tabla chica, una fila por semana,
+        problema y ubicación), que cubre las variantes de texto que
+        ``categorize_issue`` asigna por palabra clave.
+        """
+        if not self.has_issue_filter:
+            return None
+        if self._issue_names is None:
+            if self.category is None:
+                candidates = set(self.issues)
+                candidates.update(ISSUE_REPLACEMENTS)
+            else:
+                candidates = set(self.issues or ISSUE_CATEGORIES)
+                candidates.update(ISSUE_REPLACEMENTS)
+                if self.issues is None:
+                    candidates.update(issue for (issue,) in db.query(distinct(DiagnosisSketch.detected_issue)))
+            self._issue_names = frozenset(issue for issue in candidates if self.matches_issue(issue))
+        return self._issue_names
+
+    # ---------------- SQL ----------------
+
+    def predicates(self, db: Session, model=DiagnosisRecord) -> list:
+        """
+        SQLAlchemy conditions on diagnosis_records (or a table with the same columns)
+
+        ``db`` se usa solo para resolver la categoría; los predicados
+        resultantes sirven en cualquier shard.
+        """
+        conditions = []
+        if self.since is not None:
+            conditions.append(model.timestamp >= self.since)
+        if self.until is not None:
+            conditions.append(model.timestamp < self.until)
+        issue_names = self.issue_names(db)
+        if issue_names is not None:
+            conditions.append(model.detected_issue.in_(sorted(issue_names)))
+        if self.location_prefix is not None:
+            conditions.append(model.location >= self.location_prefix)
+            upper = _prefix_upper_bound(self.location_prefix)
+            if upper is not None:
+                conditions.append(model.location < upper)
+            conditions.append(model.location.startswith(self.location_prefix, autoescape=True))
+        if self.min_confidence is not None:
+            conditions.append(model.confidence >= self.min_confidence)
+        if self.max_confidence is not None:
+            conditions.append(model.confidence <= self.max_confidence)
+        return conditions
+
+    def sketch_predicates(self, db: Session, since: Optional[datetime] = None) -> list:
+        """
+        Conditions on diagnosis_sketches (weekly buckets; the range is rounded to weeks)
+
+        Los sketches no guardan la confianza de cada fila; ese filtro lo
+        aplica cada endpoint según lo que el sketch permite.
+        """
+        conditions = []
+        start = max(filter(None, [since, self.since]), default=None)
+        if start is not None:
+            conditions.append(DiagnosisSketch.bucket_start >= week_start(start))
+        if self.until is not None:
+            conditions.append(DiagnosisSketch.bucket_start < self.until)
+        issue_names = self.issue_names(db)
+        if issue_names is not None:
+            conditions.append(DiagnosisSketch.detected_issue.in_(sorted(issue_names)))
+        if self.location_prefix is not None:
+            conditions.append(DiagnosisSketch.location.startswith(self.location_prefix, autoescape=True))
+        return conditions
+
+    # ---------------- NumPy ----------------
+
+    def mask(
+        self,
+        timestamps: "np.ndarray",
+        issue_codes: "np.ndarray",
+        issue_names: List[str],
+        confidence: "np.ndarray",
+        location_codes: Optional["np.ndarray"] = None,
+        location_names: Optional[List[Optional[str]]] = None,
+    ) -> Optional["np.ndarray"]:
+        """
+        Boolean mask of the rows that pass the filters (None = every row)
+
+        Problemas y ubicaciones se evalúan una vez por valor del diccionario
+        y luego se indexan con los códigos de cada fila.
+        """
+        if not self.active:
+            return None
+        import numpy as np  # Solo para el almacén columnar y el archivo
+        
+        mask = np.ones(len(timestamps), dtype=bool)
+        if self.since is not None:
+            mask &= timestamps >= np.datetime64(self.since, "us")
+        if self.until is not None:
+            mask &= timestamps < np.datetime64(self.until, "us")
+        if self.has_issue_filter:
+            allowed = np.array([self.matches_issue(name) for name in issue_names], dtype=bool)
+            mask &= allowed[issue_codes] if len(allowed) else False
+        if self.location_prefix is not None:
+            if location_codes is None:
+                raise ValueError("location filter needs the location column")
+            allowed = np.array(
+                [bool(name) and name.startswith(self.location_prefix) for name in location_names],
+                dtype=bool
+            )
+            mask &= allowed[location_codes] if len(allowed) else False
+        if self.min_confidence is not None:
+            mask &= confidence >= self.min_confidence
+        if self.max_confidence is not None:
+            mask &= confidence <= self.max_confidence
+        return mask
+
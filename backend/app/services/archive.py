@@ -0,0 +1,535 @@
+"""
+Cold-data archive of diagnosis_records in Parquet
+
+Los meses cerrados más antiguos que ``ARCHIVE_HOT_MONTHS`` se copian a un
+archivo Parquet comprimido por mes (``ARCHIVE_DIR/diagnoses-YYYY-MM.<versión>.parquet``)
+y luego se borran de la tabla caliente en lotes. ``manifest.json`` guarda por
+mes el estado, el número de filas y los mínimos/máximos de id y timestamp, para
+descartar archivos completos sin abrirlos.
+
+Un mes se archiva con sus filas con ``id <= cutoff_id`` (el id más alto al
+empezar) que no tengan action items. Los ids copiados se guardan en
+archive_pending_deletes y el borrado elimina exactamente esos ids: una fila
+con id bajo que se confirma después de la copia (posible en PostgreSQL) se
+queda en la tabla caliente y entra al archivo en una corrida posterior, igual
+que los diagnósticos que llegan tarde con fechas viejas. Mientras un mes está
+en estado "deleting" sus filas copiadas existen en ambos lados y las
+consultas calientes las excluyen (``hot_exclusions``) para no contarlas dos
+veces.
+
+Cada escritura de un mes crea un archivo nuevo (el anterior más las filas
+nuevas); el cambio de manifiesto es el único paso que lo publica, así que un
+lector nunca ve el archivo nuevo sin la exclusión de sus filas calientes.
+
+Solo /analytics/frequent-issues y /analytics/trends suman el archivo; el
+resto de /metrics y /analytics cubre la tabla caliente. Los sketches
+semanales (dispositivos únicos, percentiles) no se tocan al archivar, y
+rebuild_sketches.py conserva los de las semanas archivadas (``archived_until``).
+
+pyarrow es opcional y se importa al primer uso: sin él el archivado no corre
+y no se lee el archivo.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.events import event_bus, INGEST_CHANNEL
+from app.crud.crud import CATEGORIES, ISSUE_REPLACEMENTS, canonical_issue, categorize_issue
+from app.models.models import ActionItem, ArchivePendingDelete, DiagnosisRecord
+
+logger = logging.getLogger("kaapeh.archive")
+
+ARCHIVE_LOCK_KEY = 0x4B4150_4152  # Un solo worker archiva a la vez
+MANIFEST_NAME = "manifest.json"
+
+
+class ArchiveError(RuntimeError):
+    """
+    The hot table and an archive file disagree; the month stays in "deleting"
+    """
+
+_ARCHIVE_COLUMNS = (
+    DiagnosisRecord.id,
+    DiagnosisRecord.user_id,
+    DiagnosisRecord.timestamp,
+    DiagnosisRecord.detected_issue,
+    DiagnosisRecord.confidence,
+    DiagnosisRecord.user_feedback_correct,
+    DiagnosisRecord.user_corrected_issue,
+    DiagnosisRecord.ai_explanation,
+    DiagnosisRecord.location,
+)
+
+
+_arrow: Optional[tuple] = None
+
+
+def _pyarrow() -> tuple:
+    """
+    (pyarrow, pyarrow.compute, pyarrow.parquet), or () when not installed
+    """
+    global _arrow
+    if _arrow is None:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.parquet
+            _arrow = (pyarrow, pyarrow.compute, pyarrow.parquet)
+        except ImportError:
+            _arrow = ()
+    return _arrow
+
+
+def available() -> bool:
+    return bool(_pyarrow())
+
+
+def _schema():
+    pa = _pyarrow()[0]
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+        ("detected_issue", pa.string()),
+        ("confidence", pa.float64()),
+        ("user_feedback_correct", pa.bool_()),
+        ("user_corrected_issue", pa.string()),
+        ("ai_explanation", pa.string()),
+        ("location", pa.string()),
+    ])
+
+
+def _month_bounds(month: str) -> Tuple[datetime, datetime]:
+    start = datetime.strptime(month, "%Y-%m")
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def _month_key(moment: datetime) -> str:
+    return moment.strftime("%Y-%m")
+
+
+def archive_boundary(hot_months: int, now: Optional[datetime] = None) -> datetime:
+    """
+    First instant that stays hot: start of the current month minus ``hot_months``
+    """
+    now = now or datetime.utcnow()
+    index = now.year * 12 + (now.month - 1) - hot_months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+# ==================== MANIFEST ====================
+
+class Manifest:
+    """
+    manifest.json of the archive directory, re-read when it changes on disk
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.path = self.directory / MANIFEST_NAME
+        self._months: Dict[str, dict] = {}
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def months(self) -> Dict[str, dict]:
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            if mtime != self._mtime:
+                self._months = json.loads(self.path.read_text()).get("months", {})
+                self._mtime = mtime
+            return self._months
+
+    def save(self, months: Dict[str, dict]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": 1, "months": months}, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+    def update(self, month: str, entry: dict) -> None:
+        months = dict(self.months())
+        months[month] = entry
+        self.save(months)
+
+
+manifest = Manifest(settings.ARCHIVE_DIR)
+
+
+def archived_until() -> Optional[datetime]:
+    """
+    End of the latest month in the manifest (None with nothing archived)
+    """
+    months = manifest.months()
+    if not months:
+        return None
+    return _month_bounds(max(months))[1]
+
+
+def _archived_predicate(month: str, cutoff_id: int):
+    """
+    Hot rows of ``month`` that can be copied to the archive
+    """
+    start, end = _month_bounds(month)
+    return and_(
+        DiagnosisRecord.timestamp >= start,
+        DiagnosisRecord.timestamp < end,
+        DiagnosisRecord.id <= cutoff_id,
+        DiagnosisRecord.id.notin_(
+            select(ActionItem.diagnosis_id).where(ActionItem.diagnosis_id.isnot(None))
+        ),
+    )
+
+
+def hot_exclusions() -> list:
+    """
+    Filters that hide hot rows already copied to a month still being deleted
+    """
+    months = [month for month, entry in manifest.months().items() if entry.get("status") == "deleting"]
+    if not months:
+        return []
+    return [DiagnosisRecord.id.notin_(
+        select(ArchivePendingDelete.diagnosis_id).where(ArchivePendingDelete.month.in_(months))
+    )]
+
+
+def deleting_in_progress() -> bool:
+    return any(entry.get("status") == "deleting" for entry in manifest.months().values())
+
+
+# ==================== WRITE ====================
+
+def _write_month(db: Session, month: str, cutoff_id: int, batch_size: int,
+                 previous: Optional[dict], hot_ids: Optional[List[int]] = None) -> dict:
+    """
+    Write a new archive file for the month: the current file plus new hot rows
+
+    Con ``hot_ids`` None copia las filas archivables de la tabla caliente y
+    registra sus ids en archive_pending_deletes (un commit por lote, sin
+    retener la tabla); si no, reescribe el archivo sin esos ids (filas que
+    ganaron un action item durante el borrado). El archivo nuevo no se publica
+    hasta que el llamador actualiza el manifiesto.
+    """
+    pa, pc, pq = _pyarrow()
+    directory = manifest.directory
+    directory.mkdir(parents=True, exist_ok=True)
+    filename = f"diagnoses-{month}.{time.time_ns()}.parquet"
+    target = directory / filename
+    tmp = directory / f"{filename}.tmp"
+    schema = _schema()
+    names = schema.names
+
+    rows = 0
+    pending = 0
+    stats = {"min_id": None, "max_id": None, "min_timestamp": None, "max_timestamp": None}
+
+    def track(table) -> None:
+        nonlocal rows
+        if not table.num_rows:
+            return
+        rows += table.num_rows
+        for column, low, high in (("id", "min_id", "max_id"), ("timestamp", "min_timestamp", "max_timestamp")):
+            bounds = pc.min_max(table[column])
+            lo, hi = bounds["min"].as_py(), bounds["max"].as_py()
+            if lo is not None and (stats[low] is None or lo < stats[low]):
+                stats[low] = lo
+            if hi is not None and (stats[high] is None or hi > stats[high]):
+                stats[high] = hi
+
+    with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+        # Filas archivadas antes (diagnósticos tardíos de un mes ya archivado)
+        if previous is not None:
+            current = pq.read_table(directory / previous["file"], schema=schema)
+            if hot_ids:
+                current = current.filter(pc.invert(pc.is_in(current["id"], pa.array(hot_ids, pa.int64()))))
+            writer.write_table(current)
+            track(current)
+
+        if hot_ids is None:
+            db.execute(delete(ArchivePendingDelete).where(ArchivePendingDelete.month == month))
+            db.commit()
+            query = select(*_ARCHIVE_COLUMNS).where(_archived_predicate(month, cutoff_id))\
+                .order_by(DiagnosisRecord.id).limit(batch_size)
+            last_id = 0
+            while True:
+                batch = db.execute(query.where(DiagnosisRecord.id > last_id)).all()
+                if not batch:
+                    break
+                table = pa.Table.from_arrays(
+                    [pa.array(values, type=schema.field(name).type) for name, values in zip(names, zip(*batch))],
+                    schema=schema
+                )
+                writer.write_table(table)
+                track(table)
+                db.execute(insert(ArchivePendingDelete), [{"diagnosis_id": row[0], "month": month} for row in batch])
+                db.commit()
+                pending += len(batch)
+                last_id = batch[-1][0]
+
+    os.replace(tmp, target)
+    return {
+        "file": filename,
+        "rows": rows,
+        "pending_rows": pending,
+        "cutoff_id": cutoff_id,
+        "min_id": stats["min_id"],
+        "max_id": stats["max_id"],
+        "min_timestamp": stats["min_timestamp"].isoformat() if stats["min_timestamp"] else None,
+        "max_timestamp": stats["max_timestamp"].isoformat() if stats["max_timestamp"] else None,
+        "bytes": target.stat().st_size,
+        "archived_at": datetime.utcnow().isoformat(),
+    }
+
+
+def _file_rows(entry: dict) -> int:
+    return _pyarrow()[2].ParquetFile(manifest.directory / entry["file"]).metadata.num_rows
+
+
+def _remove_superseded(month: str, keep: str) -> None:
+    """
+    Delete older files of the month (and files of runs that failed before the manifest)
+    """
+    for path in manifest.directory.glob(f"diagnoses-{month}*.parquet"):
+        if path.name != keep:
+            path.unlink(missing_ok=True)
+
+
+def _delete_month(db: Session, month: str, entry: dict, batch_size: int) -> Tuple[int, List[int]]:
+    """
+    Delete the month's copied rows from the hot table, one short transaction per batch
+
+    Borra exactamente los ids de archive_pending_deletes y comprueba que cada
+    uno seguía en la tabla: si faltara alguno, el archivo tendría una fila que
+    ya no existe y se detiene con ArchiveError. Los ids que ganaron un action
+    item después de la copia no se borran y se devuelven para sacarlos del
+    archivo.
+
+    Returns:
+        (rows deleted by this call, ids kept hot)
+    """
+    if _file_rows(entry) != entry["rows"]:
+        raise ArchiveError(f"{entry['file']} does not have the {entry['rows']} rows listed in the manifest")
+    remaining = db.query(func.count(ArchivePendingDelete.diagnosis_id))\
+        .filter(ArchivePendingDelete.month == month).scalar()
+    if remaining > entry.get("pending_rows", remaining):
+        raise ArchiveError(f"{month} has {remaining} pending ids, more than the {entry['pending_rows']} archived")
+
+    ids_query = select(ArchivePendingDelete.diagnosis_id)\
+        .where(ArchivePendingDelete.month == month)\
+        .order_by(ArchivePendingDelete.diagnosis_id)\
+        .limit(batch_size)
+    deleted = 0
+    kept: List[int] = []
+    last_id = 0
+    while True:
+        ids = db.execute(ids_query.where(ArchivePendingDelete.diagnosis_id > last_id)).scalars().all()
+        if not ids:
+            break
+        last_id = ids[-1]
+        linked = set(db.execute(
+            select(ActionItem.diagnosis_id).where(ActionItem.diagnosis_id.in_(ids))
+        ).scalars())
+        doomed = [diagnosis_id for diagnosis_id in ids if diagnosis_id not in linked]
+        count = db.query(DiagnosisRecord).filter(DiagnosisRecord.id.in_(doomed))\
+            .delete(synchronize_session=False) if doomed else 0
+        if count != len(doomed):
+            db.rollback()
+            raise ArchiveError(
+                f"{month}: {len(doomed) - count} archived rows were already gone from the hot table"
+            )
+        # Los ids conservados quedan pendientes (ocultos) hasta reescribir el archivo
+        db.execute(delete(ArchivePendingDelete).where(ArchivePendingDelete.diagnosis_id.in_(doomed)))
+        db.commit()
+        deleted += count
+        kept.extend(sorted(linked))
+    return deleted, kept
+
+
+def archive_closed_months(
+    db: Session,
+    hot_months: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    dry_run: bool = False
+) -> List[dict]:
+    """
+    Archive every closed month older than ``hot_months`` and delete it from the hot table
+
+    Returns:
+        One entry per archived month (with the candidate row counts on dry runs)
+    """
+    if not available():
+        logger.warning("pyarrow is not installed; skipping archive")
+        return []
+
+    hot_months = settings.ARCHIVE_HOT_MONTHS if hot_months is None else hot_months
+    batch_size = batch_size or settings.ARCHIVE_DELETE_BATCH_SIZE
+    boundary = archive_boundary(hot_months)
+
+    lock_conn = None
+    if db.get_bind().dialect.name == "postgresql":
+        lock_conn = db.get_bind().connect()
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK_KEY}).scalar():
+            lock_conn.close()
+            return []
+
+    try:
+        cutoff_id = db.query(func.max(DiagnosisRecord.id)).scalar() or 0
+        known = manifest.months()
+
+        # Meses con filas calientes archivables (o un borrado a medias)
+        candidates = {
+            month: entry["cutoff_id"] for month, entry in known.items() if entry.get("status") == "deleting"
+        }
+        oldest = db.query(func.min(DiagnosisRecord.timestamp))\
+            .filter(DiagnosisRecord.timestamp < boundary).scalar()
+        month_start = datetime(oldest.year, oldest.month, 1) if oldest else boundary
+        while month_start < boundary:
+            month = _month_key(month_start)
+            candidates.setdefault(month, cutoff_id)
+            month_start = _month_bounds(month)[1]
+
+        results = []
+        for month, month_cutoff in sorted(candidates.items()):
+            entry = known.get(month)
+            if entry is None or entry.get("status") != "deleting":
+                pending = db.query(func.count(DiagnosisRecord.id))\
+                    .filter(_archived_predicate(month, month_cutoff)).scalar()
+                if not pending:
+                    continue
+                if dry_run:
+                    results.append({"month": month, "rows": pending, "status": "dry_run"})
+                    continue
+                entry = _write_month(db, month, month_cutoff, batch_size, entry)
+                entry["status"] = "deleting"
+                manifest.update(month, entry)
+            elif dry_run:
+                results.append({"month": month, "rows": entry["rows"], "status": "deleting"})
+                continue
+
+            deleted, kept = _delete_month(db, month, entry, batch_size)
+            if kept:
+                entry = {**_write_month(db, month, entry["cutoff_id"], batch_size, entry, hot_ids=kept),
+                         "pending_rows": entry["pending_rows"] - len(kept)}
+            entry = {**entry, "status": "complete"}
+            manifest.update(month, entry)
+            db.execute(delete(ArchivePendingDelete).where(ArchivePendingDelete.month == month))
+            db.commit()
+            _remove_superseded(month, entry["file"])
+            results.append({"month": month, "rows": entry["rows"], "deleted": deleted, "status": "complete"})
+            logger.info("Archived %s: %d rows (%d deleted from the hot table)", month, entry["rows"], deleted)
+
+            # Las copias en memoria (caches, almacén columnar) incluían las filas borradas
+            event_bus.publish(INGEST_CHANNEL, {"resync": True})
+
+        return results
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK_KEY})
+            lock_conn.close()
+
+
+# ==================== READ ====================
+
+@lru_cache(maxsize=36)
+def _load_month(path: str, mtime: float):
+    """
+    Timestamp, issue and location codes/names and confidence of one archive file (cached per mtime)
+    """
+    import numpy as np
+
+    pq = _pyarrow()[2]
+    table = pq.read_table(path, columns=["timestamp", "detected_issue", "confidence", "location"])
+    issues = table["detected_issue"].combine_chunks().dictionary_encode()
+    locations = table["location"].combine_chunks().dictionary_encode()
+    location_names = locations.dictionary.to_pylist() + [None]
+    return (
+        table["timestamp"].to_numpy(),
+        issues.indices.to_numpy(zero_copy_only=False).astype(np.int64),
+        issues.dictionary.to_pylist(),
+        table["confidence"].to_numpy(),
+        # Ubicación nula -> último código (None en location_names)
+        locations.indices.fill_null(len(location_names) - 1).to_numpy(zero_copy_only=False).astype(np.int64),
+        location_names,
+    )
+
+
+def _archived_months(filters):
+    """
+    Archive columns of the rows that pass an ``AnalyticsFilters``
+
+    Los meses cuyo rango [min_timestamp, max_timestamp] del manifiesto queda
+    fuera de since/until se descartan sin abrir el archivo.
+    """
+    months = manifest.months()
+    if not months or not available():
+        return
+    for month, entry in sorted(months.items()):
+        if not entry.get("rows"):
+            continue
+        if filters.since is not None and entry.get("max_timestamp") \
+                and datetime.fromisoformat(entry["max_timestamp"]) < filters.since:
+            continue
+        if filters.until is not None and entry.get("min_timestamp") \
+                and datetime.fromisoformat(entry["min_timestamp"]) >= filters.until:
+            continue
+        path = manifest.directory / entry["file"]
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            logger.warning("Archive file %s listed in the manifest is missing", path)
+            continue
+        timestamps, codes, names, confidence, location_codes, location_names = _load_month(str(path), mtime)
+        if ISSUE_REPLACEMENTS:
+            # Los archivos conservan los nombres de la taxonomía con que se escribieron
+            names = [canonical_issue(name) for name in names]
+        mask = filters.mask(timestamps, codes, names, confidence, location_codes, location_names)
+        if mask is not None:
+            timestamps, codes, confidence = timestamps[mask], codes[mask], confidence[mask]
+        yield timestamps, codes, names, confidence
+
+
+def add_issue_totals(totals: Dict[str, list], filters) -> Dict[str, list]:
+    """
+    Add archived [count, confidence_sum] per issue into ``totals``
+    """
+    import numpy as np
+
+    for _, codes, names, confidence in _archived_months(filters):
+        counts = np.bincount(codes, minlength=len(names))
+        conf_sums = np.bincount(codes, weights=confidence, minlength=len(names))
+        for code in np.flatnonzero(counts):
+            entry = totals.setdefault(names[code], [0, 0.0])
+            entry[0] += int(counts[code])
+            entry[1] += float(conf_sums[code])
+    return totals
+
+
+def add_trend_counts(counts: Dict[str, List[int]], filters, interval: str) -> Dict[str, List[int]]:
+    """
+    Add archived per-category counts per date bucket into ``counts``
+    """
+    import numpy as np
+
+    from app.services.columnar_store import bucket_category_counts
+
+    for timestamps, codes, names, _ in _archived_months(filters):
+        name_categories = np.array([CATEGORIES.index(categorize_issue(name)) for name in names], dtype=np.int64)
+        category = name_categories[codes] if len(names) else codes
+        for key, row in bucket_category_counts(timestamps, category, interval).items():
+            existing = counts.setdefault(key, [0] * len(CATEGORIES))
+            for index, value in enumerate(row):
+                existing[index] += value
+    return counts
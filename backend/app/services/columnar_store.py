@@ -0,0 +1,389 @@
+"""
+In-memory columnar snapshot of diagnosis_records for analytics
+
+Los endpoints de /analytics vuelven a leer siempre las mismas columnas de
+``diagnosis_records``. Con ``COLUMNAR_STORE_ENABLED`` cada worker mantiene esas
+columnas como arreglos NumPy compactos (textos codificados como diccionario) y
+los extiende con los ids nuevos que anuncia el bus de ingesta, solo hasta el
+horizonte confirmado de ``crud.committed_horizon``: en PostgreSQL una
+transacción lenta puede confirmar ids menores que la marca publicada, y el
+almacén no vuelve a mirar atrás de su último id. Las consultas se
+resuelven con máscaras vectorizadas y ``bincount`` y devuelven exactamente las
+mismas respuestas que el camino SQL.
+
+Si el almacén superaría ``COLUMNAR_STORE_MAX_BYTES`` se desactiva y los
+endpoints vuelven a consultar la base de datos. Una recarga completa cada
+``COLUMNAR_STORE_MAX_AGE_SECONDS`` recoge cambios que no pasan por /sync
+(feedback actualizado, archivado, scripts de carga).
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.cache import ingest_state
+from app.core.config import settings
+from app.core.events import event_bus, INGEST_CHANNEL
+from app.core.telemetry import registry, Gauge
+from app.crud.crud import CATEGORIES, categorize_issue, committed_horizon
+from app.db.database import SessionLocal
+from app.models.models import DiagnosisRecord
+
+logger = logging.getLogger("kaapeh.columnar")
+
+columnar_store_rows = registry.register(Gauge(
+    "kaapeh_columnar_store_rows",
+    "Diagnosis rows held by the in-memory columnar store",
+))
+columnar_store_bytes = registry.register(Gauge(
+    "kaapeh_columnar_store_bytes",
+    "Memory allocated by the in-memory columnar store",
+))
+
+# Columnas: (nombre, dtype)
+_COLUMNS = (
+    ("id", np.int64),
+    ("timestamp", "datetime64[us]"),
+    ("issue", np.int32),       # código en el diccionario de problemas
+    ("confidence", np.float64),
+    ("feedback", np.int8),     # -1 sin feedback, 0 incorrecto, 1 correcto
+    ("location", np.int32),    # código en el diccionario de ubicaciones (0 = sin ubicación)
+    ("user_id", np.int64),     # -1 sin usuario
+)
+BYTES_PER_ROW = sum(np.dtype(dtype).itemsize for _, dtype in _COLUMNS)
+
+_EPOCH_WEEKDAY = 3  # 1970-01-01 fue jueves
+
+
+def bucket_category_counts(timestamps: np.ndarray, category: np.ndarray,
+                           interval: str) -> Dict[str, List[int]]:
+    """
+    Count diagnoses per (date bucket, category) with the /trends date keys
+
+    Las claves coinciden con las del camino SQL: "%Y-%m-%d" por día, el lunes
+    de la semana por semana y "%Y-%m" por mes.
+    """
+    day = timestamps.astype("datetime64[D]")
+    if interval == "day":
+        bucket, unit = day, "D"
+    elif interval == "week":
+        weekday = (day.astype(np.int64) + _EPOCH_WEEKDAY) % 7
+        bucket, unit = day - weekday.astype("timedelta64[D]"), "D"
+    else:  # month
+        bucket, unit = day.astype("datetime64[M]"), "M"
+
+    keys, bucket_codes = np.unique(bucket, return_inverse=True)
+    n_categories = len(CATEGORIES)
+    counts = np.bincount(
+        bucket_codes.reshape(-1) * n_categories + category,
+        minlength=len(keys) * n_categories
+    ).reshape(len(keys), n_categories)
+    return {
+        str(key): [int(value) for value in row]
+        for key, row in zip(np.datetime_as_string(keys, unit=unit), counts)
+    }
+
+
+class _Dictionary:
+    """
+    String dictionary; codes are assigned in order of first appearance
+    """
+
+    def __init__(self, initial: Optional[List[str]] = None):
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+        for value in initial or []:
+            self.encode(value)
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ColumnarSnapshot:
+    """
+    Immutable view of the first ``size`` rows of the store
+
+    Los arreglos se comparten con el almacén (solo se agregan filas detrás de
+    ``size``), así que una vista no se ve afectada por refrescos concurrentes.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], size: int, issues: List[str],
+                 locations: List[str], issue_categories: np.ndarray):
+        self.size = size
+        self.columns = {name: array[:size] for name, array in columns.items()}
+        self.issues = issues[:]
+        self.locations = locations[:]
+        self.issue_categories = issue_categories
+
+    def _mask(self, filters) -> np.ndarray:
+        """
+        Rows that pass an ``AnalyticsFilters`` (None or no filters = every row)
+        """
+        mask = None
+        if filters is not None:
+            mask = filters.mask(
+                self.columns["timestamp"], self.columns["issue"], self.issues,
+                self.columns["confidence"], self.columns["location"], self.locations,
+            )
+        return np.ones(self.size, dtype=bool) if mask is None else mask
+
+    # ---------------- /analytics/frequent-issues ----------------
+
+    def issue_totals(self, filters=None) -> Dict[str, list]:
+        """
+        {issue: [count, confidence_sum]} for the diagnoses that pass the filters
+        """
+        mask = self._mask(filters)
+        issue = self.columns["issue"][mask]
+        n_issues = len(self.issues)
+        counts = np.bincount(issue, minlength=n_issues)
+        conf_sums = np.bincount(issue, weights=self.columns["confidence"][mask], minlength=n_issues)
+        return {
+            self.issues[code]: [int(counts[code]), float(conf_sums[code])]
+            for code in np.flatnonzero(counts)
+        }
+
+    # ---------------- /analytics/heatmap ----------------
+
+    def heatmap(self, filters=None) -> dict:
+        location = self.columns["location"]
+        mask = (location > 0) & self._mask(filters)
+        location = location[mask]
+        issue = self.columns["issue"][mask]
+        n_locations = len(self.locations)
+        n_issues = max(len(self.issues), 1)
+
+        counts = np.bincount(location, minlength=n_locations)
+        conf_sums = np.bincount(location, weights=self.columns["confidence"][mask], minlength=n_locations)
+        per_issue = np.bincount(location * n_issues + issue, minlength=n_locations * n_issues)
+        per_issue = per_issue.reshape(n_locations, n_issues)
+
+        # Mismo orden que el camino SQL: por cantidad y los empates por nombre
+        locations = []
+        for code in sorted(np.flatnonzero(counts), key=lambda code: (-counts[code], self.locations[code])):
+            count = int(counts[code])
+            row = per_issue[code]
+            most_common = min(np.flatnonzero(row == row.max()), key=lambda issue_code: self.issues[issue_code])
+            avg_conf = float(conf_sums[code] / count)
+            locations.append({
+                "location": self.locations[code],
+                "diagnoses_count": count,
+                "most_common_issue": self.issues[most_common],
+                "avg_confidence": round(avg_conf, 3) if avg_conf else 0
+            })
+
+        return {
+            "total_locations": len(locations),
+            "locations": locations
+        }
+
+    # ---------------- /analytics/trends ----------------
+
+    def trend_counts(self, filters, interval: str) -> Dict[str, List[int]]:
+        """
+        {date_key: per-category counts in CATEGORIES order}
+        """
+        mask = self._mask(filters)
+        category = self.issue_categories[self.columns["issue"][mask]]
+        return bucket_category_counts(self.columns["timestamp"][mask], category, interval)
+
+    # ---------------- /analytics/feedback-analysis ----------------
+
+    def feedback_analysis(self, filters=None) -> dict:
+        feedback = self.columns["feedback"]
+        mask = (feedback >= 0) & self._mask(filters)
+        issue = self.columns["issue"][mask]
+        correct_flags = feedback[mask] == 1
+        n_issues = len(self.issues)
+
+        totals = np.bincount(issue, minlength=n_issues)
+        corrects = np.bincount(issue, weights=correct_flags.astype(np.float64), minlength=n_issues).astype(np.int64)
+        total_with_feedback = int(totals.sum())
+        correct = int(corrects.sum())
+        incorrect = total_with_feedback - correct
+
+        # Mismo orden que el camino SQL: por más errores y los empates por nombre
+        issues_analysis = []
+        for code in np.unique(issue):
+            total = int(totals[code])
+            ok = int(corrects[code])
+            issues_analysis.append({
+                "issue": self.issues[code],
+                "total": total,
+                "correct": ok,
+                "incorrect": total - ok,
+                "accuracy": round(ok / total * 100, 2) if total > 0 else 0
+            })
+        issues_analysis.sort(key=lambda x: (-x["incorrect"], x["issue"]))
+
+        return {
+            "total_with_feedback": total_with_feedback,
+            "correct_diagnoses": correct,
+            "incorrect_diagnoses": incorrect,
+            "accuracy_rate": round((correct / total_with_feedback * 100), 2) if total_with_feedback > 0 else 0,
+            "issues_with_most_errors": issues_analysis[:10]  # Top 10
+        }
+
+
+class ColumnarStore:
+    """
+    Append-only columnar copy of diagnosis_records, refreshed by id
+    """
+
+    def __init__(self, max_bytes: int, max_age: float, batch_size: int = 50_000):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.over_budget = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._capacity = 0
+        self._size = 0
+        self._last_id = 0
+        self._loaded_at: Optional[float] = None
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in _COLUMNS}
+        self._issues = _Dictionary()
+        self._locations = _Dictionary([""])
+        self._issue_categories = np.empty(0, dtype=np.int64)
+        self._record_gauges()
+
+    def _record_gauges(self) -> None:
+        columnar_store_rows.set(self._size)
+        columnar_store_bytes.set(self._capacity * BYTES_PER_ROW)
+
+    def invalidate(self) -> None:
+        """
+        Drop all rows; the next snapshot reloads from the database
+        """
+        with self._lock:
+            self._reset()
+            self.over_budget = False
+
+    def _grow(self, needed: int) -> bool:
+        if needed <= self._capacity:
+            return True
+        capacity = max(needed, self._capacity * 2, 1024)
+        if needed * BYTES_PER_ROW > self.max_bytes:
+            return False
+        capacity = min(capacity, self.max_bytes // BYTES_PER_ROW)
+        for name, dtype in _COLUMNS:
+            grown = np.empty(capacity, dtype=dtype)
+            grown[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = grown
+        self._capacity = capacity
+        return True
+
+    def _append(self, rows: list) -> bool:
+        n = len(rows)
+        if not self._grow(self._size + n):
+            return False
+
+        ids, timestamps, issues, confidences, feedbacks, locations, user_ids = zip(*rows)
+        start, end = self._size, self._size + n
+        columns = self._columns
+        columns["id"][start:end] = ids
+        columns["timestamp"][start:end] = np.array(timestamps, dtype="datetime64[us]")
+        columns["issue"][start:end] = [self._issues.encode(value) for value in issues]
+        columns["confidence"][start:end] = confidences
+        columns["feedback"][start:end] = [-1 if value is None else int(value) for value in feedbacks]
+        columns["location"][start:end] = [self._locations.encode(value or "") for value in locations]
+        columns["user_id"][start:end] = [-1 if value is None else value for value in user_ids]
+
+        self._size = end
+        self._last_id = int(ids[-1])
+        return True
+
+    def _refresh(self, db: Session) -> None:
+        if db.info.get("replica") is not None:
+            # El horizonte es de la principal: una réplica atrasada todavía no
+            # tendría todas las filas hasta él y el almacén las saltaría
+            with SessionLocal() as primary:
+                return self._refresh(primary)
+        if self._loaded_at is None:
+            self._loaded_at = time.monotonic()
+        horizon = committed_horizon(db)
+
+        query = select(
+            DiagnosisRecord.id,
+            DiagnosisRecord.timestamp,
+            DiagnosisRecord.detected_issue,
+            DiagnosisRecord.confidence,
+            DiagnosisRecord.user_feedback_correct,
+            DiagnosisRecord.location,
+            DiagnosisRecord.user_id,
+        ).order_by(DiagnosisRecord.id).limit(self.batch_size)
+
+        while self._last_id < horizon:
+            rows = db.execute(
+                query.where(DiagnosisRecord.id > self._last_id, DiagnosisRecord.id <= horizon)
+            ).all()
+            if not rows:
+                break
+            if not self._append(rows):
+                logger.warning(
+                    "Columnar store exceeds COLUMNAR_STORE_MAX_BYTES=%d; analytics fall back to SQL",
+                    self.max_bytes
+                )
+                self._reset()
+                self.over_budget = True
+                return
+
+        self._issue_categories = np.array(
+            [CATEGORIES.index(categorize_issue(issue)) for issue in self._issues.values],
+            dtype=np.int64
+        )
+        self._record_gauges()
+
+    def snapshot(self, db: Session) -> Optional[ColumnarSnapshot]:
+        """
+        Catch up with the ingest watermark and return a view, or None to use SQL
+        """
+        if self.over_budget:
+            return None
+        watermark = ingest_state.watermark(db)
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at > self.max_age:
+                self._reset()
+            if self._loaded_at is None or self._last_id < watermark:
+                self._refresh(db)
+            if self.over_budget:
+                return None
+            return ColumnarSnapshot(
+                self._columns, self._size, self._issues.values,
+                self._locations.values, self._issue_categories
+            )
+
+
+columnar_store = ColumnarStore(
+    max_bytes=settings.COLUMNAR_STORE_MAX_BYTES,
+    max_age=settings.COLUMNAR_STORE_MAX_AGE_SECONDS,
+)
+
+
+def _on_ingest(payload: dict) -> None:
+    # Tras una reconexión del bus pudieron perderse eventos
+    if payload.get("resync"):
+        columnar_store.invalidate()
+
+
+event_bus.subscribe(INGEST_CHANNEL, _on_ingest)
+
+
+def get_snapshot(db: Session) -> Optional[ColumnarSnapshot]:
+    """
+    Columnar view for analytics, or None when the store is disabled or over budget
+    """
+    if not settings.COLUMNAR_STORE_ENABLED:
+        return None
+    return columnar_store.snapshot(db)
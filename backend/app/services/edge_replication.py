@@ -0,0 +1,253 @@
+"""
+Edge node replication: ship locally ingested diagnoses to the central instance
+
+En modo edge el backend corre en una laptop del beneficio con SQLite (WAL,
+``SQLITE_PRAGMAS``) y los dispositivos sincronizan contra ella aunque no haya
+internet. Este replicador envía a la instancia central (``EDGE_UPSTREAM_URL``)
+las filas nuevas de diagnosis_records cuando hay enlace:
+
+- Cada lote son las filas con id en (cursor, último id del lote], en el
+  formato columnar de ``sync_codec`` con sus ids y comprimido con gzip, a
+  ``POST /sync/replicate``. La central guarda por nodo el último id aplicado
+  en la misma transacción que las filas, así que reenviar un lote (se perdió
+  la respuesta, se cortó el proceso) no duplica nada.
+- El cursor vive en la central: al arrancar, o tras un 409, el nodo lo pide
+  y retoma desde ahí.
+- El tamaño del lote sigue al ancho de banda medido (``BatchSizer``) para
+  que cada envío tarde cerca de ``EDGE_BATCH_TARGET_SECONDS``; un timeout lo
+  reduce a la mitad. Sin enlace se reintenta con espera exponencial hasta
+  ``EDGE_MAX_BACKOFF_SECONDS``.
+
+Lo corre el scheduler de la app (``EDGE_REPLICATION_INTERVAL_SECONDS``) o
+``replicate_edge.py``. Solo se replican diagnósticos: son las únicas filas que
+el nodo agrega y nunca cambian después del /sync.
+"""
+
+import gzip
+import logging
+import socket
+import time
+from typing import Optional
+
+import httpx
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.telemetry import (
+    edge_replicated_rows_total, edge_replicated_bytes_total, edge_replication_failures_total,
+    edge_replication_backlog_rows, edge_replication_batch_rows, edge_replication_bandwidth,
+)
+from app.models.models import DiagnosisRecord
+from app.services import sync_codec
+
+logger = logging.getLogger("kaapeh.edge")
+
+_COLUMNS = (
+    DiagnosisRecord.id,
+    DiagnosisRecord.timestamp,
+    DiagnosisRecord.detected_issue,
+    DiagnosisRecord.confidence,
+    DiagnosisRecord.user_feedback_correct,
+    DiagnosisRecord.location,
+)
+
+
+class BatchSizer:
+    """
+    Rows per batch so that one upload takes about ``target_seconds``
+
+    Ancho de banda (bytes comprimidos por segundo, incluida la aplicación en
+    la central) y bytes por fila se suavizan con una media exponencial. El
+    lote crece como mucho al doble por envío y se reduce a la mitad tras un
+    fallo.
+    """
+
+    def __init__(self, min_rows: int, max_rows: int, target_seconds: float, alpha: float = 0.3):
+        self.min_rows = max(min_rows, 1)
+        self.max_rows = max(max_rows, self.min_rows)
+        self.target_seconds = target_seconds
+        self.alpha = alpha
+        self.rows = self.min_rows
+        self.bytes_per_second: Optional[float] = None
+        self.bytes_per_row: Optional[float] = None
+
+    def _smooth(self, previous: Optional[float], value: float) -> float:
+        return value if previous is None else previous + self.alpha * (value - previous)
+
+    def record(self, rows: int, sent_bytes: int, seconds: float) -> None:
+        if rows <= 0 or sent_bytes <= 0:
+            return
+        self.bytes_per_row = self._smooth(self.bytes_per_row, sent_bytes / rows)
+        self.bytes_per_second = self._smooth(self.bytes_per_second, sent_bytes / max(seconds, 1e-3))
+        ideal = self.target_seconds * self.bytes_per_second / self.bytes_per_row
+        self.rows = int(min(max(ideal, self.min_rows), 2 * self.rows, self.max_rows))
+
+    def failed(self) -> None:
+        self.rows = max(self.rows // 2, self.min_rows)
+
+
+class EdgeReplicator:
+    """
+    Uploads new local diagnoses to the central instance in resumable batches
+    """
+
+    def __init__(
+        self,
+        upstream_url: str,
+        node_id: str,
+        token: str,
+        cooperative_id: Optional[str] = None,
+        sizer: Optional[BatchSizer] = None,
+        timeout: float = 60.0,
+        max_backoff: float = 600.0,
+    ):
+        self.node_id = node_id
+        self.cooperative_id = cooperative_id
+        self.sizer = sizer or BatchSizer(100, 20000, 5.0)
+        self.max_backoff = max_backoff
+        self.cursor: Optional[int] = None  # Último id confirmado por la central (None = preguntar)
+        self._failures = 0
+        self._retry_at = 0.0
+        self._client = httpx.Client(
+            base_url=upstream_url.rstrip("/"),
+            timeout=timeout,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    @classmethod
+    def from_settings(cls) -> "EdgeReplicator":
+        return cls(
+            settings.EDGE_UPSTREAM_URL,
+            settings.EDGE_NODE_ID or socket.gethostname(),
+            settings.REPLICATION_TOKEN,
+            settings.EDGE_COOPERATIVE_ID,
+            BatchSizer(settings.EDGE_BATCH_MIN_ROWS, settings.EDGE_BATCH_MAX_ROWS, settings.EDGE_BATCH_TARGET_SECONDS),
+            settings.EDGE_UPLOAD_TIMEOUT_SECONDS,
+            settings.EDGE_MAX_BACKOFF_SECONDS,
+        )
+
+    def close(self) -> None:
+        self._client.close()
+
+    # ---------------- central ----------------
+
+    def fetch_cursor(self) -> int:
+        response = self._client.get(f"/sync/replicate/{self.node_id}")
+        response.raise_for_status()
+        self.cursor = response.json()["applied_through_id"]
+        return self.cursor
+
+    def _upload(self, rows: list, through_id: int) -> Optional[int]:
+        """
+        Send one batch; returns the new cursor, or None after a 409 (cursor refreshed)
+        """
+        body = gzip.compress(
+            sync_codec.encode(rows, cooperative_id=self.cooperative_id, with_ids=True), compresslevel=6
+        )
+        started = time.perf_counter()
+        response = self._client.post(
+            "/sync/replicate",
+            content=body,
+            headers={
+                "Content-Type": sync_codec.MEDIA_TYPES[0],
+                "Content-Encoding": "gzip",
+                "X-Edge-Node": self.node_id,
+                "X-Edge-After-Id": str(self.cursor),
+                "X-Edge-Through-Id": str(through_id),
+            },
+        )
+        elapsed = time.perf_counter() - started
+        if response.status_code == 409:
+            # Otro proceso del nodo avanzó, o la central se restauró de un respaldo
+            self.cursor = response.json()["applied_through_id"]
+            logger.warning("Central replication cursor moved; resuming after id %d", self.cursor)
+            return None
+        response.raise_for_status()
+
+        edge_replicated_bytes_total.inc(len(body))
+        edge_replicated_rows_total.inc(response.json()["rows_applied"])
+        self.sizer.record(len(rows), len(body), elapsed)
+        self.cursor = response.json()["applied_through_id"]
+        return self.cursor
+
+    # ---------------- loop ----------------
+
+    def backlog(self, db: Session) -> Optional[int]:
+        if self.cursor is None:
+            return None
+        return db.query(func.count(DiagnosisRecord.id)).filter(DiagnosisRecord.id > self.cursor).scalar()
+
+    def _publish_gauges(self, db: Session) -> None:
+        backlog = self.backlog(db)
+        if backlog is not None:
+            edge_replication_backlog_rows.set(backlog)
+        edge_replication_batch_rows.set(self.sizer.rows)
+        if self.sizer.bytes_per_second is not None:
+            edge_replication_bandwidth.set(round(self.sizer.bytes_per_second))
+
+    def _fail(self, reason: str, error: Exception) -> None:
+        self._failures += 1
+        delay = min(settings.EDGE_REPLICATION_INTERVAL_SECONDS * 2 ** (self._failures - 1), self.max_backoff)
+        self._retry_at = time.monotonic() + delay
+        edge_replication_failures_total.inc(reason=reason)
+        logger.warning("Edge replication %s (%s); retrying in %.0f s", reason, error, delay)
+
+    def run(self, db: Session, time_budget: Optional[float] = None) -> dict:
+        """
+        Upload batches until caught up, out of time, or the link fails
+
+        Returns:
+            {"batches", "rows", "cursor", "caught_up"} for this run
+        """
+        stats = {"batches": 0, "rows": 0, "cursor": self.cursor, "caught_up": False}
+        if time.monotonic() < self._retry_at:
+            return stats
+        deadline = time.monotonic() + time_budget if time_budget else None
+        try:
+            if self.cursor is None:
+                self.fetch_cursor()
+            while True:
+                rows = [
+                    row._asdict() for row in db.query(*_COLUMNS)
+                    .filter(DiagnosisRecord.id > self.cursor)
+                    .order_by(DiagnosisRecord.id)
+                    .limit(self.sizer.rows)
+                    .all()
+                ]
+                db.rollback()  # No retener el snapshot de lectura mientras se sube
+                if not rows:
+                    stats["caught_up"] = True
+                    break
+                before = self.cursor
+                if self._upload(rows, rows[-1]["id"]) is None:
+                    continue
+                stats["batches"] += 1
+                stats["rows"] += sum(1 for row in rows if row["id"] > before)
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+            self._failures = 0
+        except httpx.TimeoutException as e:
+            self.sizer.failed()
+            self._fail("timeout", e)
+        except httpx.TransportError as e:
+            self._fail("unreachable", e)
+        except httpx.HTTPStatusError as e:
+            self._fail(f"http_{e.response.status_code}", e)
+        finally:
+            stats["cursor"] = self.cursor
+            self._publish_gauges(db)
+        return stats
+
+
+_replicator: Optional[EdgeReplicator] = None
+
+
+def get_replicator() -> Optional[EdgeReplicator]:
+    """
+    Process-wide replicator, or None when EDGE_UPSTREAM_URL is not set
+    """
+    global _replicator
+    if _replicator is None and settings.EDGE_UPSTREAM_URL:
+        _replicator = EdgeReplicator.from_settings()
+    return _replicator
@@ -0,0 +1,187 @@
+"""
+Live dashboard stream (Server-Sent Events)
+
+En lugar de que cada pantalla abierta vuelva a pedir /metrics, /categories y
+/analytics/trends cada pocos segundos, el worker recalcula ese estado una
+sola vez después de cada ingesta (evento ``INGEST_CHANNEL``) y envía a todos
+los suscriptores el mismo frame ya serializado:
+
+- ``event: snapshot``: estado completo (al conectarse y tras un desborde)
+- ``event: delta``: solo lo que cambió, como JSON merge patch (RFC 7386)
+  sobre el estado anterior; ``id`` es la versión del estado
+
+Cada suscriptor tiene una cola acotada. Si un cliente lento la llena, se
+descartan sus deltas pendientes y recibe un snapshot nuevo en su lugar, así
+el worker nunca acumula memoria por un consumidor que no lee.
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.events import event_bus, INGEST_CHANNEL
+from app.core.responses import dumps
+from app.core.telemetry import sse_broadcasts_total, sse_overflows_total, sse_subscribers
+
+logger = logging.getLogger("kaapeh.stream")
+
+KEEPALIVE_FRAME = b": keepalive\n\n"
+RETRY_FRAME = b"retry: 3000\n\n"  # Espera de EventSource antes de reconectarse
+
+
+def merge_patch(previous: Any, current: Any) -> Any:
+    """
+    JSON merge patch turning ``previous`` into ``current`` (None when equal)
+
+    Las claves que desaparecen se envían como null; las listas se reemplazan
+    completas.
+    """
+    if not isinstance(previous, dict) or not isinstance(current, dict):
+        return None if previous == current else current
+    patch = {}
+    for key, value in current.items():
+        if key not in previous:
+            patch[key] = value
+        elif previous[key] != value:
+            patch[key] = merge_patch(previous[key], value) if isinstance(value, dict) else value
+    for key in previous:
+        if key not in current:
+            patch[key] = None
+    return patch or None
+
+
+def _frame(event: str, version: int, data: Any) -> bytes:
+    return f"id: {version}\nevent: {event}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+
+class Subscriber:
+    """
+    Bounded queue of frames for one open stream
+    """
+
+    def __init__(self, max_frames: int):
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=max_frames)
+
+    def offer(self, frame: bytes, snapshot: Callable[[], bytes]) -> None:
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Cliente lento: sus deltas ya no sirven, se reemplazan por el estado completo
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(snapshot())
+            sse_overflows_total.inc()
+
+
+class MetricsBroadcaster:
+    """
+    Computes the dashboard state once per ingest and fans it out to subscribers
+    """
+
+    def __init__(self, compute: Callable[[], dict], coalesce_seconds: float, max_subscribers: int, max_frames: int):
+        self.compute = compute
+        self.coalesce_seconds = coalesce_seconds
+        self.max_subscribers = max_subscribers
+        self.max_frames = max_frames
+        self._subscribers: Set[Subscriber] = set()
+        self._state: Optional[dict] = None
+        self._version = 0
+        self._stale = True
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._compute_lock: Optional[asyncio.Lock] = None
+        self._snapshot: tuple = (None, b"")
+        event_bus.subscribe(INGEST_CHANNEL, self._on_ingest)
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._compute_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _on_ingest(self, payload: dict) -> None:
+        # Llega desde el hilo del bus o del threadpool de /sync
+        self._stale = True
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def _refresh(self) -> Optional[dict]:
+        """
+        Recompute the state if it is stale; returns the merge patch (None if nothing changed)
+        """
+        async with self._compute_lock:
+            if not self._stale and self._state is not None:
+                return None
+            self._stale = False
+            state = await run_in_threadpool(self.compute)
+            patch = merge_patch(self._state, state) if self._state is not None else state
+            if patch is not None:
+                self._state = state
+                self._version += 1
+            return patch
+
+    def _snapshot_frame(self) -> bytes:
+        # Se serializa una vez por versión aunque desborden muchos clientes
+        if self._snapshot[0] != self._version:
+            self._snapshot = (self._version, _frame("snapshot", self._version, self._state))
+        return self._snapshot[1]
+
+    def _broadcast(self, patch: Optional[dict]) -> None:
+        if patch is None or not self._subscribers:
+            return
+        frame = _frame("delta", self._version, patch)
+        sse_broadcasts_total.inc()
+        for subscriber in list(self._subscribers):
+            subscriber.offer(frame, self._snapshot_frame)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Juntar las ingestas de una ráfaga en un solo cálculo
+            await asyncio.sleep(self.coalesce_seconds)
+            self._wakeup.clear()
+            if not self._subscribers:
+                continue  # Se recalcula cuando se conecte alguien
+            try:
+                self._broadcast(await self._refresh())
+            except Exception:
+                logger.exception("Failed to compute live dashboard state")
+
+    async def subscribe(self) -> Optional[Subscriber]:
+        """
+        Register a subscriber primed with the current snapshot (None when full)
+        """
+        if len(self._subscribers) >= self.max_subscribers:
+            return None
+        if self._task is None:
+            self.start()
+        # Si había una ingesta pendiente, los suscriptores actuales reciben su delta
+        self._broadcast(await self._refresh())
+        subscriber = Subscriber(self.max_frames)
+        subscriber.queue.put_nowait(self._snapshot_frame())
+        self._subscribers.add(subscriber)
+        sse_subscribers.set(len(self._subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+        sse_subscribers.set(len(self._subscribers))
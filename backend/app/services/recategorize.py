@@ -0,0 +1,357 @@
+"""
+Online re-categorization of historical diagnoses after a taxonomy change
+
+Cuando las clases del modelo CoreML se renombran o se dividen, los
+``detected_issue`` y ``user_corrected_issue`` históricos se reescriben en
+segundo plano sin bloquear diagnosis_records:
+
+1. ``start_recategorization`` guarda la taxonomía nueva (issue_taxonomy) y
+   crea el trabajo en maintenance_jobs. Desde ese momento /sync guarda los
+   nombres nuevos y la distribución de /metrics, los snapshots y el archivo
+   Parquet traducen los viejos.
+2. ``run_job`` recorre la base principal y cada shard por rangos de id
+   (``RECATEGORIZE_CHUNK_IDS``): un UPDATE corto por rango y una pausa
+   después, para no ocupar más de ``RECATEGORIZE_MAX_DUTY`` del tiempo. El
+   cursor se guarda tras cada rango (en la principal, en la misma
+   transacción que el UPDATE); un proceso que muere se retoma donde quedó y
+   repetir un rango no cambia nada.
+3. Al terminar se combinan los sketches semanales de las clases viejas con
+   los de las nuevas y se publica un resync para que caches y almacén
+   columnar se recarguen.
+
+Las lecturas solo compiten con un rango a la vez, así que analytics sigue en
+línea. Se corre con ``recategorize_issues.py`` o lo retoma el scheduler de la
+app (``RECATEGORIZE_INTERVAL_SECONDS``, ``RECATEGORIZE_TICK_SECONDS`` por turno).
+"""
+
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import case, func, or_, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.events import event_bus, INGEST_CHANNEL
+from app.core.telemetry import maintenance_job_progress, maintenance_rows_updated_total
+from app.crud import crud
+from app.db.database import SessionLocal
+from app.db.shards import shard_router, PRIMARY
+from app.models.models import DiagnosisRecord, IssueTaxonomy, MaintenanceJob
+
+logger = logging.getLogger("kaapeh.recategorize")
+
+KIND = "recategorize"
+ACTIVE = ("pending", "running")
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobOwnershipLost(RuntimeError):
+    """
+    The job was paused or taken over by another process while this one ran it
+    """
+
+
+def _bases() -> list:
+    return [PRIMARY, *shard_router.names] if shard_router.enabled else [PRIMARY]
+
+
+def _max_id(session: Session) -> int:
+    return session.query(func.max(DiagnosisRecord.id)).scalar() or 0
+
+
+def progress(job: MaintenanceJob) -> float:
+    """
+    Fraction of the id range already processed, over all databases
+    """
+    uppers = job.upper_ids or {}
+    total = sum(uppers.values())
+    if not total:
+        return 1.0 if job.status == "complete" else 0.0
+    done = sum(min((job.cursors or {}).get(base, 0), upper) for base, upper in uppers.items())
+    return round(done / total, 4)
+
+
+# ==================== START ====================
+
+def _validate(renames: Dict[str, str], categories: Dict[str, str]) -> None:
+    for issue, category in categories.items():
+        if category not in crud.CATEGORIES:
+            raise ValueError(f"Unknown category '{category}' for '{issue}'")
+    for old, new in renames.items():
+        if not old or not new or old == new:
+            raise ValueError(f"Invalid rename '{old}' -> '{new}'")
+
+    # Los destinos dejan de estar reemplazados; no puede quedar un ciclo
+    replacements = {old: new for old, new in crud.ISSUE_REPLACEMENTS.items() if old not in renames.values()}
+    replacements.update(renames)
+    for start in replacements:
+        seen, issue = set(), start
+        while issue in replacements:
+            if issue in seen:
+                raise ValueError(f"Rename cycle through '{start}'")
+            seen.add(issue)
+            issue = replacements[issue]
+
+
+def start_recategorization(db: Session, renames: Dict[str, str], categories: Dict[str, str]) -> MaintenanceJob:
+    """
+    Save the new taxonomy and queue the job that rewrites historical rows
+
+    ``renames`` va de nombre anterior a nombre nuevo (en una división, a la
+    clase que hereda los diagnósticos históricos); ``categories`` asigna la
+    categoría del dashboard a las clases nuevas.
+
+    Raises:
+        ValueError: unknown category, empty rename or rename cycle
+    """
+    crud.load_issue_taxonomy(db)
+    _validate(renames, categories)
+
+    crud.save_issue_taxonomy(db, renames, categories)
+    db.flush()
+    crud.load_issue_taxonomy(db)
+    # Todos los nombres reemplazados, también los de cambios anteriores sin terminar
+    mapping = {old: crud.canonical_issue(old) for old in crud.ISSUE_REPLACEMENTS}
+
+    job = MaintenanceJob(
+        kind=KIND,
+        status="pending",
+        params={"renames": renames, "categories": categories, "mapping": mapping},
+        cursors={},
+        upper_ids={},
+        rows_updated=0,
+    )
+    db.add(job)
+    db.commit()
+
+    # Los demás workers recargan la taxonomía y descartan lo calculado con la anterior
+    event_bus.publish(INGEST_CHANNEL, {"resync": True, "taxonomy": True})
+    logger.info("Queued re-categorization job %d: %s", job.id, renames)
+    return job
+
+
+# ==================== RUN ====================
+
+def _claim(db: Session, job_id: Optional[int], stale_seconds: float) -> Optional[MaintenanceJob]:
+    """
+    Take ownership of a pending job, or of a running one whose owner stopped sending heartbeats
+    """
+    now = datetime.utcnow()
+    claimable = [
+        MaintenanceJob.kind == KIND,
+        MaintenanceJob.status.in_(ACTIVE),
+        or_(
+            MaintenanceJob.owner.is_(None),
+            MaintenanceJob.owner == OWNER,
+            MaintenanceJob.heartbeat_at < now - timedelta(seconds=stale_seconds),
+        ),
+    ]
+    if job_id is None:
+        candidate = db.query(MaintenanceJob.id).filter(*claimable).order_by(MaintenanceJob.id).first()
+        if candidate is None:
+            db.rollback()
+            return None
+        job_id = candidate[0]
+
+    claimed = db.execute(
+        update(MaintenanceJob)
+        .where(MaintenanceJob.id == job_id, *claimable)
+        .values(owner=OWNER, heartbeat_at=now, status="running", error=None)
+    ).rowcount
+    db.commit()
+    if not claimed:
+        return None
+    return db.query(MaintenanceJob).populate_existing().filter(MaintenanceJob.id == job_id).one()
+
+
+def _save_progress(db: Session, job: MaintenanceJob, **values) -> None:
+    """
+    Persist cursor and counters, only while this process still owns the job (no commit)
+    """
+    values["heartbeat_at"] = datetime.utcnow()
+    saved = db.execute(
+        update(MaintenanceJob)
+        .where(MaintenanceJob.id == job.id, MaintenanceJob.owner == OWNER, MaintenanceJob.status == "running")
+        .values(**values)
+    ).rowcount
+    if not saved:
+        db.rollback()
+        raise JobOwnershipLost(f"Job {job.id} was paused or claimed by another process")
+    for name, value in values.items():
+        setattr(job, name, value)
+
+
+def _rewrite_statement(mapping: Dict[str, str]):
+    table = DiagnosisRecord.__table__
+    return update(table).where(
+        or_(table.c.detected_issue.in_(list(mapping)), table.c.user_corrected_issue.in_(list(mapping)))
+    ).values(
+        detected_issue=case(mapping, value=table.c.detected_issue, else_=table.c.detected_issue),
+        user_corrected_issue=case(mapping, value=table.c.user_corrected_issue, else_=table.c.user_corrected_issue),
+    )
+
+
+def _process_base(db: Session, job: MaintenanceJob, base: str, chunk_ids: int, max_duty: float,
+                  deadline: Optional[float]) -> bool:
+    """
+    Rewrite one database range by range; False when the time budget ran out first
+    """
+    statement = _rewrite_statement(job.params["mapping"])
+    session = db if base == PRIMARY else shard_router.session(base)
+    table = DiagnosisRecord.__table__
+    try:
+        cursor = (job.cursors or {}).get(base, 0)
+        while True:
+            # Se relee en cada rango: las filas que llegan durante el trabajo ya traen
+            # los nombres nuevos, pero un worker que aún no recargó la taxonomía no
+            upper = _max_id(session)
+            if cursor >= upper:
+                if (job.upper_ids or {}).get(base) != upper:
+                    _save_progress(db, job, upper_ids={**(job.upper_ids or {}), base: upper})
+                    db.commit()
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+            started = time.perf_counter()
+            high = min(cursor + chunk_ids, upper)
+            updated = session.execute(statement.where(table.c.id > cursor, table.c.id <= high)).rowcount
+            if session is not db:
+                session.commit()
+            # En la principal el UPDATE y el cursor se confirman juntos
+            _save_progress(
+                db, job,
+                cursors={**(job.cursors or {}), base: high},
+                upper_ids={**(job.upper_ids or {}), base: upper},
+                rows_updated=(job.rows_updated or 0) + updated,
+            )
+            db.commit()
+            cursor = high
+
+            maintenance_rows_updated_total.inc(updated, kind=KIND)
+            maintenance_job_progress.set(progress(job), kind=KIND)
+            elapsed = time.perf_counter() - started
+            time.sleep(elapsed * (1 / max_duty - 1))
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if session is not db:
+            session.close()
+
+
+def run_job(
+    db: Session,
+    job_id: Optional[int] = None,
+    time_budget: Optional[float] = None,
+    chunk_ids: Optional[int] = None,
+    max_duty: Optional[float] = None,
+    stale_seconds: Optional[float] = None,
+) -> Optional[MaintenanceJob]:
+    """
+    Claim a re-categorization job and advance it, at most ``time_budget`` seconds
+
+    Returns:
+        The job (status "complete" or still "running"), or None if there was nothing to claim
+    """
+    chunk_ids = chunk_ids or settings.RECATEGORIZE_CHUNK_IDS
+    max_duty = min(max(max_duty or settings.RECATEGORIZE_MAX_DUTY, 0.01), 1.0)
+    job = _claim(db, job_id, stale_seconds or settings.RECATEGORIZE_STALE_SECONDS)
+    if job is None:
+        return None
+    deadline = time.monotonic() + time_budget if time_budget else None
+
+    try:
+        for base in _bases():
+            if not _process_base(db, job, base, chunk_ids, max_duty, deadline):
+                _save_progress(db, job, owner=None)
+                db.commit()
+                logger.info("Re-categorization job %d paused at %.1f%%", job.id, progress(job) * 100)
+                return job
+
+        folded = crud.merge_sketch_issues(db, job.params["mapping"]) if job.params["mapping"] else 0
+        _save_progress(db, job, status="complete", owner=None, finished_at=datetime.utcnow())
+        db.commit()
+    except JobOwnershipLost:
+        logger.warning("Re-categorization job %d stopped: no longer owned by %s", job.id, OWNER)
+        return job
+    except Exception as e:
+        db.rollback()
+        # El trabajo queda "running" sin dueño para que se reintente
+        db.execute(
+            update(MaintenanceJob)
+            .where(MaintenanceJob.id == job.id, MaintenanceJob.owner == OWNER)
+            .values(owner=None, error=str(e)[:500])
+        )
+        db.commit()
+        raise
+
+    maintenance_job_progress.set(1.0, kind=KIND)
+    logger.info(
+        "Re-categorization job %d complete: %d rows rewritten, %d sketch rows folded",
+        job.id, job.rows_updated, folded
+    )
+    event_bus.publish(INGEST_CHANNEL, {"resync": True})
+    return job
+
+
+def set_status(db: Session, job_id: int, status: str) -> bool:
+    """
+    Pause ("paused") or resume ("pending") a job; a running loop stops after its current range
+    """
+    allowed = {"paused": ACTIVE, "pending": ("paused",)}[status]
+    changed = db.execute(
+        update(MaintenanceJob)
+        .where(MaintenanceJob.id == job_id, MaintenanceJob.status.in_(allowed))
+        .values(status=status, owner=None)
+    ).rowcount
+    db.commit()
+    return bool(changed)
+
+
+# ==================== SCHEDULER ====================
+
+_seen_state: Optional[tuple] = None
+
+
+def _taxonomy_state(db: Session) -> tuple:
+    return (
+        db.query(func.count(IssueTaxonomy.issue), func.max(IssueTaxonomy.updated_at)).one(),
+        db.query(func.max(MaintenanceJob.finished_at)).scalar(),
+    )
+
+
+def sync_local_state(db: Session) -> None:
+    """
+    Reload the taxonomy and drop derived state when another process changed it
+
+    Con el bus local (SQLite) los eventos de recategorize_issues.py no llegan
+    a los workers de la app; este chequeo barato en cada turno del scheduler
+    lo cubre.
+    """
+    global _seen_state
+    state = _taxonomy_state(db)
+    if state == _seen_state:
+        return
+    first = _seen_state is None
+    _seen_state = state
+    crud.load_issue_taxonomy(db)
+    if not first:
+        event_bus.publish(INGEST_CHANNEL, {"resync": True})
+
+
+def _on_ingest(payload: dict) -> None:
+    if not payload.get("taxonomy"):
+        return
+    db = SessionLocal()
+    try:
+        crud.load_issue_taxonomy(db)
+    finally:
+        db.close()
+
+
+event_bus.subscribe(INGEST_CHANNEL, _on_ingest)
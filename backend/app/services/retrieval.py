@@ -0,0 +1,194 @@
+"""
+Knowledge-base retrieval over chunk embeddings
+
+Versión en servidor de ``VectorDatabaseService.search`` de la app: los
+embeddings de los chunks (los que genera ``TextChunkerService`` + el
+``EmbeddingService`` del dispositivo) se guardan en una matriz float32 mapeada
+en memoria con filas ya normalizadas, así que la similitud de coseno contra
+todo el corpus es un solo producto matriz-vector y el top-k sale de
+``argpartition``. Varias consultas se resuelven juntas con un producto
+matriz-matriz.
+
+Estructura de ``KB_INDEX_DIR``:
+- ``embeddings.f32``: matriz (n_chunks, dim) float32, filas de norma 1
+- ``chunks.json``: id, título, contenido, categoría y documento de cada fila
+- ``index.json``: dimensión, número de chunks y fecha de construcción
+
+El índice se construye con ``build_kb_index.py`` y los workers lo recargan
+cuando cambia ``index.json``.
+"""
+
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+EMBEDDINGS_FILE = "embeddings.f32"
+CHUNKS_FILE = "chunks.json"
+META_FILE = "index.json"
+
+_CHUNK_FIELDS = ("id", "title", "content", "category", "originalDocumentId")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scale rows to unit norm (zero rows stay zero, so they score 0 against everything)
+    """
+    matrix = np.array(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def build_index(chunks: List[dict], directory: str) -> dict:
+    """
+    Write a new index from chunks with a ``vector`` field (app export format)
+
+    Se escribe en un directorio temporal y se reemplaza el anterior al final,
+    de modo que los workers nunca leen un índice a medias.
+    """
+    if not chunks:
+        raise ValueError("No chunks to index")
+    dim = len(chunks[0]["vector"])
+    if any(len(chunk["vector"]) != dim for chunk in chunks):
+        raise ValueError("All chunk vectors must have the same dimension")
+
+    target = Path(directory)
+    staging = target.with_name(target.name + ".building")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    matrix = np.memmap(staging / EMBEDDINGS_FILE, dtype=np.float32, mode="w+", shape=(len(chunks), dim))
+    for start in range(0, len(chunks), 4096):
+        batch = chunks[start:start + 4096]
+        matrix[start:start + len(batch)] = normalize_rows([chunk["vector"] for chunk in batch])
+    matrix.flush()
+    del matrix
+
+    (staging / CHUNKS_FILE).write_text(json.dumps(
+        [{field: chunk.get(field) for field in _CHUNK_FIELDS} for chunk in chunks],
+        ensure_ascii=False
+    ))
+    meta = {"dim": dim, "count": len(chunks), "built_at": datetime.utcnow().isoformat()}
+    (staging / META_FILE).write_text(json.dumps(meta))
+
+    previous = target.with_name(target.name + ".previous")
+    shutil.rmtree(previous, ignore_errors=True)
+    if target.exists():
+        os.replace(target, previous)
+    os.replace(staging, target)
+    shutil.rmtree(previous, ignore_errors=True)
+    return meta
+
+
+class VectorIndex:
+    """
+    Read-only view of one built index directory
+    """
+
+    def __init__(self, directory: Path):
+        meta = json.loads((directory / META_FILE).read_text())
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        self.built_at = meta["built_at"]
+        self.matrix = np.memmap(directory / EMBEDDINGS_FILE, dtype=np.float32, mode="r",
+                                shape=(self.count, self.dim))
+        self.chunks = json.loads((directory / CHUNKS_FILE).read_text())
+
+        categories = sorted({chunk.get("category") or "" for chunk in self.chunks})
+        self.categories = categories
+        codes = {category: code for code, category in enumerate(categories)}
+        self.category_codes = np.array([codes[chunk.get("category") or ""] for chunk in self.chunks], dtype=np.int32)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        top_k: int = 3,
+        category: Optional[str] = None,
+        min_similarity: float = 0.0
+    ) -> List[List[dict]]:
+        """
+        Top-k chunks by cosine similarity for each query vector (rows of ``queries``)
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query vectors must have dimension {self.dim}, got {queries.shape[1]}")
+
+        rows = None
+        matrix = self.matrix
+        if category is not None:
+            rows = np.flatnonzero(self.category_codes == self.categories.index(category)) \
+                if category in self.categories else np.empty(0, dtype=np.int64)
+            matrix = matrix[rows]
+
+        n = matrix.shape[0]
+        k = min(top_k, n)
+        if k == 0:
+            return [[] for _ in range(len(queries))]
+
+        # (n_queries, n) similitudes con un solo producto de matrices
+        scores = queries @ matrix.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        results = []
+        for indices, similarities in zip(top, top_scores):
+            hits = []
+            for index, score in zip(indices, similarities):
+                if score < min_similarity:
+                    break
+                chunk = self.chunks[rows[index] if rows is not None else index]
+                hits.append({**chunk, "score": round(float(score), 6)})
+            results.append(hits)
+        return results
+
+
+class KnowledgeBase:
+    """
+    Process-wide index, loaded on first use and reloaded when rebuilt
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._index: Optional[VectorIndex] = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def index(self) -> Optional[VectorIndex]:
+        """
+        Current index, or None when none has been built
+        """
+        try:
+            mtime = (self.directory / META_FILE).stat().st_mtime
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                self._index = VectorIndex(self.directory)
+                self._mtime = mtime
+            return self._index
+
+    def stats(self) -> Dict:
+        index = self.index()
+        if index is None:
+            return {"available": False, "count": 0, "dim": None, "categories": [], "built_at": None}
+        return {
+            "available": True,
+            "count": index.count,
+            "dim": index.dim,
+            "categories": index.categories,
+            "built_at": index.built_at,
+        }
+
+
+knowledge_base = KnowledgeBase(settings.KB_INDEX_DIR)
@@ -0,0 +1,252 @@
+"""
+Compact binary encoding for /sync uploads
+
+Alternativa a ``SyncPayload`` en JSON para planes de datos rurales: un mapa
+MessagePack por columnas (``Content-Type: application/msgpack``) en el que
+los nombres de campo van una sola vez, los problemas detectados y las
+ubicaciones se envían como diccionario + índices, las fechas como deltas en
+milisegundos y la confianza como entero. Ver ``benchmark_sync_encoding.py``.
+
+Formato (versión 1)::
+
+    {
+        "v": 1,
+        "device_id": "ABC-123",              # opcional
+        "cooperative_id": "coop-oax-01",     # opcional; shard de destino
+        "issues": ["Roya del Café", ...],    # diccionario de detected_issue
+        "locations": ["Chiapas", ...],       # diccionario de location (opcional)
+        "timestamp": [1731542400000, 61000, ...],  # ms UTC: el primero absoluto, luego deltas
+        "issue": [0, 0, 3, ...],             # índice en issues
+        "confidence": [8712, 9340, ...],     # confianza x 10000 (0-10000)
+        "feedback": [true, null, ...],       # opcional; user_feedback_correct
+        "location": [0, null, ...],          # opcional; índice en locations, null = sin ubicación
+        "id": [1201, 1, 1, ...]              # opcional; ids de origen (réplica edge), deltas como timestamp
+    }
+
+``decode`` valida las columnas en bloque y devuelve directamente las filas
+listas para el INSERT, sin un modelo Pydantic por fila.
+"""
+
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional
+
+
+MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+FORMAT_VERSION = 1
+CONFIDENCE_SCALE = 10000
+
+_EPOCH = datetime(1970, 1, 1)
+_MAX_MILLIS = (datetime(9999, 12, 31) - _EPOCH) // timedelta(milliseconds=1)
+
+
+class Upload(NamedTuple):
+    rows: List[dict]
+    device_id: Optional[str]
+    cooperative_id: Optional[str]
+    ids: Optional[List[int]] = None  # Ids en la base de origen, estrictamente crecientes
+
+
+# NumPy y msgpack se importan al primer cuerpo MessagePack, no al arrancar el worker
+_msgpack = None
+
+
+def _load_msgpack():
+    """
+    The msgpack module, or False when not installed
+    """
+    global _msgpack
+    if _msgpack is None:
+        try:
+            import msgpack
+            _msgpack = msgpack
+        except ImportError:  # pragma: no cover - msgpack está en requirements.txt
+            _msgpack = False
+    return _msgpack
+
+
+def available() -> bool:
+    return bool(_load_msgpack())
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split(";")[0].strip().lower() in MEDIA_TYPES
+
+
+def decompress(body: bytes, content_encoding: Optional[str], max_bytes: int) -> bytes:
+    """
+    Undo ``Content-Encoding: gzip`` (or deflate) without inflating past ``max_bytes``
+
+    Raises:
+        ValueError: unsupported encoding, corrupt stream or body too large
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        if len(body) > max_bytes:
+            raise ValueError("Body is too large")
+        return body
+    if encoding not in ("gzip", "deflate"):
+        raise ValueError(f"Unsupported Content-Encoding '{encoding}'")
+    inflater = zlib.decompressobj(zlib.MAX_WBITS | (16 if encoding == "gzip" else 0))
+    try:
+        data = inflater.decompress(body, max_bytes + 1)
+    except zlib.error:
+        raise ValueError(f"Body is not valid {encoding}")
+    if len(data) > max_bytes or inflater.unconsumed_tail:
+        raise ValueError("Body is too large")
+    if not inflater.eof:
+        raise ValueError(f"Body is not valid {encoding}")
+    return data
+
+
+def _codes(values, size: int, name: str, nullable: bool) -> "np.ndarray":
+    """
+    Validate dictionary indices; nulls become -1
+    """
+    import numpy as np
+
+    if nullable:
+        values = [-1 if value is None else value for value in values]
+    try:
+        codes = np.asarray(values, dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"'{name}' must contain integer indices")
+    if codes.size and (codes.max() >= size or codes.min() < (-1 if nullable else 0)):
+        raise ValueError(f"'{name}' has indices outside its dictionary")
+    return codes
+
+
+def decode(body: bytes) -> Upload:
+    """
+    Decode an upload into rows ready for insert plus its device and cooperative ids
+
+    Raises:
+        ValueError: malformed or inconsistent payload
+    """
+    import numpy as np
+
+    try:
+        payload = _load_msgpack().unpackb(body, raw=False, strict_map_key=False)
+    except Exception:
+        raise ValueError("Body is not valid MessagePack")
+    if not isinstance(payload, dict):
+        raise ValueError("Payload must be a map")
+    if payload.get("v", FORMAT_VERSION) != FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version {payload.get('v')}")
+
+    issues = payload.get("issues") or []
+    locations = payload.get("locations") or []
+    if not isinstance(issues, list) or not isinstance(locations, list) \
+            or not all(isinstance(value, str) for value in issues + locations):
+        raise ValueError("'issues' and 'locations' must be lists of strings")
+
+    try:
+        timestamps = np.cumsum(np.asarray(payload.get("timestamp") or [], dtype=np.int64))
+        confidence = np.asarray(payload.get("confidence") or [], dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("'timestamp' and 'confidence' must contain integers")
+    n = len(timestamps)
+
+    issue_codes = _codes(payload.get("issue") or [], len(issues), "issue", nullable=False)
+    feedback = payload.get("feedback")
+    feedback = [None] * n if feedback is None else feedback
+    location = payload.get("location")
+    location_codes = np.full(n, -1, dtype=np.int64) if location is None \
+        else _codes(location, len(locations), "location", nullable=True)
+
+    ids = payload.get("id")
+    if ids is not None:
+        try:
+            ids = np.cumsum(np.asarray(ids, dtype=np.int64))
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("'id' must contain integers")
+        if len(ids) != n:
+            raise ValueError("All columns must have the same length")
+        if n and (ids[0] <= 0 or (n > 1 and np.diff(ids).min() <= 0)):
+            raise ValueError("'id' must be positive and strictly increasing")
+
+    if not (len(confidence) == len(issue_codes) == len(feedback) == len(location_codes) == n):
+        raise ValueError("All columns must have the same length")
+    if n and (timestamps.min() < 0 or timestamps.max() > _MAX_MILLIS):
+        raise ValueError("'timestamp' is out of range")
+    if n and (confidence.min() < 0 or confidence.max() > CONFIDENCE_SCALE):
+        raise ValueError(f"'confidence' must be between 0 and {CONFIDENCE_SCALE}")
+    if not all(value is None or isinstance(value, bool) for value in feedback):
+        raise ValueError("'feedback' must contain true, false or null")
+
+    # Conversión por columna; las filas solo se arman al final
+    location_values = [None] + locations  # índice -1 -> None
+    rows = [
+        {
+            "user_id": None,  # Anonymous for privacy
+            "timestamp": timestamp,
+            "detected_issue": issues[issue],
+            "confidence": value,
+            "user_feedback_correct": correct,
+            "location": location_values[code + 1],
+        }
+        for timestamp, issue, value, correct, code in zip(
+            timestamps.astype("datetime64[ms]").tolist(),
+            issue_codes.tolist(),
+            (confidence / CONFIDENCE_SCALE).tolist(),
+            feedback,
+            location_codes.tolist(),
+        )
+    ]
+    device_id = payload.get("device_id")
+    cooperative_id = payload.get("cooperative_id")
+    return Upload(
+        rows,
+        device_id if isinstance(device_id, str) else None,
+        cooperative_id if isinstance(cooperative_id, str) else None,
+        None if ids is None else ids.tolist(),
+    )
+
+
+def encode(
+    rows: Iterable[dict],
+    device_id: Optional[str] = None,
+    cooperative_id: Optional[str] = None,
+    with_ids: bool = False,
+) -> bytes:
+    """
+    Encode diagnosis dicts (timestamp, detected_issue, confidence, ...) in the upload format
+
+    Con ``with_ids`` se envía también el ``id`` de cada fila (réplica edge).
+    """
+    issues, locations = {}, {}
+    timestamps, issue_codes, confidence, feedback, location_codes, ids = [], [], [], [], [], []
+    previous = previous_id = 0
+    for row in rows:
+        if with_ids:
+            ids.append(row["id"] - previous_id)
+            previous_id = row["id"]
+        timestamp = row["timestamp"]
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.replace(tzinfo=None) - timestamp.utcoffset()
+        millis = (timestamp - _EPOCH) // timedelta(milliseconds=1)
+        timestamps.append(millis - previous)
+        previous = millis
+        issue_codes.append(issues.setdefault(row["detected_issue"], len(issues)))
+        confidence.append(round(row["confidence"] * CONFIDENCE_SCALE))
+        feedback.append(row.get("user_feedback_correct"))
+        location = row.get("location")
+        location_codes.append(None if location is None else locations.setdefault(location, len(locations)))
+
+    payload = {
+        "v": FORMAT_VERSION,
+        "issues": list(issues),
+        "locations": list(locations),
+        "timestamp": timestamps,
+        "issue": issue_codes,
+        "confidence": confidence,
+        "feedback": feedback,
+        "location": location_codes,
+    }
+    if with_ids:
+        payload["id"] = ids
+    if device_id:
+        payload["device_id"] = device_id
+    if cooperative_id:
+        payload["cooperative_id"] = cooperative_id
+    return _load_msgpack().packb(payload, use_bin_type=True)
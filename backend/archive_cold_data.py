@@ -0,0 +1,61 @@
+"""
+Archiva meses cerrados de diagnosis_records a Parquet y los borra de la tabla caliente
+
+Cada mes más antiguo que ARCHIVE_HOT_MONTHS se escribe en
+ARCHIVE_DIR/diagnoses-YYYY-MM.<versión>.parquet (zstd) y se registra en manifest.json;
+después se borra de la tabla en lotes. Es seguro volver a correrlo: retoma los
+borrados a medias y agrega a cada mes los diagnósticos que llegaron tarde.
+
+Uso:
+    python archive_cold_data.py --dry-run
+    python archive_cold_data.py --hot-months 6 --batch-size 10000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.models import models  # noqa: F401  (registra las tablas)
+from app.services import archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo de datos fríos en Parquet")
+    parser.add_argument("--hot-months", type=int, default=settings.ARCHIVE_HOT_MONTHS,
+                        help=f"Meses cerrados que se quedan en la tabla (default: {settings.ARCHIVE_HOT_MONTHS})")
+    parser.add_argument("--batch-size", type=int, default=settings.ARCHIVE_DELETE_BATCH_SIZE,
+                        help="Filas por lote de lectura y de borrado")
+    parser.add_argument("--dry-run", action="store_true", help="Solo listar los meses a archivar")
+    args = parser.parse_args()
+
+    if not archive.available():
+        sys.exit("❌ pyarrow no está instalado (pip install pyarrow)")
+
+    boundary = archive.archive_boundary(args.hot_months)
+    print(f"🧊 Archivando meses anteriores a {boundary:%Y-%m} en {settings.ARCHIVE_DIR}/")
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        results = archive.archive_closed_months(
+            db, hot_months=args.hot_months, batch_size=args.batch_size, dry_run=args.dry_run
+        )
+    except archive.ArchiveError as e:
+        sys.exit(f"❌ {e}")
+    finally:
+        db.close()
+
+    for result in results:
+        deleted = f", {result['deleted']:,} borradas" if "deleted" in result else ""
+        print(f"   • {result['month']}: {result['rows']:,} filas ({result['status']}{deleted})")
+    if not results:
+        print("   (nada que archivar)")
+    print(f"✅ Listo en {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Benchmark de carga y latencia para la API de Kaapeh Copiloto
+
+Ejecuta una mezcla configurable de tráfico (/sync, /auth/login, /metrics y
+/analytics/*) contra la app ASGI en el mismo proceso (por defecto, con una base
+SQLite temporal) o contra un servidor en vivo, y reporta throughput y latencias
+p50/p95/p99 por endpoint. Los resultados se guardan en JSON para compararlos
+entre commits y detectar regresiones.
+
+Uso:
+    python benchmark_api.py --requests 2000 --concurrency 16 --output bench.json
+    python benchmark_api.py --url http://localhost:8000 --duration 30
+    python benchmark_api.py --compare bench_main.json --output bench_branch.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Las 15 clases del modelo (formateadas en español como las envía la app)
+CLASES_MODELO = [
+    "Deficiencia de Nitrógeno (N)",
+    "Deficiencia de Fósforo (P)",
+    "Deficiencia de Potasio (K)",
+    "Deficiencia de Calcio (Ca)",
+    "Deficiencia de Magnesio (Mg)",
+    "Deficiencia de Hierro (Fe)",
+    "Deficiencia de Manganeso (Mn)",
+    "Deficiencia de Boro (B)",
+    "Múltiples Deficiencias Nutricionales",
+    "Roya del Café",
+    "Mancha de Phoma",
+    "Ojo de Gallo (Cercospora)",
+    "Minador de la Hoja",
+    "Araña Roja",
+    "Planta Saludable",
+]
+
+LOCATIONS = ["Chiapas, México", "Oaxaca, México", "Veracruz, México", "Huehuetenango, Guatemala"]
+
+API_V1 = "/api/v1"
+
+# Endpoint lógico -> (método, ruta)
+ENDPOINTS = {
+    "sync": ("POST", f"{API_V1}/sync"),
+    "login": ("POST", f"{API_V1}/auth/login"),
+    "metrics": ("GET", f"{API_V1}/metrics"),
+    "categories": ("GET", f"{API_V1}/categories"),
+    "frequent_issues": ("GET", f"{API_V1}/analytics/frequent-issues?days=30"),
+    "heatmap": ("GET", f"{API_V1}/analytics/heatmap"),
+    "trends": ("GET", f"{API_V1}/analytics/trends?days=90&interval=day"),
+    "feedback_analysis": ("GET", f"{API_V1}/analytics/feedback-analysis"),
+    "active_users": ("GET", f"{API_V1}/analytics/active-users"),
+}
+
+DEFAULT_MIX = "sync=4,login=2,metrics=2,frequent_issues=1,heatmap=1,trends=1,feedback_analysis=1"
+
+
+def parse_mix(mix: str) -> dict:
+    """
+    Parse "sync=4,metrics=2" into {"sync": 4.0, "metrics": 2.0}
+    """
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"❌ Endpoint desconocido en --mix: {name} (opciones: {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def build_sync_payload(rng: random.Random, batch_size: int) -> dict:
+    now = datetime.utcnow()
+    return {
+        "diagnoses": [
+            {
+                "timestamp": (now - timedelta(minutes=rng.randint(0, 60 * 24 * 90))).isoformat(),
+                "detected_issue": rng.choice(CLASES_MODELO),
+                "confidence": round(rng.uniform(0.5, 0.99), 3),
+                "user_feedback_correct": rng.choice([True, False, None]),
+                "location": rng.choice(LOCATIONS),
+            }
+            for _ in range(batch_size)
+        ]
+    }
+
+
+def make_client(args):
+    """
+    Create an httpx client against the in-process app or a live URL
+    """
+    import httpx
+
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=60)
+
+    from app.db.database import init_db
+    from app.models import models  # noqa: F401  (registra las tablas)
+    from app.main import app as asgi_app
+
+    init_db()
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url="http://benchmark", timeout=60)
+
+
+async def technician_token(client, rng: random.Random) -> str:
+    response = await client.post(f"{API_V1}/auth/register", json={
+        "username": f"bench-tecnico-{rng.randint(0, 10**9)}@benchmark",
+        "role": "Técnico",
+    })
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+async def run_benchmark(args) -> dict:
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    names = list(weights)
+    weight_values = [weights[n] for n in names]
+
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+
+    async with make_client(args) as client:
+        token = await technician_token(client, rng)
+        auth_headers = {"Authorization": f"Bearer {token}"}
+
+        # Datos iniciales para que las consultas analíticas no trabajen en vacío
+        for _ in range(args.warmup_batches):
+            await client.post(ENDPOINTS["sync"][1], json=build_sync_payload(rng, args.sync_batch))
+
+        remaining = {"requests": args.requests}
+        deadline = time.perf_counter() + args.duration if args.duration else None
+
+        def next_endpoint():
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return None
+            else:
+                if remaining["requests"] <= 0:
+                    return None
+                remaining["requests"] -= 1
+            return rng.choices(names, weights=weight_values)[0]
+
+        async def worker(worker_id: int):
+            worker_rng = random.Random(f"{args.seed}-{worker_id}")
+            while True:
+                name = next_endpoint()
+                if name is None:
+                    return
+                method, path = ENDPOINTS[name]
+                kwargs = {}
+                if name == "sync":
+                    kwargs["json"] = build_sync_payload(worker_rng, args.sync_batch)
+                elif name == "login":
+                    kwargs["json"] = {"username": f"productor{worker_rng.randint(0, args.users)}@device-bench"}
+                else:
+                    kwargs["headers"] = auth_headers
+
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, **kwargs)
+                    ok = response.status_code < 400
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - start
+
+                if ok:
+                    samples[name].append(elapsed)
+                else:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+        wall_time = time.perf_counter() - started
+
+    endpoints = {}
+    for name in names:
+        values = sorted(samples[name])
+        endpoints[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "throughput_rps": round(len(values) / wall_time, 2) if wall_time else 0.0,
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "target": args.url or "in-process",
+            "mix": weights,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "sync_batch": args.sync_batch,
+        },
+        "total": {
+            "requests": total,
+            "errors": sum(errors.values()),
+            "wall_time_s": round(wall_time, 3),
+            "throughput_rps": round(total / wall_time, 2) if wall_time else 0.0,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float) -> list:
+    """
+    Return the endpoints whose p95 latency regressed beyond the tolerance
+    """
+    regressions = []
+    for name, stats in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or not base["p95_ms"] or not stats["requests"]:
+            continue
+        ratio = stats["p95_ms"] / base["p95_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append({
+                "endpoint": name,
+                "baseline_p95_ms": base["p95_ms"],
+                "current_p95_ms": stats["p95_ms"],
+                "ratio": round(ratio, 3),
+            })
+    return regressions
+
+
+def print_report(results: dict) -> None:
+    print("\n" + "=" * 78)
+    print(f"BENCHMARK - {results['meta']['target']} @ {results['meta']['commit']}")
+    print("=" * 78)
+    print(f"{'endpoint':<20}{'reqs':>7}{'err':>6}{'rps':>10}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for name, s in results["endpoints"].items():
+        print(f"{name:<20}{s['requests']:>7}{s['errors']:>6}{s['throughput_rps']:>10}"
+              f"{s['p50_ms']:>11}{s['p95_ms']:>11}{s['p99_ms']:>11}")
+    total = results["total"]
+    print("-" * 78)
+    print(f"Total: {total['requests']} requests, {total['errors']} errores, "
+          f"{total['throughput_rps']} req/s en {total['wall_time_s']} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latencia de la API")
+    parser.add_argument("--url", help="URL de un servidor en vivo (por defecto: app en el mismo proceso)")
+    parser.add_argument("--database-url", help="DATABASE_URL para el modo en proceso (por defecto: SQLite temporal)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos por endpoint (default: {DEFAULT_MIX})")
+    parser.add_argument("--requests", type=int, default=1000, help="Número total de requests")
+    parser.add_argument("--duration", type=float, help="Duración en segundos (sustituye a --requests)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sync-batch", type=int, default=20, help="Diagnósticos por request de /sync")
+    parser.add_argument("--warmup-batches", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200, help="Usuarios distintos para /auth/login")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Archivo JSON de resultados")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Aumento de p95 tolerado (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    if not args.url:
+        database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='kaapeh-bench-')}/bench.db"
+        os.environ["DATABASE_URL"] = database_url
+
+    results = asyncio.run(run_benchmark(args))
+    print_report(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+        print(f"\n💾 Resultados guardados en {args.output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\n⚠️  Regresiones de p95 frente a {args.compare}:")
+            for r in regressions:
+                print(f"   • {r['endpoint']}: {r['baseline_p95_ms']} ms → {r['current_p95_ms']} ms (x{r['ratio']})")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones de p95 frente a {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
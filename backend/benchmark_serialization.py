@@ -0,0 +1,211 @@
+"""
+Benchmark de serialización JSON para respuestas grandes
+
+Compara, para cuerpos del tamaño de las respuestas más pesadas de la API,
+cuánto CPU cuesta cada forma de producir los bytes de la respuesta:
+
+- ``stdlib``: lo que hace FastAPI por defecto (``jsonable_encoder`` +
+  ``json.dumps`` de JSONResponse)
+- ``stdlib+model``: además valida contra el ``response_model`` (solo
+  /sync/changes y /metrics/history, que lo tienen)
+- ``orjson``: ``FastJSONResponse`` retornada directamente por el endpoint
+- ``cached``: ``CachedJSONResponse`` con los bytes ya serializados
+
+No necesita base de datos: los cuerpos son sintéticos con la misma forma que
+los reales.
+
+Uso:
+    python benchmark_serialization.py
+    python benchmark_serialization.py --repeat 50 --locations 2000 --output serialization.json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.core import responses
+from app.crud import crud
+from app.schemas.schemas import MetricsHistoryResponse, SyncChangesResponse
+
+
+def build_trends(rng: random.Random, days: int) -> dict:
+    """
+    /analytics/trends?days=<days>&interval=day
+    """
+    start = datetime.utcnow() - timedelta(days=days)
+    data_points = []
+    for offset in range(days):
+        row = [rng.randint(0, 400) for _ in crud.CATEGORIES]
+        data_points.append({
+            "date": (start + timedelta(days=offset)).strftime("%Y-%m-%d"),
+            "total_diagnoses": sum(row),
+            "by_category": dict(zip(crud.CATEGORIES, row)),
+        })
+    return {
+        "period": f"last_{days}_days",
+        "interval": "day",
+        "total_data_points": len(data_points),
+        "data_points": data_points,
+    }
+
+
+def build_heatmap(rng: random.Random, locations: int) -> dict:
+    """
+    /analytics/heatmap
+    """
+    issues = list(crud.ISSUE_CATEGORIES)
+    return {
+        "total_locations": locations,
+        "locations": [
+            {
+                "location": f"Finca {index}, Chiapas, México",
+                "diagnoses_count": rng.randint(1, 5000),
+                "most_common_issue": rng.choice(issues),
+                "avg_confidence": round(rng.uniform(0.5, 0.99), 3),
+            }
+            for index in range(locations)
+        ],
+    }
+
+
+def build_sync_changes(rng: random.Random, rows: int) -> dict:
+    """
+    /sync/changes con un lote lleno de action items
+    """
+    now = datetime.utcnow()
+    return {
+        "cursor": rows,
+        "has_more": True,
+        "changes": {
+            "action_item": {
+                "columns": ["id", "diagnosis_id", "description_text", "is_completed", "created_at"],
+                "rows": [
+                    [index, rng.randint(1, 10**6), "Aplicar fungicida cúprico", rng.random() < 0.5,
+                     now - timedelta(minutes=index)]
+                    for index in range(rows)
+                ],
+                "deleted": [],
+            }
+        },
+    }
+
+
+def build_history(rng: random.Random, points: int) -> dict:
+    """
+    /metrics/history?limit=<points>&include_distribution=true
+    """
+    now = datetime.utcnow()
+    snapshots = [
+        {
+            "timestamp": now - timedelta(minutes=15 * index),
+            "tpp": round(rng.uniform(60, 95), 2),
+            "cpm": round(rng.uniform(70, 95), 2),
+            "nas": round(rng.uniform(10, 60), 2),
+            "total_diagnoses": rng.randint(10**4, 10**6),
+            "issue_distribution": {category: rng.randint(0, 10**5) for category in crud.CATEGORIES},
+        }
+        for index in range(points)
+    ]
+    return {"snapshots": snapshots, "count": len(snapshots)}
+
+
+def render_stdlib(content, model=None) -> bytes:
+    if model is not None:
+        content = model.model_validate(content)
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def render_orjson(content) -> bytes:
+    return responses.FastJSONResponse(content).body
+
+
+def time_call(func, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    payloads = {
+        "trends": (build_trends(rng, args.days), None),
+        "heatmap": (build_heatmap(rng, args.locations), None),
+        "sync_changes": (build_sync_changes(rng, args.rows), SyncChangesResponse),
+        "metrics_history": (build_history(rng, args.rows), MetricsHistoryResponse),
+    }
+
+    results = {}
+    for name, (content, model) in payloads.items():
+        body = render_orjson(content)
+        variants = {
+            "stdlib": lambda: render_stdlib(content),
+            "orjson": lambda: render_orjson(content),
+            "cached": lambda: responses.CachedJSONResponse(body).body,
+        }
+        if model is not None:
+            variants["stdlib+model"] = lambda: render_stdlib(content, model)
+
+        # Los dos caminos deben producir el mismo JSON
+        if json.loads(render_stdlib(content)) != json.loads(body):
+            raise SystemExit(f"❌ {name}: orjson y stdlib producen JSON distinto")
+
+        results[name] = {"bytes": len(body), "variants": {}}
+        for variant, func in variants.items():
+            func()  # warmup
+            timings = time_call(func, args.repeat)
+            results[name]["variants"][variant] = {
+                "median_ms": round(statistics.median(timings), 3),
+                "min_ms": round(min(timings), 3),
+            }
+    return results
+
+
+def print_report(results: dict) -> None:
+    print("\n" + "=" * 72)
+    print("SERIALIZACIÓN JSON (mediana por respuesta)")
+    print("=" * 72)
+    print(f"{'respuesta':<18}{'KB':>8}{'variante':>16}{'ms':>10}{'vs stdlib':>12}")
+    for name, result in results.items():
+        baseline = result["variants"]["stdlib"]["median_ms"]
+        for variant, stats in result["variants"].items():
+            speedup = f"x{baseline / stats['median_ms']:.1f}" if stats["median_ms"] else "-"
+            print(f"{name:<18}{result['bytes'] / 1024:>8.0f}{variant:>16}{stats['median_ms']:>10}{speedup:>12}")
+        print("-" * 72)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de serialización de respuestas grandes")
+    parser.add_argument("--days", type=int, default=365, help="Puntos diarios de /analytics/trends")
+    parser.add_argument("--locations", type=int, default=1000, help="Ubicaciones de /analytics/heatmap")
+    parser.add_argument("--rows", type=int, default=5000, help="Filas de /sync/changes y /metrics/history")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    if responses.orjson is None:
+        print("⚠️  orjson no está instalado: 'orjson' usa el fallback de la stdlib")
+
+    results = run(args)
+    print_report(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+        print(f"\n💾 Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
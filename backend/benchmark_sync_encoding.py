@@ -0,0 +1,143 @@
+"""
+Benchmark del formato de subida de /sync: JSON vs MessagePack columnar
+
+Para lotes sintéticos con la misma forma que los que sube la app, reporta:
+- bytes en el cable (sin comprimir y con gzip, como los enviaría un proxy)
+- CPU de decodificación en el servidor hasta tener las filas listas para el
+  INSERT: ``SyncPayload.model_validate_json`` + dicts por fila frente a
+  ``sync_codec.decode``
+
+Uso:
+    python benchmark_sync_encoding.py
+    python benchmark_sync_encoding.py --batch-sizes 20,200,2000 --repeat 50 --output sync_encoding.json
+"""
+
+import argparse
+import gzip
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from app.crud import crud
+from app.schemas.schemas import SyncPayload
+from app.services import sync_codec
+
+LOCATIONS = ["Tapachula, Chiapas", "Pluma Hidalgo, Oaxaca", "Coatepec, Veracruz", "Huehuetenango, Guatemala"]
+
+
+def build_rows(rng: random.Random, size: int) -> list:
+    """
+    Diagnósticos de un dispositivo, ordenados en el tiempo como los guarda la app
+    """
+    start = datetime.utcnow() - timedelta(days=7)
+    return [
+        {
+            "timestamp": start + timedelta(seconds=index * rng.randint(30, 900)),
+            "detected_issue": rng.choice(list(crud.ISSUE_CATEGORIES)),
+            "confidence": round(rng.uniform(0.5, 0.99), 4),
+            "user_feedback_correct": rng.choice([True, False, None]),
+            "location": rng.choice(LOCATIONS + [None]),
+        }
+        for index in range(size)
+    ]
+
+
+def encode_json(rows: list, device_id: str) -> bytes:
+    return json.dumps({
+        "diagnoses": [{**row, "timestamp": row["timestamp"].isoformat()} for row in rows],
+        "device_id": device_id,
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def decode_json(body: bytes) -> list:
+    """
+    Lo que hace /sync con un cuerpo JSON
+    """
+    payload = SyncPayload.model_validate_json(body)
+    return [
+        {
+            "user_id": None,
+            "timestamp": d.timestamp,
+            "detected_issue": d.detected_issue,
+            "confidence": d.confidence,
+            "user_feedback_correct": d.user_feedback_correct,
+            "location": d.location,
+        }
+        for d in payload.diagnoses
+    ]
+
+
+def median_ms(func, repeat: int) -> float:
+    func()  # warmup
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    results = {}
+    for size in [int(value) for value in args.batch_sizes.split(",")]:
+        rows = build_rows(rng, size)
+        json_body = encode_json(rows, "benchmark-device")
+        msgpack_body = sync_codec.encode(rows, "benchmark-device")
+
+        decoded = sync_codec.decode(msgpack_body).rows
+        if len(decoded) != size or any(a["detected_issue"] != b["detected_issue"] for a, b in zip(decoded, rows)):
+            raise SystemExit(f"❌ El lote de {size} filas no sobrevive encode/decode")
+
+        results[str(size)] = {
+            "json_bytes": len(json_body),
+            "json_gzip_bytes": len(gzip.compress(json_body)),
+            "msgpack_bytes": len(msgpack_body),
+            "msgpack_gzip_bytes": len(gzip.compress(msgpack_body)),
+            "json_decode_ms": median_ms(lambda: decode_json(json_body), args.repeat),
+            "msgpack_decode_ms": median_ms(lambda: sync_codec.decode(msgpack_body), args.repeat),
+        }
+    return results
+
+
+def print_report(results: dict) -> None:
+    print("\n" + "=" * 86)
+    print("FORMATO DE /sync: JSON vs MessagePack columnar")
+    print("=" * 86)
+    print(f"{'filas':>7}{'JSON B':>10}{'JSON gz':>10}{'msgpack B':>11}{'mp gz':>9}{'ahorro':>9}"
+          f"{'JSON ms':>10}{'mp ms':>9}{'CPU':>9}")
+    for size, r in results.items():
+        saving = 1 - r["msgpack_bytes"] / r["json_bytes"]
+        speedup = r["json_decode_ms"] / r["msgpack_decode_ms"] if r["msgpack_decode_ms"] else 0
+        print(f"{size:>7}{r['json_bytes']:>10}{r['json_gzip_bytes']:>10}{r['msgpack_bytes']:>11}"
+              f"{r['msgpack_gzip_bytes']:>9}{saving:>8.0%}{r['json_decode_ms']:>10}{r['msgpack_decode_ms']:>9}"
+              f"{speedup:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del formato binario de /sync")
+    parser.add_argument("--batch-sizes", default="20,200,2000", help="Tamaños de lote separados por comas")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    if not sync_codec.available():
+        raise SystemExit("❌ msgpack no está instalado (pip install -r requirements.txt)")
+
+    results = run(args)
+    print_report(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"\n💾 Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Construye el índice de búsqueda de la base de conocimiento (KB_INDEX_DIR)
+
+Lee los chunks con embeddings en el formato que persiste la app
+(``VectorDB/vector_chunks.json``: id, title, content, category, vector,
+originalDocumentId, createdAt) y escribe la matriz normalizada que sirve
+/api/v1/kb/search. Los workers cargan el índice nuevo en la siguiente búsqueda.
+
+Uso:
+    python build_kb_index.py --input vector_chunks.json
+    python build_kb_index.py --input vector_chunks.json --output /srv/kaapeh/kb_index
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from app.core.config import settings
+from app.services.retrieval import build_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de embeddings de la base de conocimiento")
+    parser.add_argument("--input", required=True, help="JSON exportado por la app (vector_chunks.json)")
+    parser.add_argument("--output", default=settings.KB_INDEX_DIR,
+                        help=f"Directorio del índice (default: {settings.KB_INDEX_DIR})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    chunks = json.loads(Path(args.input).read_text())
+    print(f"📚 {len(chunks):,} chunks leídos de {args.input}")
+
+    try:
+        meta = build_index(chunks, args.output)
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+
+    size_mb = meta["count"] * meta["dim"] * 4 / 1_048_576
+    print(f"✅ Índice escrito en {args.output}: {meta['count']:,} x {meta['dim']} float32 "
+          f"({size_mb:.1f} MB) en {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
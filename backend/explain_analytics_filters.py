@@ -0,0 +1,192 @@
+"""
+Verifica con EXPLAIN que los filtros de /analytics usan índices
+
+Para cada filtro (rango de fechas, categoría, lista de problemas, prefijo de
+ubicación, rango de confianza y todos juntos) llama a los endpoints de
+/analytics que leen diagnosis_records contra la base de DATABASE_URL, con el
+almacén columnar desactivado, captura las consultas que llegan a la base y
+corre EXPLAIN sobre cada una. Falla si alguna recorre diagnosis_records
+completa (``SCAN`` en SQLite, ``Seq Scan`` en PostgreSQL) en lugar de usar un
+índice o descartar particiones.
+
+/unique-devices y /confidence-percentiles leen diagnosis_sketches y no se
+verifican aquí. En PostgreSQL conviene correr ANALYZE antes: con estadísticas
+vacías o tablas chicas el planificador prefiere un Seq Scan.
+
+Uso:
+    python explain_analytics_filters.py
+    python explain_analytics_filters.py --location-prefix Tapachula --verbose --output explain.json
+"""
+
+import argparse
+import json
+import re
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from fastapi import Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.models.models import DiagnosisRecord
+from app.api.v1.endpoints import analytics
+from app.services.analytics_filters import AnalyticsFilters
+
+TABLE = DiagnosisRecord.__tablename__
+_SQLITE_ACCESS = re.compile(rf"^(SCAN|SEARCH)( TABLE)? {TABLE}\b(.*)$")
+
+ENDPOINTS = {
+    "frequent-issues": lambda db, f: analytics.get_frequent_issues(limit=10, days=None, filters=f, db=db, current_user=None),
+    "heatmap": lambda db, f: analytics.get_location_heatmap(filters=f, db=db, current_user=None),
+    "trends": lambda db, f: analytics.get_temporal_trends(days=365, interval="day", filters=f, db=db, current_user=None),
+    "feedback-analysis": lambda db, f: analytics.get_feedback_analysis(filters=f, db=db, current_user=None),
+    "active-users": lambda db, f: analytics.get_active_users(limit=20, filters=f, db=db, current_user=None),
+    "calibration": lambda db, f: analytics.get_model_calibration(
+        response=Response(), bins=10, min_count=1, filters=f, db=db, current_user=None
+    ),
+}
+
+
+def build_scenarios(args) -> dict:
+    now = datetime.utcnow()
+    since, until = now - timedelta(days=args.days), now - timedelta(days=args.days // 4)
+    return {
+        "date_range": AnalyticsFilters(since=since, until=until),
+        "category": AnalyticsFilters(category=args.category),
+        "issues": AnalyticsFilters(issues=args.issues.split(",")),
+        "location_prefix": AnalyticsFilters(location_prefix=args.location_prefix),
+        "confidence_range": AnalyticsFilters(min_confidence=args.min_confidence, max_confidence=1.0),
+        "combined": AnalyticsFilters(
+            since=since, until=until, category=args.category, location_prefix=args.location_prefix,
+            min_confidence=args.min_confidence, max_confidence=1.0,
+        ),
+    }
+
+
+def capture_queries(call) -> list:
+    """
+    Run ``call()`` and return the (engine, statement, parameters) that touch diagnosis_records
+    """
+    captured = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if TABLE in statement and statement.lstrip().upper().startswith("SELECT"):
+            captured.append((conn.engine, statement, parameters))
+
+    event.listen(Engine, "before_cursor_execute", before_execute)
+    try:
+        call()
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_execute)
+    return captured
+
+
+def explain(engine, statement: str, parameters) -> dict:
+    """
+    {"ok": bool, "access": [...], "plan": [...]} for one statement
+    """
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plan = [row[-1] for row in rows]
+            access = [line for line in plan if _SQLITE_ACCESS.match(line)]
+            ok = all(line.startswith("SEARCH") for line in access)
+        else:
+            document = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+            if isinstance(document, str):
+                document = json.loads(document)
+            plan, access = [], []
+            _walk_pg(document[0]["Plan"], plan, access)
+            ok = not any(node.startswith("Seq Scan") for node in access)
+    return {"ok": ok, "access": access, "plan": plan}
+
+
+def _walk_pg(node: dict, plan: list, access: list, depth: int = 0) -> None:
+    relation = node.get("Relation Name", "")
+    line = node["Node Type"] + (f" on {relation}" if relation else "")
+    if node.get("Index Name"):
+        line += f" using {node['Index Name']}"
+    if node.get("Subplans Removed"):
+        line += f" ({node['Subplans Removed']} particiones descartadas)"
+    plan.append("  " * depth + line)
+    if relation == TABLE or relation.startswith(f"{TABLE}_"):
+        access.append(line)
+    for child in node.get("Plans", []):
+        _walk_pg(child, plan, access, depth + 1)
+
+
+def run(args) -> dict:
+    settings.COLUMNAR_STORE_ENABLED = False  # Forzar el camino SQL
+    results = {}
+    db = SessionLocal()
+    try:
+        for scenario, filters in build_scenarios(args).items():
+            results[scenario] = {}
+            for endpoint, call in ENDPOINTS.items():
+                queries = capture_queries(lambda: call(db, filters))
+                explained, seen = [], set()
+                for engine, statement, parameters in queries:
+                    if statement in seen:
+                        continue
+                    seen.add(statement)
+                    explained.append({"sql": statement, **explain(engine, statement, parameters)})
+                results[scenario][endpoint] = explained
+    finally:
+        db.close()
+    return results
+
+
+def print_report(results: dict, verbose: bool) -> int:
+    failures = 0
+    print("\n" + "=" * 78)
+    print(f"EXPLAIN DE LOS FILTROS DE /analytics SOBRE {TABLE}")
+    print("=" * 78)
+    for scenario, endpoints in results.items():
+        print(f"\n🔎 {scenario}")
+        for endpoint, queries in endpoints.items():
+            if not queries:
+                print(f"   ⚪ {endpoint:<20} sin consultas a {TABLE}")
+                continue
+            bad = [query for query in queries if not query["ok"]]
+            failures += len(bad)
+            access = sorted({line for query in queries for line in query["access"]})
+            icon = "❌" if bad else "✅"
+            print(f"   {icon} {endpoint:<20} {len(queries)} consulta(s): {'; '.join(access)}")
+            for query in (queries if verbose else bad):
+                print("        " + " ".join(query["sql"].split())[:300])
+                for line in query["plan"]:
+                    print(f"          {line}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN de los filtros de /analytics")
+    parser.add_argument("--days", type=int, default=60, help="Tamaño del rango de fechas de prueba")
+    parser.add_argument("--category", default="Plagas")
+    parser.add_argument("--issues", default="Roya del Café,Araña Roja", help="Problemas separados por comas")
+    parser.add_argument("--location-prefix", default="Tapachula")
+    parser.add_argument("--min-confidence", type=float, default=0.95)
+    parser.add_argument("--verbose", action="store_true", help="Mostrar el plan de todas las consultas")
+    parser.add_argument("--output", help="Archivo JSON con los planes")
+    args = parser.parse_args()
+
+    results = run(args)
+    failures = print_report(results, args.verbose)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False, default=str))
+        print(f"\n💾 Planes guardados en {args.output}")
+
+    if failures:
+        print(f"\n❌ {failures} consulta(s) recorren {TABLE} completa (¿faltan índices? corre init_db.py)")
+        sys.exit(1)
+    print("\n🎉 Todos los filtros usan índices")
+
+
+if __name__ == "__main__":
+    main()
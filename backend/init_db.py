@@ -9,8 +9,8 @@ from pathlib import Path
 # Agregar el directorio raíz al path
 sys.path.append(str(Path(__file__).parent))
 
-from app.db.database import engine, Base, init_db
-from app.models.models import User, DiagnosisRecord, AccessibilityConfig, ActionItem, AggregatedMetrics
+from app.db.database import engine, Base, init_db, SCHEMA_VERSION
+from app.models.models import User, DiagnosisRecord, AccessibilityConfig, ActionItem, AggregatedMetrics, SchemaVersion
 from app.core.config import settings
 
 def initialize_database():
@@ -26,14 +26,15 @@ def initialize_database():
         connection.close()
         print("✅ Conexión exitosa a PostgreSQL")
         
-        # Crear todas las tablas
-        Base.metadata.create_all(bind=engine)
+        # Crear todas las tablas y registrar la versión del esquema
+        init_db()
         print("✅ Tablas creadas exitosamente:")
         print("   - users")
         print("   - accessibility_configs")
         print("   - diagnosis_records")
         print("   - action_items")
         print("   - aggregated_metrics")
+        print(f"   - schema_version (v{SCHEMA_VERSION})")
         print("\n🚀 Base de datos PostgreSQL lista para usar!")
         
         return True
@@ -0,0 +1,41 @@
+"""
+Reconstruye los sketches semanales (diagnosis_sketches) desde diagnosis_records
+
+Útil después de cargar datos sin pasar por /sync (p. ej.
+seed_synthetic_data.py --skip-sketches) o tras cambiar la taxonomía de
+problemas:
+    python rebuild_sketches.py
+
+Las semanas que ya se archivaron en Parquet (archive_cold_data.py) no
+están en diagnosis_records: sus sketches se conservan y solo se reconstruyen
+las semanas posteriores al último mes archivado.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from app.db.database import SessionLocal
+from app.models import models  # noqa: F401  (registra las tablas)
+from app.crud import crud
+from app.services import archive
+
+
+def main():
+    print("🔄 Reconstruyendo sketches de diagnósticos...")
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        archived_until = archive.archived_until()
+        if archived_until is not None:
+            print(f"   Conservando los sketches anteriores a {archived_until:%Y-%m-%d} (meses archivados)")
+        processed = crud.rebuild_diagnosis_sketches(db, archived_until=archived_until)
+    finally:
+        db.close()
+    print(f"✅ {processed:,} diagnósticos procesados en {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
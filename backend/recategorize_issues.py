@@ -0,0 +1,124 @@
+"""
+Renombra o divide clases de problemas y reescribe los diagnósticos históricos
+
+El cambio de taxonomía se aplica de inmediato (los /sync nuevos y las
+métricas ya usan los nombres nuevos) y las filas históricas se reescriben en
+segundo plano por rangos de id, con pausas para no competir con /sync ni con
+el dashboard. El trabajo queda en maintenance_jobs: si el proceso se corta,
+``run`` (o el scheduler de la app) lo retoma donde quedó.
+
+Uso:
+    python recategorize_issues.py start --rename "Ojo de Gallo (Cercospora)=Cercosporiosis" --run
+    python recategorize_issues.py start --rename "Antracnosis=Antracnosis del Fruto" \\
+        --category "Antracnosis del Fruto=Enfermedades"
+    python recategorize_issues.py run --max-duty 0.25
+    python recategorize_issues.py status
+    python recategorize_issues.py pause --job 3
+    python recategorize_issues.py resume --job 3
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.models.models import MaintenanceJob
+from app.services import recategorize
+
+
+def _pairs(values, option: str) -> dict:
+    pairs = {}
+    for value in values or []:
+        name, sep, target = value.partition("=")
+        if not sep or not name.strip() or not target.strip():
+            sys.exit(f"❌ {option} espera 'Nombre=Valor', recibió '{value}'")
+        pairs[name.strip()] = target.strip()
+    return pairs
+
+
+def run(db, args) -> None:
+    print(f"🔄 Reescribiendo diagnósticos (rangos de {args.chunk_ids:,} ids, hasta {args.max_duty:.0%} del tiempo)...")
+    start = time.perf_counter()
+    job = recategorize.run_job(
+        db, job_id=args.job, time_budget=args.time_budget, chunk_ids=args.chunk_ids, max_duty=args.max_duty
+    )
+    if job is None:
+        print("   (ningún trabajo pendiente, o lo está corriendo otro proceso)")
+        return
+    print(f"   • Trabajo {job.id}: {job.status}, {job.rows_updated:,} filas reescritas, "
+          f"{recategorize.progress(job):.0%} del rango")
+    print(f"✅ Listo en {time.perf_counter() - start:.1f} s")
+
+
+def status(db) -> None:
+    jobs = db.query(MaintenanceJob).filter(MaintenanceJob.kind == recategorize.KIND)\
+        .order_by(MaintenanceJob.id.desc()).limit(10).all()
+    if not jobs:
+        print("   (no hay trabajos de re-categorización)")
+    for job in jobs:
+        renames = ", ".join(f"{old} → {new}" for old, new in job.params.get("renames", {}).items()) or "solo categorías"
+        owner = f", corriendo en {job.owner}" if job.owner else ""
+        print(f"   • {job.id} [{job.status}] {renames}: {job.rows_updated:,} filas, "
+              f"{recategorize.progress(job):.0%}{owner}")
+        if job.error:
+            print(f"     ⚠️  {job.error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-categorización en línea de diagnósticos")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    start = commands.add_parser("start", help="Guardar la taxonomía nueva y crear el trabajo")
+    start.add_argument("--rename", action="append", metavar="ANTERIOR=NUEVO",
+                       help="Clase renombrada o dividida (la nueva hereda el histórico); repetible")
+    start.add_argument("--category", action="append", metavar="CLASE=CATEGORÍA",
+                       help="Categoría del dashboard de una clase; repetible")
+    start.add_argument("--run", action="store_true", help="Reescribir el histórico ahora en lugar de dejarlo al scheduler")
+
+    run_parser = commands.add_parser("run", help="Avanzar el trabajo pendiente (o retomarlo)")
+    for sub in (start, run_parser):
+        sub.add_argument("--chunk-ids", type=int, default=settings.RECATEGORIZE_CHUNK_IDS,
+                         help="Ids por UPDATE")
+        sub.add_argument("--max-duty", type=float, default=settings.RECATEGORIZE_MAX_DUTY,
+                         help="Fracción máxima del tiempo ocupando la base (0-1)")
+        sub.add_argument("--time-budget", type=float, help="Segundos antes de pausar (default: hasta terminar)")
+    run_parser.add_argument("--job", type=int, help="Id del trabajo (default: el más antiguo pendiente)")
+
+    commands.add_parser("status", help="Listar los trabajos recientes")
+    for name, help_text in (("pause", "Pausar un trabajo"), ("resume", "Retomar un trabajo pausado")):
+        commands.add_parser(name, help=help_text).add_argument("--job", type=int, required=True)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "start":
+            renames, categories = _pairs(args.rename, "--rename"), _pairs(args.category, "--category")
+            if not renames and not categories:
+                sys.exit("❌ Indica al menos un --rename o --category")
+            try:
+                job = recategorize.start_recategorization(db, renames, categories)
+            except ValueError as e:
+                sys.exit(f"❌ {e}")
+            print(f"🏷️  Taxonomía actualizada; trabajo {job.id} creado")
+            if args.run:
+                args.job = job.id
+                run(db, args)
+        elif args.command == "run":
+            run(db, args)
+        elif args.command == "status":
+            status(db)
+        else:
+            new_status = "paused" if args.command == "pause" else "pending"
+            if not recategorize.set_status(db, args.job, new_status):
+                sys.exit(f"❌ El trabajo {args.job} no existe o no admite '{args.command}'")
+            print(f"✅ Trabajo {args.job}: {new_status}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Envía a la instancia central los diagnósticos guardados en este nodo edge
+
+Usa la configuración de modo edge (EDGE_UPSTREAM_URL, REPLICATION_TOKEN,
+EDGE_NODE_ID). Es seguro cortarlo y volver a correrlo: la central guarda
+hasta qué id aplicó y el siguiente envío sigue desde ahí. La app ya lo hace
+en segundo plano; este script sirve para vaciar el pendiente a mano (p. ej.
+al llegar a un lugar con buena conexión) o revisar el estado.
+
+Uso:
+    python replicate_edge.py --status
+    python replicate_edge.py
+    python replicate_edge.py --watch --interval 60
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.models import models  # noqa: F401  (registra las tablas)
+from app.services import edge_replication
+
+
+def report(replicator, db, stats=None) -> None:
+    sizer = replicator.sizer
+    bandwidth = f"{sizer.bytes_per_second / 1024:,.1f} KB/s" if sizer.bytes_per_second else "sin medir"
+    backlog = replicator.backlog(db)
+    print(f"   • Nodo {replicator.node_id}: central aplicó hasta el id {replicator.cursor}, "
+          f"{'?' if backlog is None else f'{backlog:,}'} filas pendientes")
+    print(f"   • Lote: {sizer.rows:,} filas, ancho de banda {bandwidth}")
+    if stats is not None:
+        print(f"   • Este turno: {stats['batches']} lotes, {stats['rows']:,} filas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réplica de un nodo edge hacia la instancia central")
+    parser.add_argument("--status", action="store_true", help="Solo mostrar el cursor y el pendiente")
+    parser.add_argument("--watch", action="store_true", help="Seguir enviando cada --interval segundos")
+    parser.add_argument("--interval", type=float, default=settings.EDGE_REPLICATION_INTERVAL_SECONDS)
+    parser.add_argument("--time-budget", type=float, help="Segundos máximos por turno (default: hasta vaciar)")
+    args = parser.parse_args()
+
+    replicator = edge_replication.get_replicator()
+    if replicator is None:
+        sys.exit("❌ EDGE_UPSTREAM_URL no está configurado")
+    print(f"🛰️  Réplica hacia {settings.EDGE_UPSTREAM_URL}")
+
+    db = SessionLocal()
+    try:
+        if args.status:
+            try:
+                replicator.fetch_cursor()
+            except Exception as e:
+                sys.exit(f"❌ No se pudo consultar la central: {e}")
+            report(replicator, db)
+            return
+
+        while True:
+            start = time.perf_counter()
+            stats = replicator.run(db, time_budget=args.time_budget)
+            report(replicator, db, stats)
+            if stats["caught_up"]:
+                print(f"✅ Al día en {time.perf_counter() - start:.1f} s")
+            elif not args.watch:
+                sys.exit("⚠️  Quedaron filas pendientes (sin enlace o sin tiempo); se retoma en el próximo turno")
+            if not args.watch:
+                return
+            time.sleep(args.interval)
+    finally:
+        db.close()
+        replicator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+Generador de datos sintéticos a gran escala para Kaapeh Copiloto
+
+Produce millones de filas de ``users``, ``diagnosis_records`` y ``action_items``
+con distribuciones realistas:
+- las 15 clases del modelo CoreML con frecuencias y estacionalidad propias
+  (la roya sube en temporada de lluvias, las deficiencias en floración, etc.)
+- ubicaciones de Chiapas, Oaxaca, Veracruz y Guatemala con peso tipo Zipf
+- confianza con distribución Beta por clase y feedback correlacionado con ella
+- usuarios con actividad de cola larga y acciones sugeridas por diagnóstico
+
+Todo es determinista a partir de ``--seed``: cada chunk usa su propio
+generador derivado de (seed, tabla, chunk), así que el resultado es idéntico
+con cualquier número de workers. En PostgreSQL cada worker carga su chunk con
+COPY en su propia conexión; en SQLite los chunks se generan en paralelo y se
+insertan en bloque desde un solo proceso.
+
+Cargar varias veces sin ``--truncate`` agrega usuarios nuevos y sus propios
+diagnósticos (los ids continúan después de los existentes). Como la carga no
+pasa por crud, al final se recalculan metric_counters y se reconstruye
+diagnosis_sketches (``--skip-sketches`` lo omite; luego ``rebuild_sketches.py``).
+
+Uso:
+    python seed_synthetic_data.py --diagnoses 2000000 --users 50000 --workers 8
+    python seed_synthetic_data.py --diagnoses 100000 --seed 7 --truncate
+"""
+
+import argparse
+import csv
+import io
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.crud.crud import categorize_issue
+
+# (clase, peso relativo, Beta(a, b) de confianza, mes pico o None)
+ISSUE_PROFILES = [
+    ("Deficiencia de Nitrógeno (N)", 9.0, (8.0, 2.5), 4),
+    ("Deficiencia de Fósforo (P)", 3.0, (6.0, 2.5), 4),
+    ("Deficiencia de Potasio (K)", 6.0, (7.0, 2.5), 9),
+    ("Deficiencia de Calcio (Ca)", 2.0, (5.0, 2.5), None),
+    ("Deficiencia de Magnesio (Mg)", 4.0, (6.5, 2.5), 9),
+    ("Deficiencia de Hierro (Fe)", 2.0, (5.5, 2.5), None),
+    ("Deficiencia de Manganeso (Mn)", 1.5, (5.0, 2.5), None),
+    ("Deficiencia de Boro (B)", 2.5, (5.5, 2.5), 3),
+    ("Múltiples Deficiencias Nutricionales", 3.0, (4.0, 2.5), None),
+    ("Roya del Café", 18.0, (12.0, 2.0), 9),
+    ("Mancha de Phoma", 4.0, (6.0, 2.5), 11),
+    ("Ojo de Gallo (Cercospora)", 6.0, (8.0, 2.5), 8),
+    ("Minador de la Hoja", 5.0, (7.0, 2.5), 3),
+    ("Araña Roja", 2.5, (6.0, 2.5), 2),
+    ("Planta Saludable", 22.0, (14.0, 1.5), None),
+]
+
+LOCATIONS = [
+    "Tapachula, Chiapas", "Ángel Albino Corzo, Chiapas", "La Concordia, Chiapas",
+    "Jaltenango, Chiapas", "Motozintla, Chiapas", "Chilón, Chiapas", "Tenejapa, Chiapas",
+    "Siltepec, Chiapas", "Pluma Hidalgo, Oaxaca", "San Miguel del Puerto, Oaxaca",
+    "Santa María Huatulco, Oaxaca", "Candelaria Loxicha, Oaxaca", "Coatepec, Veracruz",
+    "Huatusco, Veracruz", "Xico, Veracruz", "Zongolica, Veracruz",
+    "Huehuetenango, Guatemala", "Antigua, Guatemala", "Cobán, Guatemala", "San Marcos, Guatemala",
+]
+
+ACTIONS_BY_CATEGORY = {
+    "Deficiencias Nutricionales": [
+        "Aplicar fertilización foliar según análisis",
+        "Tomar muestra de suelo para análisis",
+        "Incorporar abono orgánico (bocashi o composta)",
+    ],
+    "Enfermedades": [
+        "Retirar y destruir hojas afectadas",
+        "Aplicar caldo bordelés o fungicida cúprico",
+        "Regular la sombra para mejorar la ventilación",
+    ],
+    "Plagas": [
+        "Colocar trampas y monitorear la población",
+        "Liberar control biológico",
+        "Revisar plantas vecinas",
+    ],
+}
+
+FIRST_NAMES = [
+    "Juan", "María", "José", "Guadalupe", "Pedro", "Rosa", "Miguel", "Juana",
+    "Antonio", "Carmen", "Francisco", "Elena", "Manuel", "Sofía", "Luis", "Petrona",
+]
+
+ACTIVITY_HOURS = np.arange(6, 19)
+
+
+def chunk_rng(seed: int, table: str, chunk_index: int) -> np.random.Generator:
+    """
+    Deterministic generator for one chunk, independent of worker scheduling
+    """
+    table_id = {"users": 1, "diagnoses": 2, "actions": 3}[table]
+    return np.random.default_rng([seed, table_id, chunk_index])
+
+
+def day_weights(start: datetime, days: int) -> np.ndarray:
+    """
+    Weight per calendar day: slow adoption growth plus a weekly rhythm
+    """
+    t = np.arange(days)
+    growth = 0.4 + 0.6 * t / max(days - 1, 1)
+    weekday = (np.arange(days) + start.weekday()) % 7
+    weekly = np.where(weekday == 6, 0.4, 1.0)
+    weights = growth * weekly
+    return weights / weights.sum()
+
+
+def seasonal_factor(months: np.ndarray, peak: int) -> np.ndarray:
+    """
+    Cosine bump centred on the peak month (1..12)
+    """
+    return 1.0 + 0.8 * np.cos((months - peak) / 12.0 * 2 * np.pi)
+
+
+# ==================== GENERATION ====================
+
+def generate_users(seed: int, chunk_index: int, first_id: int, count: int, now: datetime) -> list:
+    rng = chunk_rng(seed, "users", chunk_index)
+    names = rng.choice(FIRST_NAMES, size=count)
+    devices = rng.integers(0, 16 ** 8, size=count)
+    is_tech = rng.random(count) < 0.02
+    created_offsets = rng.integers(0, 365 * 2 * 86400, size=count)
+    login_offsets = rng.integers(0, 30 * 86400, size=count)
+
+    rows = []
+    for i in range(count):
+        user_id = first_id + i
+        device = f"{int(devices[i]):08x}"
+        created = now - timedelta(seconds=int(created_offsets[i]))
+        rows.append((
+            user_id,
+            f"{names[i]}{user_id}@device-{device}",
+            str(names[i]),
+            device,
+            "Técnico" if is_tech[i] else "Productor",
+            "es",
+            created,
+            max(created, now - timedelta(seconds=int(login_offsets[i]))),
+        ))
+    return rows
+
+
+def generate_diagnoses(seed: int, chunk_index: int, first_id: int, count: int,
+                       start: datetime, days: int, user_count: int, first_user_id: int = 1) -> list:
+    rng = chunk_rng(seed, "diagnoses", chunk_index)
+    weights = np.array([p[1] for p in ISSUE_PROFILES])
+
+    # Día de cada diagnóstico: tendencia de adopción por la estacionalidad de su clase
+    day_p = day_weights(start, days)
+    day_months = np.array([(start + timedelta(days=int(d))).month for d in range(days)])
+    issues = rng.choice(len(ISSUE_PROFILES), size=count, p=weights / weights.sum())
+    day_index = np.empty(count, dtype=np.int64)
+    for code, (_, _, _, peak) in enumerate(ISSUE_PROFILES):
+        mask = issues == code
+        p = day_p if peak is None else day_p * seasonal_factor(day_months, peak)
+        day_index[mask] = rng.choice(days, size=mask.sum(), p=p / p.sum())
+
+    seconds = rng.choice(ACTIVITY_HOURS, size=count) * 3600 + rng.integers(0, 3600, size=count)
+
+    confidence = np.empty(count)
+    for code, (_, _, (a, b), _) in enumerate(ISSUE_PROFILES):
+        mask = issues == code
+        confidence[mask] = rng.beta(a, b, size=mask.sum())
+    confidence = np.clip(confidence, 0.3, 0.999).round(4)
+
+    # ~35% deja feedback; la probabilidad de "correcto" crece con la confianza
+    has_feedback = rng.random(count) < 0.35
+    correct = rng.random(count) < (0.35 + 0.6 * confidence ** 2)
+
+    location_ranks = np.arange(1, len(LOCATIONS) + 1)
+    location_p = (1.0 / location_ranks ** 0.9) / (1.0 / location_ranks ** 0.9).sum()
+    locations = rng.choice(len(LOCATIONS), size=count, p=location_p)
+    missing_location = rng.random(count) < 0.08
+
+    # 30% de los diagnósticos están ligados a un usuario de esta carga (el resto llega anónimo por /sync)
+    linked = rng.random(count) < 0.3
+    user_ids = first_user_id - 1 + np.minimum(rng.zipf(1.3, size=count), user_count) \
+        if user_count else np.zeros(count, int)
+
+    rows = []
+    for i in range(count):
+        issue = ISSUE_PROFILES[issues[i]][0]
+        rows.append((
+            first_id + i,
+            int(user_ids[i]) if linked[i] and user_count else None,
+            start + timedelta(days=int(day_index[i]), seconds=int(seconds[i])),
+            issue,
+            float(confidence[i]),
+            bool(correct[i]) if has_feedback[i] else None,
+            None,
+            None,
+            None if missing_location[i] else LOCATIONS[locations[i]],
+        ))
+    return rows
+
+
+def generate_actions(seed: int, chunk_index: int, first_id: int, diagnoses: list) -> list:
+    rng = chunk_rng(seed, "actions", chunk_index)
+    rows = []
+    next_id = first_id
+    for diagnosis in diagnoses:
+        templates = ACTIONS_BY_CATEGORY.get(categorize_issue(diagnosis[3]))
+        if not templates:
+            continue
+        n = int(rng.integers(1, len(templates) + 1))
+        for text in rng.choice(templates, size=n, replace=False):
+            rows.append((
+                next_id,
+                diagnosis[0],
+                str(text),
+                bool(rng.random() < 0.42),
+                diagnosis[2] + timedelta(minutes=int(rng.integers(1, 120))),
+            ))
+            next_id += 1
+    return rows
+
+
+# ==================== LOADING ====================
+
+USER_COLUMNS = ("id", "username", "display_name", "device_id", "role", "preferred_language",
+                "created_at", "last_login_at")
+DIAGNOSIS_COLUMNS = ("id", "user_id", "timestamp", "detected_issue", "confidence",
+                     "user_feedback_correct", "user_corrected_issue", "ai_explanation", "location")
+ACTION_COLUMNS = ("id", "diagnosis_id", "description_text", "is_completed", "created_at")
+
+
+def copy_rows(raw_connection, table: str, columns: tuple, rows: list) -> None:
+    """
+    Load rows through PostgreSQL COPY using an in-memory CSV buffer
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if v is None else v for v in row])
+    buffer.seek(0)
+    with raw_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+
+
+def insert_rows(connection, table: str, columns: tuple, rows: list) -> None:
+    """
+    Bulk insert with executemany (SQLite and other non-COPY backends)
+    """
+    placeholders = ", ".join("?" for _ in columns)
+    connection.exec_driver_sql(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows
+    )
+
+
+def build_chunk(task: dict):
+    """
+    Generate one diagnosis chunk (and its action items); load it directly on PostgreSQL
+    """
+    start = datetime.fromisoformat(task["start"])
+    diagnoses = generate_diagnoses(
+        task["seed"], task["chunk"], task["first_id"], task["count"],
+        start, task["days"], task["user_count"], task["first_user_id"],
+    )
+    actions = generate_actions(task["seed"], task["chunk"], task["first_action_id"], diagnoses)
+
+    if not task["use_copy"]:
+        return diagnoses, actions
+
+    from sqlalchemy import create_engine
+    engine = create_engine(task["database_url"])
+    raw = engine.raw_connection()
+    try:
+        copy_rows(raw, "diagnosis_records", DIAGNOSIS_COLUMNS, diagnoses)
+        copy_rows(raw, "action_items", ACTION_COLUMNS, actions)
+        raw.commit()
+    finally:
+        raw.close()
+        engine.dispose()
+    return len(diagnoses), len(actions)
+
+
+def seed_database(args) -> None:
+    from sqlalchemy import text
+    from app.core.config import settings
+    from app.db.database import engine, Base, SessionLocal, reconcile_metric_counters
+    from app.crud import crud
+    from app.models import models  # noqa: F401  (registra las tablas)
+    from app.services import archive
+
+    database_url = settings.DATABASE_URL
+    use_copy = engine.dialect.name == "postgresql"
+    Base.metadata.create_all(bind=engine)
+
+    print("🌱 Generando datos sintéticos")
+    print(f"   Diagnósticos: {args.diagnoses:,}  Usuarios: {args.users:,}  Seed: {args.seed}")
+    print(f"   Backend: {engine.dialect.name} ({'COPY' if use_copy else 'bulk INSERT'}), workers: {args.workers}")
+
+    with engine.begin() as conn:
+        if args.truncate:
+            if use_copy:
+                conn.execute(text("TRUNCATE action_items, diagnosis_records, users RESTART IDENTITY CASCADE"))
+            else:
+                for table in ("action_items", "diagnosis_records", "users"):
+                    conn.execute(text(f"DELETE FROM {table}"))
+        user_offset = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM users")).scalar()
+        diagnosis_offset = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM diagnosis_records")).scalar()
+        action_offset = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM action_items")).scalar()
+
+    # La fecha final forma parte de la semilla: fijarla con --end-date para reproducir exactamente
+    now = datetime.fromisoformat(args.end_date) if args.end_date else \
+        datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = now - timedelta(days=args.days)
+    started = time.perf_counter()
+
+    # Usuarios (volumen pequeño comparado con diagnósticos: un solo chunk)
+    users = generate_users(args.seed, 0, user_offset + 1, args.users, now)
+    with engine.begin() as conn:
+        if use_copy:
+            copy_rows(conn.connection.dbapi_connection, "users", USER_COLUMNS, users)
+        else:
+            insert_rows(conn, "users", USER_COLUMNS, users)
+    print(f"   ✅ users: {len(users):,}")
+
+    # Diagnósticos y acciones en chunks; cada chunk reserva un rango de ids de acciones
+    tasks = []
+    for chunk, first in enumerate(range(0, args.diagnoses, args.chunk_size)):
+        count = min(args.chunk_size, args.diagnoses - first)
+        tasks.append({
+            "seed": args.seed,
+            "chunk": chunk,
+            "first_id": diagnosis_offset + first + 1,
+            "first_action_id": action_offset + first * 3 + 1,
+            "count": count,
+            "start": start.isoformat(),
+            "days": args.days,
+            "user_count": args.users,
+            "first_user_id": user_offset + 1,
+            "use_copy": use_copy,
+            "database_url": database_url,
+        })
+
+    total_diagnoses = total_actions = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for result in pool.map(build_chunk, tasks):
+            if use_copy:
+                n_diagnoses, n_actions = result
+            else:
+                diagnoses, actions = result
+                with engine.begin() as conn:
+                    insert_rows(conn, "diagnosis_records", DIAGNOSIS_COLUMNS, diagnoses)
+                    insert_rows(conn, "action_items", ACTION_COLUMNS, actions)
+                n_diagnoses, n_actions = len(diagnoses), len(actions)
+            total_diagnoses += n_diagnoses
+            total_actions += n_actions
+            print(f"   … {total_diagnoses:,}/{args.diagnoses:,} diagnósticos")
+
+    if use_copy:
+        with engine.begin() as conn:
+            for table in ("users", "diagnosis_records", "action_items"):
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"
+                ))
+            conn.execute(text("ANALYZE users, diagnosis_records, action_items"))
+
+    # COPY / INSERT masivo no pasa por crud: los contadores de NAS se recalculan aquí
+    with engine.begin() as conn:
+        reconcile_metric_counters(conn)
+
+    elapsed = time.perf_counter() - started
+    print(f"   ✅ diagnosis_records: {total_diagnoses:,}")
+    print(f"   ✅ action_items: {total_actions:,}")
+
+    # Los sketches se reconstruyen completos, salvo las semanas ya archivadas:
+    # también cubren las cargas anteriores
+    if args.skip_sketches:
+        print("   ⚠️  diagnosis_sketches quedó desactualizado: correr python rebuild_sketches.py")
+    else:
+        sketch_start = time.perf_counter()
+        db = SessionLocal()
+        try:
+            crud.rebuild_diagnosis_sketches(db, archived_until=archive.archived_until())
+        finally:
+            db.close()
+        print(f"   ✅ diagnosis_sketches reconstruidos en {time.perf_counter() - sketch_start:.1f} s")
+    print(f"\n🚀 Carga en {elapsed:.1f} s ({total_diagnoses / elapsed:,.0f} diagnósticos/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de datos sintéticos")
+    parser.add_argument("--diagnoses", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--days", type=int, default=3 * 365, help="Días de historia hacia atrás")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end-date", help="Fecha final de la historia (YYYY-MM-DD, default: hoy UTC)")
+    parser.add_argument("--truncate", action="store_true", help="Vaciar las tablas antes de cargar")
+    parser.add_argument("--skip-sketches", action="store_true",
+                        help="No reconstruir diagnosis_sketches al final (correr rebuild_sketches.py después)")
+    args = parser.parse_args()
+    seed_database(args)
+
+
+if __name__ == "__main__":
+    main()
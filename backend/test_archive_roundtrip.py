@@ -0,0 +1,190 @@
+"""
+Script de prueba para el archivo Parquet - Copia, borrado y lectura
+Archiva meses viejos de una base SQLite temporal y verifica en cada paso que
+tabla caliente + archivo suman exactamente los diagnósticos originales:
+
+- una fila con id bajo que se confirma después de la copia (como una
+  transacción lenta en PostgreSQL) no se borra ni se oculta, y entra al
+  archivo en la corrida siguiente
+- un diagnóstico que gana un action item durante el borrado se queda en la
+  tabla y sale del archivo
+- si una fila copiada ya no está en la tabla, el borrado se detiene con
+  ArchiveError y el mes queda en "deleting"
+- reconstruir los sketches después de archivar conserva los de las semanas
+  archivadas (no se pierden diagnósticos de los sketches)
+
+Corre en un subproceso con su propia base SQLite y directorio de archivo
+temporales (la configuración se lee al importar la app). Necesita pyarrow.
+No necesita el servidor corriendo.
+Ejecutar con: python test_archive_roundtrip.py  (o con pytest)
+"""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+ISSUES = ["Roya del Café", "Broca del Café", "Deficiencia de Nitrógeno (N)", "Planta Saludable"]
+LATE_ID = 250  # Hueco en la secuencia: id reservado por una transacción que confirma tarde
+
+
+def _row(diagnosis_id: int, timestamp: datetime, rng: random.Random) -> dict:
+    return {
+        "id": diagnosis_id,
+        "timestamp": timestamp,
+        "detected_issue": rng.choice(ISSUES),
+        "confidence": round(rng.uniform(0.5, 0.99), 4),
+        "location": "Tapachula, Chiapas",
+    }
+
+
+def _visible(db) -> Counter:
+    """
+    Per-issue counts as analytics sees them: hot table (with exclusions) + archive
+    """
+    from app.api.v1.endpoints.analytics import _sql_issue_totals
+    from app.services import archive
+    from app.services.analytics_filters import AnalyticsFilters
+
+    totals = archive.add_issue_totals({}, AnalyticsFilters())
+    for issue, (count, _) in _sql_issue_totals(db, archive.hot_exclusions()).items():
+        totals.setdefault(issue, [0, 0.0])[0] += count
+    return Counter({issue: entry[0] for issue, entry in totals.items() if entry[0]})
+
+
+def _hot_ids(db, month: str) -> set:
+    from app.models.models import DiagnosisRecord
+    from app.services import archive
+
+    start, end = archive._month_bounds(month)
+    return {
+        diagnosis_id for (diagnosis_id,) in db.query(DiagnosisRecord.id).filter(
+            DiagnosisRecord.timestamp >= start, DiagnosisRecord.timestamp < end
+        )
+    }
+
+
+def _archived_ids(month: str) -> list:
+    from app.services import archive
+
+    entry = archive.manifest.months()[month]
+    table = archive._pyarrow()[2].read_table(archive.manifest.directory / entry["file"], columns=["id"])
+    return table["id"].to_pylist()
+
+
+def _worker() -> None:
+    """
+    Subproceso: archiva sobre DATABASE_URL y ARCHIVE_DIR, verificando cada paso
+    """
+    from sqlalchemy import insert
+
+    from app.db.database import init_db, SessionLocal
+    from app.models.models import ActionItem, ArchivePendingDelete, DiagnosisRecord, DiagnosisSketch
+    from app.crud import crud
+    from app.services import archive
+
+    def sketched() -> int:
+        return sum(count for (count,) in db.query(DiagnosisSketch.diagnoses_count))
+
+    assert archive.available(), "pyarrow no está instalado"
+    init_db()
+    rng = random.Random(36)
+    db = SessionLocal()
+    try:
+        january, february = datetime(2024, 1, 1), datetime(2024, 2, 1)
+        rows = [_row(i, january + timedelta(hours=rng.randint(0, 700)), rng) for i in range(1, 400) if i != LATE_ID]
+        rows += [_row(i, february + timedelta(hours=rng.randint(0, 650)), rng) for i in range(400, 700)]
+        rows += [_row(i, datetime.utcnow() - timedelta(hours=rng.randint(0, 48)), rng) for i in range(700, 800)]
+        db.execute(insert(DiagnosisRecord), rows)
+        db.add(ActionItem(diagnosis_id=10, description_text="Aplicar caldo bordelés"))
+        db.commit()
+        expected = Counter(row["detected_issue"] for row in rows)
+
+        # Copia de enero, como la hace archive_closed_months antes de borrar
+        cutoff = max(row["id"] for row in rows)
+        entry = archive._write_month(db, "2024-01", cutoff, 64, None)
+        entry["status"] = "deleting"
+        archive.manifest.update("2024-01", entry)
+        assert entry["pending_rows"] == entry["rows"] == 397  # 398 filas menos la del action item
+        assert _visible(db) == expected
+
+        # La transacción lenta confirma ahora su id bajo; otro diagnóstico copiado gana un action item
+        late = _row(LATE_ID, january + timedelta(days=3), rng)
+        db.execute(insert(DiagnosisRecord), [late])
+        db.add(ActionItem(diagnosis_id=20, description_text="Revisar trampas"))
+        db.commit()
+        expected[late["detected_issue"]] += 1
+        assert _visible(db) == expected, "la fila tardía quedó oculta"
+        crud.rebuild_diagnosis_sketches(db)
+        assert sketched() == sum(expected.values())
+
+        results = archive.archive_closed_months(db, hot_months=1, batch_size=64)
+        print(f"🧊 Primera corrida: {results}")
+        assert {result["month"] for result in results} == {"2024-01", "2024-02"}
+        assert _hot_ids(db, "2024-01") == {10, 20, LATE_ID}
+        assert 20 not in _archived_ids("2024-01") and LATE_ID not in _archived_ids("2024-01")
+        assert archive.manifest.months()["2024-01"]["rows"] == 396
+        assert _visible(db) == expected
+        assert db.query(ArchivePendingDelete).count() == 0
+
+        results = archive.archive_closed_months(db, hot_months=1, batch_size=64)
+        print(f"🔁 Segunda corrida: {results}")
+        assert [result["month"] for result in results] == ["2024-01"]
+        assert _hot_ids(db, "2024-01") == {10, 20}
+        assert sorted(_archived_ids("2024-01")) == sorted(
+            row["id"] for row in rows + [late] if row["timestamp"] < february and row["id"] not in (10, 20)
+        )
+        assert _visible(db) == expected
+        files = sorted(path.name for path in archive.manifest.directory.glob("diagnoses-2024-01*.parquet"))
+        assert files == [archive.manifest.months()["2024-01"]["file"]], files
+
+        # Los meses archivados ya no están en la tabla: sus semanas de sketches se conservan
+        archived_until = archive.archived_until()
+        assert archived_until == datetime(2024, 3, 1)
+        crud.rebuild_diagnosis_sketches(db, archived_until=archived_until)
+        print(f"🧮 Sketches tras reconstruir con meses archivados: {sketched()} diagnósticos")
+        assert sketched() == sum(expected.values())
+
+        # Una fila copiada desaparece de la tabla antes del borrado: no se da el mes por archivado
+        straggler = _row(LATE_ID + 1000, february + timedelta(days=2), rng)
+        db.execute(insert(DiagnosisRecord), [straggler])
+        db.commit()
+        entry = archive._write_month(db, "2024-02", straggler["id"], 64, archive.manifest.months()["2024-02"])
+        entry["status"] = "deleting"
+        archive.manifest.update("2024-02", entry)
+        db.query(DiagnosisRecord).filter(DiagnosisRecord.id == straggler["id"]).delete()
+        db.commit()
+        try:
+            archive.archive_closed_months(db, hot_months=1, batch_size=64)
+        except archive.ArchiveError as e:
+            print(f"🛑 Borrado detenido: {e}")
+        else:
+            raise AssertionError("expected ArchiveError")
+        assert archive.manifest.months()["2024-02"]["status"] == "deleting"
+    finally:
+        db.close()
+
+
+def test_archive_delete_read_roundtrip():
+    directory = tempfile.mkdtemp(prefix="kaapeh-archive-")
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/archive.db", ARCHIVE_DIR=f"{directory}/archive"),
+        cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    print(output.stdout, end="")
+    assert output.returncode == 0, output.stderr[-2000:]
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+        sys.exit(0)
+    test_archive_delete_read_roundtrip()
+    print("\n🎉 Tabla caliente + archivo suman siempre los diagnósticos originales")
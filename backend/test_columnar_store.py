@@ -0,0 +1,130 @@
+"""
+Script de prueba para el almacén columnar - Mismas respuestas que SQL
+Sincroniza los mismos lotes con COLUMNAR_STORE_ENABLED apagado y encendido y
+verifica que /analytics/frequent-issues, /heatmap, /trends y
+/feedback-analysis responden lo mismo:
+
+- después de la carga inicial del almacén
+- después de nuevos lotes, que el almacén agrega de forma incremental
+- con filtros de categoría, problema, ubicación y confianza
+
+Cada configuración corre en un subproceso con su propia base SQLite (la
+configuración se lee al importar la app). No necesita el servidor corriendo.
+Ejecutar con: python test_columnar_store.py  (o con pytest)
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+LOCATIONS = ["Tapachula, Chiapas", "Pluma Hidalgo, Oaxaca", "Coatepec, Veracruz", None]
+ISSUES = ["Roya del Café", "Broca del Café", "Deficiencia de Nitrógeno (N)", "Planta Sana", "Araña Roja"]
+
+ENDPOINTS = [
+    "/api/v1/analytics/frequent-issues?limit=50",
+    "/api/v1/analytics/heatmap",
+    "/api/v1/analytics/trends?days=30",
+    "/api/v1/analytics/trends?days=90&interval=week",
+    "/api/v1/analytics/feedback-analysis",
+    "/api/v1/analytics/frequent-issues?category=Plagas&location_prefix=Coatepec",
+    "/api/v1/analytics/heatmap?issue=Roya del Café&issue=Araña Roja&min_confidence=0.7",
+    "/api/v1/analytics/trends?days=30&max_confidence=0.8",
+    "/api/v1/analytics/feedback-analysis?location_prefix=Tapachula",
+]
+
+
+def _batches(seed: int, count: int) -> list:
+    rng = random.Random(seed)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=60)
+    return [
+        {
+            "device_id": f"dev-{seed}-{index}",
+            "diagnoses": [
+                {
+                    "timestamp": (start + timedelta(minutes=rng.randint(0, 86000))).isoformat(),
+                    "detected_issue": rng.choice(ISSUES),
+                    "confidence": round(rng.uniform(0.5, 0.99), 4),
+                    "user_feedback_correct": rng.choice([True, False, None]),
+                    "location": rng.choice(LOCATIONS),
+                }
+                for _ in range(80)
+            ],
+        }
+        for index in range(count)
+    ]
+
+
+def _worker() -> None:
+    """
+    Subproceso: sincroniza en dos tandas y vuelca las respuestas de cada una como JSON
+    """
+    import asyncio
+    import httpx
+
+    from app.main import app
+    from app.db.database import init_db
+    from app.models import models  # noqa: F401  (registra las tablas)
+    from app.core.security import create_access_token
+    from app.services.columnar_store import columnar_store
+
+    init_db()
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": "1", "role": "Técnico"})}
+
+    async def requests() -> dict:
+        results = {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            for phase, batches in (("inicial", _batches(1, 4)), ("incremental", _batches(2, 3))):
+                for batch in batches:
+                    response = await client.post("/api/v1/sync", json=batch)
+                    assert response.status_code == 200, response.text
+                for path in ENDPOINTS:
+                    response = await client.get(path, headers=headers)
+                    assert response.status_code == 200, f"{path}: {response.status_code} {response.text}"
+                    results[f"{phase} {path}"] = response.json()
+                results[f"{phase} filas en memoria"] = columnar_store._size
+        return results
+
+    print(json.dumps(asyncio.run(requests())))
+
+
+def _run_config(directory: str, columnar: bool) -> dict:
+    name = "columnar" if columnar else "sql"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/{name}.db", COLUMNAR_STORE_ENABLED=str(columnar))
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=env, cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_columnar_matches_sql():
+    directory = tempfile.mkdtemp(prefix="kaapeh-columnar-")
+    sql = _run_config(directory, columnar=False)
+    columnar = _run_config(directory, columnar=True)
+
+    print(f"📦 Filas en memoria: {columnar['inicial filas en memoria']} → {columnar['incremental filas en memoria']}")
+    assert sql["incremental filas en memoria"] == 0
+    assert columnar["inicial filas en memoria"] == 320 and columnar["incremental filas en memoria"] == 560
+
+    for key in sql:
+        if key.endswith("filas en memoria"):
+            continue
+        assert json.dumps(sql[key], sort_keys=True) == json.dumps(columnar[key], sort_keys=True), \
+            f"{key} difiere:\n  SQL:      {sql[key]}\n  columnar: {columnar[key]}"
+        print(f"✅ {key}")
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+    else:
+        test_columnar_matches_sql()
+        print("\n🎉 El almacén columnar responde lo mismo que SQL")
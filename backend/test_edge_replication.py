@@ -0,0 +1,223 @@
+"""
+Script de prueba para el modo edge - Réplica por lotes hacia la central
+Levanta una instancia central (uvicorn, SQLite) y corre el nodo edge en otro
+proceso con su propia base SQLite en WAL. Verifica que:
+
+- el nodo envía todo lo sincronizado localmente y la central queda con las
+  mismas filas
+- reenviar un lote ya aplicado no duplica filas y un lote con hueco recibe 409
+- cortar el proceso del nodo a medias y volver a correrlo retoma donde quedó
+- sin enlace (central apagada) no se pierde nada y se completa al volver
+
+No necesita el servidor corriendo.
+Ejecutar con: python test_edge_replication.py  (o con pytest)
+"""
+
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+TOKEN = "edge-test-token"
+NODE = "beneficio-prueba"
+ISSUES = ["Roya del Café", "Broca del Café", "Deficiencia de Nitrógeno (N)", "Planta Saludable", "Araña Roja"]
+LOCATIONS = ["Tapachula, Chiapas", "Pluma Hidalgo, Oaxaca", "Coatepec, Veracruz", None]
+
+
+def _diagnoses(seed: int, count: int) -> list:
+    rng = random.Random(seed)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=30)
+    return [
+        {
+            "timestamp": (start + timedelta(minutes=rng.randint(0, 43000))).isoformat(),
+            "detected_issue": rng.choice(ISSUES),
+            "confidence": round(rng.uniform(0.5, 0.99), 4),
+            "user_feedback_correct": rng.choice([True, False, None]),
+            "location": rng.choice(LOCATIONS),
+        }
+        for _ in range(count)
+    ]
+
+
+def _edge_worker(phase: str) -> None:
+    """
+    Subproceso del nodo edge; imprime un JSON con lo que observó
+    """
+    import asyncio
+    import gzip
+    import httpx
+
+    from app.main import app
+    from app.db.database import init_db, SessionLocal, engine
+    from app.services import edge_replication, sync_codec
+    from app.models.models import DiagnosisRecord
+
+    init_db()
+    result = {}
+    with engine.connect() as conn:
+        result["journal_mode"] = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+
+    async def sync(diagnoses: list) -> None:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://edge") as client:
+            for index in range(0, len(diagnoses), 500):
+                response = await client.post("/api/v1/sync", json={"diagnoses": diagnoses[index:index + 500]})
+                assert response.status_code == 200, response.text
+
+    replicator = edge_replication.get_replicator()
+    db = SessionLocal()
+    try:
+        if phase == "partial":
+            asyncio.run(sync(_diagnoses(1, 3000)))
+            # Un solo lote chico y el proceso termina: simula un corte a medias
+            replicator.sizer.rows = 400
+            result["stats"] = replicator.run(db, time_budget=1e-6)
+        elif phase == "resume":
+            result["cursor_at_start"] = replicator.fetch_cursor()
+            # Reintento de un lote cuya respuesta se perdió
+            rows = [
+                row._asdict() for row in db.query(*edge_replication._COLUMNS)
+                .filter(DiagnosisRecord.id <= replicator.cursor).order_by(DiagnosisRecord.id).all()
+            ]
+            headers = {
+                "Authorization": f"Bearer {TOKEN}", "Content-Type": sync_codec.MEDIA_TYPES[0],
+                "Content-Encoding": "gzip", "X-Edge-Node": NODE,
+            }
+            body = gzip.compress(sync_codec.encode(rows, with_ids=True))
+            client = httpx.Client(base_url=os.environ["EDGE_UPSTREAM_URL"])
+            duplicate = client.post("/sync/replicate", content=body, headers={
+                **headers, "X-Edge-After-Id": "0", "X-Edge-Through-Id": str(replicator.cursor),
+            })
+            result["duplicate"] = [duplicate.status_code, duplicate.json()]
+            gap = client.post("/sync/replicate", content=gzip.compress(sync_codec.encode([], with_ids=True)), headers={
+                **headers, "X-Edge-After-Id": str(replicator.cursor + 100),
+                "X-Edge-Through-Id": str(replicator.cursor + 200),
+            })
+            result["gap"] = [gap.status_code, gap.json()]
+            result["stats"] = replicator.run(db)
+        elif phase == "offline":
+            asyncio.run(sync(_diagnoses(2, 800)))
+            result["stats"] = replicator.run(db)
+        elif phase == "reconnect":
+            result["stats"] = replicator.run(db)
+        result["batch_rows"] = replicator.sizer.rows
+        result["local_rows"] = db.query(DiagnosisRecord).count()
+    finally:
+        db.close()
+        replicator.close()
+    print(json.dumps(result, default=str))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_central(directory: str, port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{directory}/central.db",
+        REPLICATION_TOKEN=TOKEN,
+        METRICS_SNAPSHOT_INTERVAL_SECONDS="0",
+        RECATEGORIZE_INTERVAL_SECONDS="0",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=str(Path(__file__).parent), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    import httpx
+    for _ in range(100):
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/v1/health", timeout=1).status_code == 200:
+                return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(process.stderr.read().decode()[-2000:])
+
+
+def _run_edge(directory: str, port: int, phase: str) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{directory}/edge.db",
+        EDGE_MODE="true",
+        EDGE_NODE_ID=NODE,
+        EDGE_UPSTREAM_URL=f"http://127.0.0.1:{port}/api/v1",
+        EDGE_UPLOAD_TIMEOUT_SECONDS="10",
+        EDGE_BATCH_MIN_ROWS="50",
+        EDGE_BATCH_MAX_ROWS="1000",
+        REPLICATION_TOKEN=TOKEN,
+        METRICS_SNAPSHOT_INTERVAL_SECONDS="0",
+        RECATEGORIZE_INTERVAL_SECONDS="0",
+    )
+    output = subprocess.run(
+        [sys.executable, __file__, "--edge", phase],
+        env=env, cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def _rows(path: str) -> list:
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT timestamp, detected_issue, confidence, user_feedback_correct, location "
+        "FROM diagnosis_records ORDER BY timestamp, detected_issue, confidence, location"
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def test_edge_node_replicates_exactly_once():
+    directory = tempfile.mkdtemp(prefix="kaapeh-edge-")
+    port = _free_port()
+    central = _start_central(directory, port)
+    try:
+        partial = _run_edge(directory, port, "partial")
+        print(f"✂️  Corte a medias: {partial['stats']}")
+        assert partial["journal_mode"] == "wal"
+        assert 0 < partial["stats"]["cursor"] < partial["local_rows"] == 3000
+        assert len(_rows(f"{directory}/central.db")) == partial["stats"]["cursor"]
+
+        resume = _run_edge(directory, port, "resume")
+        print(f"🔁 Retoma desde {resume['cursor_at_start']}: {resume['stats']}, lote final {resume['batch_rows']} filas")
+        assert resume["cursor_at_start"] == partial["stats"]["cursor"]
+        assert resume["duplicate"][0] == 200 and resume["duplicate"][1]["rows_applied"] == 0
+        assert resume["duplicate"][1]["duplicates_skipped"] == resume["cursor_at_start"]
+        assert resume["gap"][0] == 409 and resume["gap"][1]["applied_through_id"] == resume["cursor_at_start"]
+        assert resume["stats"]["caught_up"] and resume["stats"]["cursor"] == 3000
+        assert _rows(f"{directory}/central.db") == _rows(f"{directory}/edge.db")
+    finally:
+        central.terminate()
+        central.wait()
+
+    offline = _run_edge(directory, port, "offline")
+    print(f"📴 Sin enlace: {offline['stats']}")
+    assert not offline["stats"]["caught_up"] and offline["local_rows"] == 3800
+
+    central = _start_central(directory, port)
+    try:
+        reconnect = _run_edge(directory, port, "reconnect")
+        print(f"📶 Enlace de vuelta: {reconnect['stats']}")
+        assert reconnect["stats"]["caught_up"] and reconnect["stats"]["cursor"] == 3800
+        assert _rows(f"{directory}/central.db") == _rows(f"{directory}/edge.db")
+    finally:
+        central.terminate()
+        central.wait()
+
+
+if __name__ == "__main__":
+    if "--edge" in sys.argv:
+        _edge_worker(sys.argv[sys.argv.index("--edge") + 1])
+    else:
+        test_edge_node_replicates_exactly_once()
+        print("\n🎉 La central tiene exactamente las filas del nodo edge")
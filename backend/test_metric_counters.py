@@ -0,0 +1,92 @@
+"""
+Script de prueba para metric_counters - NAS mantenido vs. NAS contado
+Verifica que el NAS de los contadores (get_nas, lo que leen /metrics y los
+snapshots) coincide con el que cuenta la tabla (calculate_nas):
+
+- después de init_db + seed_synthetic_data.py (carga masiva sin crud)
+- después de volver a cargar con --truncate
+- después de un DELETE por SQL, una vez que se reconcilian los contadores
+- con escrituras de crud después de reconciliar
+
+Corre en un subproceso con su propia base SQLite temporal (la configuración
+se lee al importar la app). No necesita el servidor corriendo.
+Ejecutar con: python test_metric_counters.py  (o con pytest)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+
+def _seed(*extra: str) -> None:
+    output = subprocess.run(
+        [sys.executable, "seed_synthetic_data.py", "--diagnoses", "3000", "--users", "40",
+         "--chunk-size", "1000", "--workers", "2", "--end-date", "2026-01-01", *extra],
+        cwd=str(Path(__file__).parent), capture_output=True, text=True, env=dict(os.environ)
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+
+
+def _check(db, label: str) -> None:
+    from app.crud import crud
+
+    maintained, counted = crud.get_nas(db), crud.calculate_nas(db)
+    print(f"   • {label}: get_nas={maintained}  calculate_nas={counted}")
+    assert counted is not None and maintained == counted
+
+
+def _worker() -> None:
+    """
+    Subproceso: carga, borra y escribe sobre la base de DATABASE_URL
+    """
+    from sqlalchemy import text
+
+    from app.db.database import init_db, SessionLocal
+    from app.models import models  # noqa: F401  (registra las tablas)
+    from app.crud import crud
+
+    init_db()
+    db = SessionLocal()
+    try:
+        _seed()
+        _check(db, "init_db + seeder")
+        _seed("--truncate", "--seed", "7")
+        _check(db, "seeder --truncate")
+
+        db.execute(text("DELETE FROM action_items WHERE id % 4 = 0"))
+        db.commit()
+        table_total = db.execute(text("SELECT COUNT(*) FROM action_items")).scalar()
+        assert crud.get_action_counts(db)[0] > table_total  # El DELETE no pasó por crud
+        assert crud.reconcile_metric_counters(db)["actions_total"] == table_total
+        _check(db, "DELETE por SQL + reconcile")
+
+        diagnosis_id = db.execute(text("SELECT MIN(id) FROM diagnosis_records")).scalar()
+        action = crud.create_action_item(db, diagnosis_id, "Podar ramas afectadas")
+        crud.update_action_item_status(db, action.id, True)
+        _check(db, "escrituras de crud")
+    finally:
+        db.close()
+
+
+def test_counters_follow_bulk_writes():
+    directory = tempfile.mkdtemp(prefix="kaapeh-counters-")
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/counters.db"),
+        cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    print(output.stdout, end="")
+    assert output.returncode == 0, output.stderr[-2000:]
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+        sys.exit(0)
+    print("🔢 NAS de los contadores contra el de la tabla")
+    test_counters_follow_bulk_writes()
+    print("\n🎉 Los contadores coinciden con la tabla")
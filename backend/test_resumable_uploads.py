@@ -0,0 +1,163 @@
+"""
+Script de prueba para /sync/uploads - Subidas reanudables por chunks
+Simula un dispositivo con un pendiente grande y un enlace que se corta:
+los chunks llegan desordenados y algunos se reenvían. Verifica que:
+
+- cada chunk se guarda en cuanto llega y un reenvío no duplica filas
+- committed_offset / next_chunk solo avanzan sobre chunks sin huecos
+- la sesión se completa cuando llega el último hueco
+- un chunk fuera de rango o con otra cantidad de filas recibe 422
+- una sesión vencida responde 410 y la limpieza la borra (404)
+
+Corre en un subproceso con su propia base SQLite temporal (la configuración
+se lee al importar la app). No necesita el servidor corriendo.
+Ejecutar con: python test_resumable_uploads.py  (o con pytest)
+"""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+TOTAL_ROWS = 1250
+CHUNK_SIZE = 300
+ISSUES = ["Roya del Café", "Broca del Café", "Deficiencia de Nitrógeno (N)", "Planta Saludable"]
+
+
+def _diagnoses(count: int) -> list:
+    rng = random.Random(50)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=10)
+    return [
+        {
+            "timestamp": (start + timedelta(minutes=rng.randint(0, 14000))).isoformat(),
+            "detected_issue": rng.choice(ISSUES),
+            "confidence": round(rng.uniform(0.5, 0.99), 4),
+            "user_feedback_correct": rng.choice([True, False, None]),
+            "location": "Tapachula, Chiapas",
+        }
+        for _ in range(count)
+    ]
+
+
+def _count_rows() -> int:
+    from app.db.database import SessionLocal
+    from app.models.models import DiagnosisRecord
+
+    db = SessionLocal()
+    try:
+        return db.query(DiagnosisRecord).count()
+    finally:
+        db.close()
+
+
+async def _scenario() -> None:
+    import httpx
+
+    from app.main import app
+    from app.db.database import SessionLocal
+    from app.models.models import SyncUpload
+    from app.crud import crud
+    from app.services import sync_codec
+
+    diagnoses = _diagnoses(TOTAL_ROWS)
+    chunk_rows = lambda n: diagnoses[n * CHUNK_SIZE:(n + 1) * CHUNK_SIZE]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        created = await client.post("/api/v1/sync/uploads", json={"total_rows": TOTAL_ROWS, "chunk_size": CHUNK_SIZE})
+        assert created.status_code == 201, created.text
+        session = created.json()
+        upload_id = session["upload_id"]
+        assert session["total_chunks"] == 5 and session["next_chunk"] == 0 and not session["complete"]
+        print(f"📦 Sesión {upload_id[:8]}…: {session['total_chunks']} chunks de {CHUNK_SIZE} filas")
+
+        put = lambda n, body: client.put(f"/api/v1/sync/uploads/{upload_id}/chunks/{n}", json=body)
+
+        # Chunks 0, 2 y 3 llegan; el 1 se pierde en el corte
+        for n in (0, 2, 3):
+            response = await put(n, {"device_id": "dispositivo-1", "diagnoses": chunk_rows(n)})
+            assert response.status_code == 200, response.text
+            assert response.json()["stored"] is True
+        status = (await client.get(f"/api/v1/sync/uploads/{upload_id}")).json()
+        print(f"✂️  Tras el corte: committed_offset={status['committed_offset']}, next_chunk={status['next_chunk']}")
+        assert status["committed_offset"] == CHUNK_SIZE and status["next_chunk"] == 1
+        assert _count_rows() == 3 * CHUNK_SIZE
+
+        # El dispositivo no supo si el 3 llegó y lo reenvía (en MessagePack)
+        response = await client.put(
+            f"/api/v1/sync/uploads/{upload_id}/chunks/3",
+            content=sync_codec.encode(
+                [{**row, "timestamp": datetime.fromisoformat(row["timestamp"])} for row in chunk_rows(3)],
+                device_id="dispositivo-1",
+            ),
+            headers={"Content-Type": sync_codec.MEDIA_TYPES[0]},
+        )
+        assert response.status_code == 200 and response.json()["stored"] is False
+        assert _count_rows() == 3 * CHUNK_SIZE
+
+        # Chunks inválidos
+        assert (await put(5, {"diagnoses": chunk_rows(0)})).status_code == 422
+        assert (await put(4, {"diagnoses": chunk_rows(0)})).status_code == 422
+
+        # Retoma desde next_chunk
+        response = await put(1, {"diagnoses": chunk_rows(1)})
+        assert response.json()["next_chunk"] == 4 and not response.json()["complete"]
+        response = await put(4, {"diagnoses": chunk_rows(4)})
+        final = response.json()
+        print(f"✅ Completa: committed_offset={final['committed_offset']}, filas={_count_rows()}")
+        assert final["complete"] and final["committed_offset"] == TOTAL_ROWS and final["next_chunk"] == 5
+        assert _count_rows() == TOTAL_ROWS
+
+        # Vencimiento y limpieza
+        db = SessionLocal()
+        try:
+            db.query(SyncUpload).filter(SyncUpload.id == upload_id).update(
+                {"expires_at": datetime.utcnow() - timedelta(seconds=1)}
+            )
+            db.commit()
+            assert (await client.get(f"/api/v1/sync/uploads/{upload_id}")).status_code == 410
+            assert crud.purge_expired_uploads(db) == 1
+        finally:
+            db.close()
+        assert (await client.get(f"/api/v1/sync/uploads/{upload_id}")).status_code == 404
+        assert _count_rows() == TOTAL_ROWS
+        print("🧹 Sesión vencida: 410 y luego 404 tras la limpieza; las filas quedan")
+
+        too_big = await client.post("/api/v1/sync/uploads", json={"total_rows": 10 ** 9})
+        assert too_big.status_code == 422
+
+
+def _worker() -> None:
+    """
+    Subproceso: crea las tablas y corre el escenario completo
+    """
+    import asyncio
+
+    from app.db.database import init_db
+    from app.models import models  # noqa: F401  (registra las tablas)
+
+    init_db()
+    asyncio.run(_scenario())
+
+
+def test_resumable_upload_survives_interruptions():
+    directory = tempfile.mkdtemp(prefix="kaapeh-uploads-")
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/uploads.db"),
+        cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    print(output.stdout, end="")
+    assert output.returncode == 0, output.stderr[-2000:]
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+        sys.exit(0)
+    test_resumable_upload_survives_interruptions()
+    print("\n🎉 Subida reanudable sin filas duplicadas ni perdidas")
@@ -0,0 +1,76 @@
+"""
+Script de prueba para seed_synthetic_data.py - Cargas sucesivas
+Corre el generador dos veces sobre la misma base SQLite, sin --truncate, y
+verifica que:
+
+- la segunda carga crea usuarios nuevos (ids después de los existentes)
+- los diagnósticos de cada carga solo apuntan a usuarios de esa carga
+- todo user_id de diagnosis_records existe en users
+- diagnosis_sketches y metric_counters cubren ambas cargas
+
+Usa una base SQLite temporal; no necesita el servidor corriendo.
+Ejecutar con: python test_seed_synthetic_data.py  (o con pytest)
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+USERS = 40
+DIAGNOSES = 3000
+
+
+def _seed(database_url: str, seed: int) -> None:
+    output = subprocess.run(
+        [sys.executable, "seed_synthetic_data.py", "--diagnoses", str(DIAGNOSES), "--users", str(USERS),
+         "--chunk-size", "1000", "--workers", "2", "--seed", str(seed), "--end-date", "2026-01-01"],
+        cwd=str(Path(__file__).parent), capture_output=True, text=True,
+        env=dict(os.environ, DATABASE_URL=database_url)
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+
+
+def test_successive_loads_keep_users_consistent():
+    path = os.path.join(tempfile.mkdtemp(prefix="kaapeh-seed-"), "seed.db")
+    _seed(f"sqlite:///{path}", 1)
+    _seed(f"sqlite:///{path}", 2)
+
+    conn = sqlite3.connect(path)
+    try:
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        assert user_ids == list(range(1, 2 * USERS + 1))
+
+        loads = {}
+        for first, last in ((1, DIAGNOSES), (DIAGNOSES + 1, 2 * DIAGNOSES)):
+            low, high, linked = conn.execute(
+                "SELECT MIN(user_id), MAX(user_id), COUNT(user_id) FROM diagnosis_records WHERE id BETWEEN ? AND ?",
+                (first, last)
+            ).fetchone()
+            loads[first] = (low, high, linked)
+        print(f"👥 user_id por carga (mín, máx, ligados): {list(loads.values())}")
+        (low1, high1, linked1), (low2, high2, linked2) = loads.values()
+        assert linked1 and linked2
+        assert 1 <= low1 <= high1 <= USERS
+        assert USERS < low2 <= high2 <= 2 * USERS
+
+        orphans = conn.execute(
+            "SELECT COUNT(*) FROM diagnosis_records WHERE user_id IS NOT NULL "
+            "AND user_id NOT IN (SELECT id FROM users)"
+        ).fetchone()[0]
+        assert orphans == 0
+
+        sketched = conn.execute("SELECT SUM(diagnoses_count) FROM diagnosis_sketches").fetchone()[0]
+        assert sketched == 2 * DIAGNOSES
+        counters = dict(conn.execute("SELECT name, value FROM metric_counters"))
+        assert counters["actions_total"] == conn.execute("SELECT COUNT(*) FROM action_items").fetchone()[0]
+        print(f"📊 Sketches: {sketched:,} diagnósticos; action items: {counters['actions_total']:,}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    test_successive_loads_keep_users_consistent()
+    print("\n🎉 Cada carga agrega sus propios usuarios y diagnósticos")
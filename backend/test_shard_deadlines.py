@@ -0,0 +1,131 @@
+"""
+Script de prueba para los plazos de consulta con shards regionales
+Corre ``shard_router.scatter`` sobre la sesión que abre ``read_db_with_deadline`` con
+dos shards SQLite y verifica que:
+
+- al cancelar el plazo (cliente desconectado o presupuesto agotado, como lo
+  hace el vigilante) se interrumpe la consulta que corre en un shard y el
+  scatter termina con QueryCancelledError, no con ShardUnavailableError
+- si el presupuesto se acaba mientras se esperan los shards, el propio
+  scatter interrumpe los que siguen corriendo
+- las cancelaciones de los shards se cuentan por ruta
+- las conexiones vuelven al pool sin el plazo y el siguiente scatter funciona
+
+Corre en un subproceso (la configuración de shards se lee al importar la app).
+No necesita el servidor corriendo.
+Ejecutar con: python test_shard_deadlines.py  (o con pytest)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+# Cuenta hasta mil millones: varios minutos en SQLite si nadie la interrumpe
+SLOW_QUERY = (
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT 1000000000) "
+    "SELECT COUNT(*) FROM c"
+)
+
+
+def _worker() -> None:
+    """
+    Subproceso: cancela scatters en curso y vuelca lo observado como JSON
+    """
+    import threading
+    import time
+
+    from sqlalchemy import text
+
+    from app.db.database import init_db
+    from app.db.shards import shard_router
+    from app.db import deadlines
+    from app.core.telemetry import query_cancellations_total
+    from app.models import models  # noqa: F401  (registra las tablas)
+
+    init_db()
+    shard_router.create_tables()
+    results = {}
+
+    def slow_on_oaxaca(session, shard):
+        return session.execute(text(SLOW_QUERY if shard == "oaxaca" else "SELECT 1")).scalar()
+
+    # 1. El plazo se cancela mientras la consulta corre en el shard
+    db, conn, deadline = deadlines._open("shard-test", 30.0)
+    threading.Timer(0.3, deadline.cancel, (deadlines.DISCONNECT,)).start()
+    started = time.monotonic()
+    try:
+        shard_router.scatter(db, slow_on_oaxaca, lambda session: 1)
+        results["running"] = "completed"
+    except Exception as e:
+        results["running"] = type(e).__name__
+    results["running_seconds"] = round(time.monotonic() - started, 2)
+    deadlines._close(db, conn, deadline)
+
+    # 2. El presupuesto se acaba mientras la principal todavía trabaja
+    db, conn, deadline = deadlines._open("shard-test", 0.2)
+    try:
+        shard_router.scatter(db, slow_on_oaxaca, lambda session: time.sleep(0.4))
+        results["expired"] = "completed"
+    except Exception as e:
+        results["expired"] = type(e).__name__
+    deadlines._close(db, conn, deadline)
+
+    results["cancellations"] = query_cancellations_total.render()
+
+    # 3. Sin plazo y con las conexiones ya devueltas al pool, todo responde
+    db, conn, deadline = deadlines._open("shard-test", 30.0)
+    try:
+        results["after"] = shard_router.scatter(db, lambda session, _: session.execute(text("SELECT 1")).scalar())
+        results["leftover"] = [
+            engine.pool.checkedout() for engine in shard_router.engines
+        ]
+    finally:
+        deadlines._close(db, conn, deadline)
+
+    print(json.dumps(results))
+
+
+def test_shard_queries_follow_the_route_deadline():
+    directory = tempfile.mkdtemp(prefix="kaapeh-shard-deadlines-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{directory}/primary.db",
+        SHARD_DATABASE_URLS=json.dumps({
+            "oaxaca": f"sqlite:///{directory}/oaxaca.db",
+            "veracruz": f"sqlite:///{directory}/veracruz.db",
+        }),
+        SHARD_REGIONS=json.dumps({"Oaxaca": "oaxaca", "Veracruz": "veracruz"}),
+    )
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=env, cwd=str(Path(__file__).parent), capture_output=True, text=True, timeout=120
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+    results = json.loads(output.stdout.strip().splitlines()[-1])
+
+    print(f"✂️  Consulta en curso en el shard: {results['running']} tras {results['running_seconds']} s")
+    assert results["running"] == "QueryCancelledError" and results["running_seconds"] < 5
+    print(f"⏱️  Presupuesto agotado esperando a los shards: {results['expired']}")
+    assert results["expired"] == "QueryCancelledError"
+
+    cancellations = "\n".join(results["cancellations"])
+    print(f"📈 {cancellations}")
+    assert 'route="shard-test",reason="disconnect"' in cancellations
+    assert 'route="shard-test",reason="deadline"' in cancellations
+
+    assert results["after"] == {"primary": 1, "oaxaca": 1, "veracruz": 1}
+    assert results["leftover"] == [0, 0]
+    print("✅ Las conexiones de los shards vuelven al pool sin el plazo")
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+    else:
+        test_shard_queries_follow_the_route_deadline()
+        print("\n🎉 Los shards respetan el plazo de la ruta")
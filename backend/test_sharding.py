@@ -0,0 +1,174 @@
+"""
+Script de prueba para los shards regionales - Scatter-gather
+Sincroniza el mismo lote de diagnósticos en una sola base y en tres bases
+SQLite (principal + Oaxaca + Veracruz) y verifica que /metrics, /categories y
+/analytics/* responden lo mismo en ambos casos.
+
+Cada configuración corre en un subproceso (la configuración de shards se lee
+al importar la app). No necesita el servidor corriendo.
+Ejecutar con: python test_sharding.py  (o con pytest)
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+LOCATIONS = [
+    "Tapachula, Chiapas", "Pluma Hidalgo, Oaxaca", "Juquila, Oaxaca",
+    "Coatepec, Veracruz", "Huehuetenango, Guatemala", None,
+]
+ISSUES = ["Roya del Café", "Broca del Café", "Deficiencia de Nitrógeno (N)", "Planta Sana", "Araña Roja"]
+
+ENDPOINTS = [
+    "/api/v1/metrics",
+    "/api/v1/categories",
+    "/api/v1/analytics/frequent-issues?limit=50",
+    "/api/v1/analytics/heatmap",
+    "/api/v1/analytics/trends?days=30",
+    "/api/v1/analytics/feedback-analysis",
+    "/api/v1/analytics/calibration?min_count=1",
+    # Filtros de /analytics en cada shard
+    "/api/v1/analytics/frequent-issues?category=Plagas&location_prefix=Juquila",
+    "/api/v1/analytics/heatmap?issue=Roya del Café&issue=Araña Roja&min_confidence=0.7",
+    "/api/v1/analytics/trends?days=30&max_confidence=0.8",
+    "/api/v1/analytics/feedback-analysis?location_prefix=Coatepec",
+    "/api/v1/analytics/calibration?min_count=1&category=Enfermedades",
+]
+
+
+def _batches():
+    """
+    Lotes deterministas; el último lo envía una cooperativa asignada a Oaxaca
+    """
+    rng = random.Random(7)
+    start = datetime.utcnow() - timedelta(days=20)
+    batches = []
+    for index in range(4):
+        diagnoses = [
+            {
+                "timestamp": (start + timedelta(hours=rng.randint(0, 480))).isoformat(),
+                "detected_issue": rng.choice(ISSUES),
+                "confidence": round(rng.uniform(0.5, 0.99), 4),
+                "user_feedback_correct": rng.choice([True, False, None]),
+                "location": rng.choice(LOCATIONS),
+            }
+            for _ in range(60)
+        ]
+        batches.append({
+            "diagnoses": diagnoses,
+            "device_id": f"dev-{index}",
+            "cooperative_id": "coop-oax-01" if index == 3 else None,
+        })
+    return batches
+
+
+def _normalize(path: str, body: dict):
+    """
+    Drop fields that legitimately differ between runs (timestamps of the response)
+    """
+    body.pop("timestamp", None)
+    if "frequent-issues" in path:
+        body["issues"] = sorted(body["issues"], key=lambda x: x["issue"])
+    if "feedback-analysis" in path:
+        body["issues_with_most_errors"] = sorted(body["issues_with_most_errors"], key=lambda x: x["issue"])
+    if "heatmap" in path:
+        body["locations"] = sorted(body["locations"], key=lambda x: x["location"])
+    return body
+
+
+def _worker() -> None:
+    """
+    Subproceso: crea las tablas, sincroniza los lotes y vuelca las respuestas como JSON
+    """
+    import asyncio
+    import httpx
+
+    from app.main import app
+    from app.db.database import init_db, SessionLocal
+    from app.core.security import create_access_token
+    from app.crud import crud
+
+    init_db()
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": "1", "role": "Técnico"})}
+
+    async def requests() -> dict:
+        results = {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            for batch in _batches():
+                response = await client.post("/api/v1/sync", json=batch)
+                assert response.status_code == 200, response.text
+
+            # El snapshot incremental también debe cubrir los shards
+            db = SessionLocal()
+            try:
+                snapshot = crud.create_metrics_snapshot(db)
+                results["snapshot"] = {"total_diagnoses": snapshot.total_diagnoses, "tpp": snapshot.tpp, "cpm": snapshot.cpm}
+            finally:
+                db.close()
+
+            for path in ENDPOINTS:
+                response = await client.get(path, headers=headers)
+                assert response.status_code == 200, f"{path}: {response.status_code} {response.text}"
+                results[path] = _normalize(path, response.json())
+        return results
+
+    print(json.dumps(asyncio.run(requests())))
+
+
+def _run_config(directory: str, sharded: bool) -> dict:
+    name = "sharded" if sharded else "single"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/{name}-primary.db")
+    if sharded:
+        env["SHARD_DATABASE_URLS"] = json.dumps({
+            "oaxaca": f"sqlite:///{directory}/{name}-oaxaca.db",
+            "veracruz": f"sqlite:///{directory}/{name}-veracruz.db",
+        })
+        env["SHARD_REGIONS"] = json.dumps({"Oaxaca": "oaxaca", "Veracruz": "veracruz"})
+        env["SHARD_COOPERATIVES"] = json.dumps({"coop-oax-01": "oaxaca"})
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=env, cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def _shard_counts(directory: str) -> dict:
+    import sqlite3
+    counts = {}
+    for shard in ("primary", "oaxaca", "veracruz"):
+        conn = sqlite3.connect(f"{directory}/sharded-{shard}.db")
+        counts[shard] = conn.execute("SELECT COUNT(*) FROM diagnosis_records").fetchone()[0]
+        conn.close()
+    return counts
+
+
+def test_sharded_results_match_single_database():
+    directory = tempfile.mkdtemp(prefix="kaapeh-shards-")
+    single = _run_config(directory, sharded=False)
+    sharded = _run_config(directory, sharded=True)
+
+    counts = _shard_counts(directory)
+    print(f"📦 Filas por base: {counts}")
+    assert counts["oaxaca"] > 0 and counts["veracruz"] > 0
+    assert sum(counts.values()) == single["/api/v1/metrics"]["total_diagnoses"]
+
+    for key in single:
+        assert json.dumps(single[key], sort_keys=True) == json.dumps(sharded[key], sort_keys=True), \
+            f"{key} difiere:\n  una base: {single[key]}\n  shards:   {sharded[key]}"
+        print(f"✅ {key}")
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+    else:
+        test_sharded_results_match_single_database()
+        print("\n🎉 Los resultados con shards coinciden con los de una sola base")
@@ -0,0 +1,159 @@
+"""
+Script de prueba para /sync/changes - Descarga de cambios por cursor
+Dos productores con perfil, configuración de accesibilidad y action items.
+Verifica que:
+
+- sin token se responde 401; un dispositivo solo puede pedir sus propios
+  cambios (403 con otro user_id o sin user_id); un técnico puede pedir todos
+- el cursor avanza estrictamente al paginar y una llamada al día no trae nada
+- cada dispositivo recibe sus entidades y ninguna del otro usuario
+- un action item borrado llega como ``deleted`` y sale de ``rows``
+
+Corre en un subproceso con su propia base SQLite temporal (la configuración
+se lee al importar la app). No necesita el servidor corriendo.
+Ejecutar con: python test_sync_changes.py  (o con pytest)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+
+async def _download(client, token: str, user_id=None, since: int = 0, limit: int = 500) -> tuple:
+    """
+    Follow has_more from ``since``; returns (final cursor, cursors seen, merged changes)
+    """
+    params = {"since": since, "limit": limit}
+    if user_id is not None:
+        params["user_id"] = user_id
+    cursors, merged = [], {}
+    while True:
+        response = await client.get("/api/v1/sync/changes", params=params, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        cursors.append(body["cursor"])
+        for entity, change in body["changes"].items():
+            target = merged.setdefault(entity, {"rows": {}, "deleted": set()})
+            for row in change["rows"]:
+                target["rows"][row[0]] = row
+                target["deleted"].discard(row[0])
+            for entity_id in change["deleted"]:
+                target["rows"].pop(entity_id, None)
+                target["deleted"].add(entity_id)
+        if not body["has_more"]:
+            return body["cursor"], cursors, merged
+        params["since"] = body["cursor"]
+
+
+async def _scenario() -> None:
+    import httpx
+
+    from app.main import app
+    from app.db.database import SessionLocal
+    from app.models.models import ActionItem
+    from app.crud import crud
+    from app.core.security import create_access_token
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        users = {}
+        for username in ("ana", "beto"):
+            response = await client.post("/api/v1/auth/login", json={"username": username})
+            assert response.status_code == 200 and response.json()["token"], response.text
+            users[username] = response.json()
+
+        db = SessionLocal()
+        try:
+            actions = {}
+            for username, user in users.items():
+                crud.update_accessibility_config(db, user["user_id"], {"large_text_enabled": True})
+                diagnosis = crud.create_diagnosis(db, user["user_id"], {"detected_issue": "Roya del Café", "confidence": 0.9})
+                response = await client.post(
+                    f"/api/v1/diagnoses/{diagnosis.id}/action-items",
+                    json={"items": [{"description_text": f"Acción {i} de {username}"} for i in range(3)]},
+                )
+                assert response.status_code == 201, response.text
+                actions[username] = [item["id"] for item in response.json()]
+        finally:
+            db.close()
+
+        ana, beto = users["ana"], users["beto"]
+        get = lambda params, token=None: client.get(
+            "/api/v1/sync/changes", params=params,
+            headers={"Authorization": f"Bearer {token}"} if token else {},
+        )
+        assert (await get({"user_id": ana["user_id"]})).status_code == 401
+        assert (await get({"user_id": beto["user_id"]}, ana["token"])).status_code == 403
+        assert (await get({}, ana["token"])).status_code == 403
+        print("🔒 Sin token 401; otro usuario o log completo con token de productor 403")
+
+        cursor, cursors, changes = await _download(client, ana["token"], ana["user_id"], limit=2)
+        print(f"📥 Ana en lotes de 2: cursores {cursors}")
+        assert cursors == sorted(set(cursors)) and len(cursors) > 1, cursors
+        assert set(changes["user"]["rows"]) == {ana["user_id"]}
+        assert [row[1] for row in changes["accessibility_config"]["rows"].values()] == [ana["user_id"]]
+        assert sorted(changes["action_item"]["rows"]) == actions["ana"]
+        again = await _download(client, ana["token"], ana["user_id"], since=cursor)
+        assert again[0] == cursor and again[2] == {}
+
+        # Ana completa una acción y borra otra; Beto también cambia algo
+        db = SessionLocal()
+        try:
+            crud.update_action_item_status(db, actions["ana"][0], True)
+            db.delete(db.get(ActionItem, actions["ana"][1]))
+            db.commit()
+            crud.update_action_item_status(db, actions["beto"][0], True)
+        finally:
+            db.close()
+
+        new_cursor, _, delta = await _download(client, ana["token"], ana["user_id"], since=cursor)
+        print(f"🔁 Delta de Ana desde {cursor}: {delta}")
+        assert new_cursor > cursor
+        assert set(delta) == {"action_item"}
+        assert list(delta["action_item"]["rows"]) == [actions["ana"][0]]
+        assert delta["action_item"]["rows"][actions["ana"][0]][3] is True
+        assert delta["action_item"]["deleted"] == {actions["ana"][1]}
+
+        technician = create_access_token({"sub": "0", "role": "Técnico"})
+        _, _, everything = await _download(client, technician)
+        assert sorted(everything["action_item"]["rows"]) == sorted(
+            set(actions["ana"] + actions["beto"]) - {actions["ana"][1]}
+        )
+        assert everything["action_item"]["deleted"] == {actions["ana"][1]}
+        assert (await get({"user_id": beto["user_id"]}, technician)).status_code == 200
+        print("🧑‍🔧 El técnico ve el log completo de ambos usuarios")
+
+
+def _worker() -> None:
+    """
+    Subproceso: crea las tablas y corre el escenario completo
+    """
+    import asyncio
+
+    from app.db.database import init_db
+    from app.models import models  # noqa: F401  (registra las tablas)
+
+    init_db()
+    asyncio.run(_scenario())
+
+
+def test_sync_changes_cursor_and_access():
+    directory = tempfile.mkdtemp(prefix="kaapeh-changes-")
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/changes.db"),
+        cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    print(output.stdout, end="")
+    assert output.returncode == 0, output.stderr[-2000:]
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+        sys.exit(0)
+    test_sync_changes_cursor_and_access()
+    print("\n🎉 Cada dispositivo descarga solo sus cambios, en orden y con bajas")
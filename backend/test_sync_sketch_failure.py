@@ -0,0 +1,120 @@
+"""
+Script de prueba para /sync - Sketches que fallan después de confirmar
+Hace fallar la actualización de los sketches semanales (como un choque de
+llaves en el último intento o un "database is locked" de SQLite) y verifica que:
+
+- /sync responde 200 y el lote queda guardado exactamente una vez
+- la falla se cuenta en kaapeh_sketch_update_failures_total
+- el siguiente lote actualiza los sketches normalmente
+
+Corre en un subproceso con su propia base SQLite temporal (la configuración
+se lee al importar la app). No necesita el servidor corriendo.
+Ejecutar con: python test_sync_sketch_failure.py  (o con pytest)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+BATCH = 25
+
+
+def _batch(device_id: str) -> dict:
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=2)
+    return {
+        "device_id": device_id,
+        "diagnoses": [
+            {
+                "timestamp": (start + timedelta(minutes=7 * i)).isoformat(),
+                "detected_issue": "Roya del Café",
+                "confidence": 0.8,
+                "location": "Tapachula, Chiapas",
+            }
+            for i in range(BATCH)
+        ],
+    }
+
+
+def _worker() -> None:
+    """
+    Subproceso: sincroniza con los sketches rotos y luego sanos; vuelca lo observado como JSON
+    """
+    import asyncio
+    import httpx
+    from sqlalchemy import func
+    from sqlalchemy.exc import OperationalError
+
+    from app.main import app
+    from app.db.database import init_db, SessionLocal
+    from app.models.models import DiagnosisRecord, DiagnosisSketch
+    from app.core.telemetry import sketch_update_failures_total
+    from app.crud import crud
+
+    init_db()
+    update_sketches = crud.update_diagnosis_sketches
+
+    def broken(db, rows, attempts=2):
+        list(rows)
+        raise OperationalError("UPDATE diagnosis_sketches", {}, Exception("database is locked"))
+
+    def counts() -> dict:
+        db = SessionLocal()
+        try:
+            return {
+                "diagnoses": db.query(func.count(DiagnosisRecord.id)).scalar(),
+                "sketched": db.query(func.coalesce(func.sum(DiagnosisSketch.diagnoses_count), 0)).scalar(),
+            }
+        finally:
+            db.close()
+
+    async def requests() -> dict:
+        results = {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            crud.update_diagnosis_sketches = broken
+            try:
+                response = await client.post("/api/v1/sync", json=_batch("dev-1"))
+            finally:
+                crud.update_diagnosis_sketches = update_sketches
+            results["broken"] = {"status": response.status_code, "body": response.json(), **counts()}
+            results["failures"] = "kaapeh_sketch_update_failures_total 1" in sketch_update_failures_total.render()
+
+            response = await client.post("/api/v1/sync", json=_batch("dev-2"))
+            results["healthy"] = {"status": response.status_code, "body": response.json(), **counts()}
+        return results
+
+    print(json.dumps(asyncio.run(requests())))
+
+
+def test_sync_survives_sketch_failure():
+    directory = tempfile.mkdtemp(prefix="kaapeh-sketch-failure-")
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/sync.db"),
+        cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+    results = json.loads(output.stdout.strip().splitlines()[-1])
+
+    broken, healthy = results["broken"], results["healthy"]
+    print(f"💥 Con sketches rotos: {broken}")
+    assert broken["status"] == 200 and broken["body"]["synced_count"] == BATCH
+    assert broken["diagnoses"] == BATCH and broken["sketched"] == 0
+    assert results["failures"]
+
+    print(f"✅ Con sketches sanos: {healthy}")
+    assert healthy["status"] == 200
+    assert healthy["diagnoses"] == 2 * BATCH and healthy["sketched"] == BATCH
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _worker()
+    else:
+        test_sync_survives_sketch_failure()
+        print("\n🎉 Una falla de los sketches no hace reenviar el lote")
@@ -0,0 +1,148 @@
+"""
+Script de prueba para la capa de escritura - Round trips por operación
+Cuenta las sentencias enviadas a la base de datos (incluido el COMMIT) por cada
+escritura de crud y falla si alguna supera su presupuesto.
+
+Las escrituras corren en un subproceso con su propia base SQLite temporal (la
+configuración se lee al importar la app). No necesita el servidor corriendo.
+Ejecutar con: python test_write_roundtrips.py  (o con pytest)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+# Operación -> máximo de round trips (sentencias + COMMIT)
+# En PostgreSQL las escrituras con change log suman el advisory lock del log y
+# las inserciones de diagnósticos el de ingesta (INGEST_LOCK_KEY).
+PRESUPUESTO = {
+    "create_user": 3,                  # INSERT ... RETURNING, change log, COMMIT
+    "login_user (nuevo)": 3,           # upsert RETURNING, change log, COMMIT
+    "login_user (existente)": 2,       # upsert RETURNING, COMMIT
+    "update_user_last_login": 2,       # UPDATE ... RETURNING, COMMIT
+    "create_diagnosis": 2,             # INSERT ... RETURNING, COMMIT
+    "get_or_create_accessibility_config": 4,  # SELECT, INSERT ... RETURNING, change log, COMMIT
+    "update_accessibility_config": 3,  # upsert RETURNING, change log, COMMIT
+    "create_action_item": 4,           # INSERT ... RETURNING, contador NAS, change log, COMMIT
+    "update_action_item_status": 4,    # UPDATE ... RETURNING, contador NAS, change log, COMMIT
+}
+
+
+class RoundTripCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.split("\n")[0][:80])
+
+    def _on_commit(self, conn):
+        self.statements.append("COMMIT")
+
+    @contextmanager
+    def measure(self, operation, results):
+        self.statements = []
+        yield
+        results[operation] = list(self.statements)
+
+
+def _run_operations():
+    """
+    Subproceso: corre cada escritura y vuelca sus sentencias como JSON
+    """
+    from app.db.database import engine, init_db, SessionLocal
+    from app.models import models  # noqa: F401  (registra las tablas)
+    from app.models.models import ChangeLogEntry
+    from app.crud import crud
+    from app.schemas.schemas import UserCreate
+
+    init_db()
+    counter = RoundTripCounter(engine)
+    results = {}
+    db = SessionLocal()
+    db.connection()  # Igual que get_db: la conexión ya está tomada
+    try:
+        with counter.measure("create_user", results):
+            user = crud.create_user(db, UserCreate(username="ana@dev-1", device_id="dev-1"))
+        with counter.measure("login_user (nuevo)", results):
+            other, created = crud.login_user(db, UserCreate(username="beto@dev-2"))
+        assert created
+        with counter.measure("login_user (existente)", results):
+            same, created = crud.login_user(db, UserCreate(username="beto@dev-2"))
+        assert not created and same.id == other.id
+        with counter.measure("update_user_last_login", results):
+            crud.update_user_last_login(db, user)
+        with counter.measure("create_diagnosis", results):
+            diagnosis = crud.create_diagnosis(db, user.id, {"detected_issue": "Roya del Café", "confidence": 0.9})
+        with counter.measure("get_or_create_accessibility_config", results):
+            crud.get_or_create_accessibility_config(db, user.id)
+        with counter.measure("update_accessibility_config", results):
+            config = crud.update_accessibility_config(db, other.id, {"large_text_enabled": True})
+        with counter.measure("create_action_item", results):
+            action = crud.create_action_item(db, diagnosis.id, "Aplicar fungicida")
+        with counter.measure("update_action_item_status", results):
+            action = crud.update_action_item_status(db, action.id, True)
+
+        # Lo devuelto por RETURNING ya es el estado guardado
+        assert diagnosis.id and diagnosis.detected_issue == "Roya del Café"
+        assert config.large_text_enabled and config.user_id == other.id
+        assert action.is_completed
+        assert crud.create_user(db, UserCreate(username="ana@dev-1")) is None
+        assert crud.get_nas(db) == 100.0
+
+        logged = {(e.entity, e.user_id) for e in db.query(ChangeLogEntry).all()}
+        assert ("action_item", user.id) in logged
+        assert ("accessibility_config", other.id) in logged
+    finally:
+        db.close()
+    print(json.dumps(results))
+
+
+def test_write_roundtrips():
+    """
+    Prueba: cada escritura cabe en su presupuesto de round trips
+    """
+    print("\n" + "="*60)
+    print("PRUEBA: Round trips por escritura")
+    print("="*60)
+
+    directory = tempfile.mkdtemp(prefix="kaapeh-roundtrips-")
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=dict(os.environ, DATABASE_URL=f"sqlite:///{directory}/roundtrips.db"),
+        cwd=str(Path(__file__).parent), capture_output=True, text=True
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+    results = json.loads(output.stdout.strip().splitlines()[-1])
+    excedidas = []
+    for operation, statements in results.items():
+        budget = PRESUPUESTO[operation]
+        ok = len(statements) <= budget
+        print(f"{'✅' if ok else '❌'} {operation}: {len(statements)} (máx {budget})")
+        for statement in statements:
+            print(f"      {statement}")
+        if not ok:
+            excedidas.append(operation)
+
+    assert not excedidas, f"Operaciones sobre presupuesto: {excedidas}"
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        _run_operations()
+        sys.exit(0)
+    try:
+        test_write_roundtrips()
+        print("\n✅ Todas las escrituras dentro del presupuesto")
+    except AssertionError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)